@@ -140,6 +140,19 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+# policy snapshots and their stamps (engine/snapshots.py) must be shared by every
+# web and worker process, a per-process cache (locmem) leaves each process with
+# its own stamps that other processes' changes never bump
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+        "LOCATION": SECURE_SETTINGS.get("cache_location", "127.0.0.1:11211"),
+    }
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
 
@@ -223,6 +236,24 @@ QUALTRICS_API_URL = "https://survey.qualtrics.com/WRAPI/ControlPanel/api.php"
 QUALTRICS_TEMPLATE_NAME = "MOOClet_template.qsf"
 QSF_ROOT = normpath(join(SITE_ROOT, "static/qsf"))
 
+# How thompson sampling probabilities are computed: "quadrature" or "monte_carlo"
+MOOCLET_PROBABILITY_METHOD = "quadrature"
+# Largest absolute error allowed when integrating thompson sampling probabilities
+MOOCLET_PROBABILITY_TOLERANCE = 1e-4
+# Largest standard error allowed when simulating thompson sampling probabilities
+MOOCLET_SIMULATION_STANDARD_ERROR = 0.005
+# Seconds a recompute request waits, so requests for the same mooclet are merged
+MOOCLET_RECOMPUTE_DEBOUNCE = 30
+# Seconds a worker holds the recompute requests it claimed, after which they are due
+# again (e.g. the worker died), and the first delay before a failed one is retried
+MOOCLET_RECOMPUTE_LEASE = 600
+MOOCLET_RECOMPUTE_RETRY_DELAY = 60
+# Seconds a cached policy snapshot is kept, bounds staleness with a per-process cache
+MOOCLET_SNAPSHOT_TIMEOUT = 60
+# Rows each counter (e.g. answer_choice_count) is spread over, so concurrent
+# increments of one counter rarely wait on the same row lock
+MOOCLET_COUNTER_SHARDS = 8
+
 
 #### DJANGO REST FRAMEWORK SETTINGS ####
 
@@ -0,0 +1,6 @@
+from .base import *
+
+# settings for manage.py benchmark_policies
+# the benchmarks build their synthetic mooclets in a throwaway in-memory SQLite db
+DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}}
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
@@ -16,6 +16,9 @@ DATABASES = {
     }
 }
 
+# a single development server process, no memcached needed
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
 # For Django Debug Toolbar:
 INTERNAL_IPS = (
     "127.0.0.1",
@@ -1,3 +1,178 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.urls import reverse
+from engine.models import (
+    Answer,
+    Counter,
+    Explanation,
+    Mooclet,
+    Policy,
+    Question,
+    Value,
+    ValueSummary,
+    Variable,
+    Version,
+)
+from engine.tests import EngineTestCase
+
+
+class SubmitValueTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="student")
+        cls.version_content_type = ContentType.objects.get_for_model(Version)
+
+    def submit(self, **params):
+        params.update(token="jjw", user_id=self.user.pk)
+        return self.client.get(reverse("api:submit_user_variable"), params)
+
+    def test_variable_without_content_type(self):
+        # variables of the same name with a content type are not the one submitted to
+        version_grade = Variable.objects.create(
+            name="prior_grade",
+            content_type=self.version_content_type,
+            is_user_variable=True,
+        )
+        response = self.submit(prior_grade="0.5")
+        self.assertEqual(response.status_code, 200)
+        value = Value.objects.get(user=self.user)
+        self.assertNotEqual(value.variable, version_grade)
+        self.assertIsNone(value.variable.content_type)
+        self.assertTrue(value.variable.is_user_variable)
+
+        Variable.objects.create(
+            name="prior_grade",
+            content_type=ContentType.objects.get_for_model(User),
+            is_user_variable=True,
+        )
+        response = self.submit(prior_grade="0.7")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(
+                Value.objects.filter(user=self.user)
+                .order_by("id")
+                .values_list("variable", "value")
+            ),
+            [(value.variable.pk, 0.5), (value.variable.pk, 0.7)],
+        )
+
+    def test_value_saved_with_its_summary(self):
+        mooclet = Mooclet.objects.create(
+            policy=Policy.objects.create(name="thompson_sampling")
+        )
+        version = Explanation.objects.create(mooclet=mooclet, text="e")
+        Variable.objects.create(
+            name="student_rating",
+            content_type=self.version_content_type,
+            is_user_variable=True,
+        )
+        params = {"content_type": "version", "object_id": version.pk}
+        with mock.patch.object(
+            ValueSummary.objects, "record_value", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                self.submit(student_rating="8", **params)
+        self.assertFalse(Value.objects.filter(user=self.user).exists())
+
+        response = self.submit(student_rating="8", prior_grade="high", **params)
+        self.assertEqual(response.json()["message"], "1 variables could not be saved")
+        self.assertEqual(
+            ValueSummary.objects.get_summary(
+                Variable.objects.get_cached("student_rating"), version.pk
+            ).count,
+            1,
+        )
+
+
+class BatchAssignmentTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="student")
+        cls.mooclet = Mooclet.objects.create(
+            policy=Policy.objects.create(name="uniform_random")
+        )
+        cls.explanation = Explanation.objects.create(mooclet=cls.mooclet, text="e")
+        cls.question = Question.objects.create(name="q", text="q")
+        # an answer with explanations, one without a mooclet and one whose mooclet
+        # has no versions
+        cls.answers = [
+            Answer.objects.create(
+                question=cls.question,
+                text="a",
+                correct=True,
+                mooclet_explanation=cls.mooclet,
+            ),
+            Answer.objects.create(question=cls.question, text="b", correct=False),
+            Answer.objects.create(
+                question=cls.question,
+                text="c",
+                correct=False,
+                mooclet_explanation=Mooclet.objects.create(policy=cls.mooclet.policy),
+            ),
+        ]
+
+    def post(self, body):
+        return self.client.post(
+            reverse("api:get_explanations_for_students"),
+            body if isinstance(body, str) else json.dumps(body),
+            content_type="application/json",
+        )
+
+    def test_assignments(self):
+        response = self.post(
+            [
+                {"question_id": self.question.pk, "answer_choice": choice}
+                for choice in (1, 2, 3)
+            ]
+            + [
+                {
+                    "question_id": self.question.pk,
+                    "answer_choice": 1,
+                    "user_id": self.user.pk,
+                }
+            ]
+        )
+        self.assertEqual(response.status_code, 200)
+        assignment = {
+            "explanation_id": self.explanation.pk,
+            "version_id": self.explanation.pk,
+            "text": "e",
+        }
+        self.assertEqual(
+            response.json()["assignments"], [assignment, None, None, assignment]
+        )
+        self.assertEqual(
+            Counter.objects.get_count(
+                Variable.objects.get(name="answer_choice_count"), self.answers[0].pk
+            ),
+            2.0,
+        )
+
+    def test_bad_input(self):
+        for body in (
+            "not json",
+            {"question_id": self.question.pk, "answer_choice": 1},
+            ["not an object"],
+            [{"question_id": self.question.pk}],
+            [{"question_id": "a", "answer_choice": 1}],
+            [{"question_id": self.question.pk, "answer_choice": [1]}],
+            [{"question_id": self.question.pk, "answer_choice": 1, "user_id": "a"}],
+        ):
+            response = self.post(body)
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn("message", response.json())
+
+    def test_not_found(self):
+        for item in (
+            {"question_id": self.question.pk, "answer_choice": 4},
+            {"question_id": self.question.pk + 1, "answer_choice": 1},
+            {
+                "question_id": self.question.pk,
+                "answer_choice": 1,
+                "user_id": self.user.pk + 1,
+            },
+        ):
+            self.assertEqual(self.post([item]).status_code, 404, item)
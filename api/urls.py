@@ -19,6 +19,11 @@ urlpatterns = [
         views.get_explanation_for_student,
         name="get_explanation_for_student",
     ),
+    url(
+        r"^get_explanations_for_students$",
+        views.get_explanations_for_students,
+        name="get_explanations_for_students",
+    ),
     url(
         r"^submit_result_of_explanation$",
         views.submit_result_of_explanation,
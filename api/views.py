@@ -1,13 +1,13 @@
 import json
 
 from django.core import serializers
+from django.db import transaction
 from django.db.models import Avg
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import get_list_or_404, get_object_or_404
 from engine import utils
 from engine.models import *
 from ltilib.utils import grade_passback
-from numpy import std
 from rest_framework import viewsets
 
 from api.serializers import *
@@ -122,21 +122,10 @@ def get_explanation_for_student(request):
 
     # update count of answers
     answer_content_type = ContentType.objects.get_for_model(Answer)
-    answer_choice_count, created = Variable.objects.get_or_create(
-        name="answer_choice_count",
-        display_name="Count",
-        content_type=answer_content_type,
+    answer_choice_count, created = Variable.objects.get_or_create_cached(
+        "answer_choice_count", answer_content_type, display_name="Count"
     )
-    value = answer_choice_count.get_data(
-        {"question": question, "answer": answer}
-    ).last()
-    if not value:
-        value = Value.objects.create(
-            variable=answer_choice_count, object_id=answer.pk, value=1.0
-        )
-    else:
-        value.value += 1.0
-    value.save()
+    Counter.objects.increment(answer_choice_count, answer.pk)
 
     return JsonResponse(
         {
@@ -147,6 +136,127 @@ def get_explanation_for_student(request):
     )
 
 
+def get_explanations_for_students(request):
+    """
+    Batch version of get_explanation_for_student, for pre-assigning a cohort.
+    Each mooclet's policy runs once over all of its assignments.
+
+    INPUT (POST body, JSON): list of {question_id, answer_choice, user_id (optional)}
+    OUTPUT: assignments, list of {explanation_id, version_id, text} in input order,
+        null for answers without an explanation mooclet or versions
+    """
+    try:
+        requested = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"message": "request body is not valid JSON"}, status=400)
+    if not isinstance(requested, list):
+        return JsonResponse(
+            {"message": "request body must be a list of assignments"}, status=400
+        )
+    # (question id, answer choice, user id or None) of each requested assignment
+    items = []
+    for position, item in enumerate(requested):
+        if not isinstance(item, dict):
+            return JsonResponse(
+                {"message": "assignment {} is not an object".format(position)},
+                status=400,
+            )
+        for param in ["question_id", "answer_choice"]:
+            if param not in item:
+                message = "Required parameter {} not found in assignment {}"
+                return JsonResponse(
+                    {"message": message.format(param, position)}, status=400
+                )
+        try:
+            items.append(
+                (
+                    int(item["question_id"]),
+                    int(item["answer_choice"]),
+                    int(item["user_id"]) if item.get("user_id") is not None else None,
+                )
+            )
+        except (TypeError, ValueError):
+            return JsonResponse(
+                {"message": "assignment {} has a non-integer id".format(position)},
+                status=400,
+            )
+
+    question_ids = {question_id for question_id, answer_choice, user_id in items}
+    user_ids = {user_id for question_id, answer_choice, user_id in items} - {None}
+    users = User.objects.in_bulk(user_ids)
+    if len(users) < len(user_ids):
+        raise Http404("User not found")
+
+    # answers of every requested question, in answer choice order
+    question_answers = {question_id: [] for question_id in question_ids}
+    answers = (
+        Answer.objects.filter(question_id__in=question_ids)
+        .select_related("mooclet_explanation")
+        .order_by("question_id", "_order")
+    )
+    for answer in answers:
+        question_answers[answer.question_id].append(answer)
+
+    # group requests by explanation mooclet, answer_choice is 1-indexed
+    mooclet_requests = {}
+    for position, (question_id, answer_choice, user_id) in enumerate(items):
+        question_answer_list = question_answers[question_id]
+        if not 1 <= answer_choice <= len(question_answer_list):
+            raise Http404("Answer not found")
+        answer = question_answer_list[answer_choice - 1]
+        user = users.get(user_id)
+        mooclet = answer.mooclet_explanation
+        if mooclet is None:
+            # no explanations for this answer
+            continue
+        mooclet_requests.setdefault(mooclet.pk, (mooclet, []))[1].append(
+            (position, answer, user)
+        )
+
+    assigned_versions = [None] * len(items)
+    answer_increments = {}
+    for mooclet, mooclet_items in mooclet_requests.values():
+        versions = mooclet.get_versions(
+            {"mooclet": mooclet}, [user for position, answer, user in mooclet_items]
+        )
+        for (position, answer, user), version in zip(mooclet_items, versions):
+            if version is None:
+                # the mooclet has no versions
+                continue
+            assigned_versions[position] = version
+            answer_increments[answer.pk] = answer_increments.get(answer.pk, 0) + 1
+    explanations = {
+        version.pk: version.explanation
+        for version in Version.objects.select_related("explanation").filter(
+            pk__in={version.pk for version in assigned_versions if version is not None}
+        )
+    }
+
+    # update count of answers, one update for all of them
+    answer_content_type = ContentType.objects.get_for_model(Answer)
+    answer_choice_count, created = Variable.objects.get_or_create_cached(
+        "answer_choice_count", answer_content_type, display_name="Count"
+    )
+    Counter.objects.increment_many(answer_choice_count, answer_increments)
+
+    return JsonResponse(
+        {
+            "assignments": [
+                (
+                    {
+                        "explanation_id": explanations[version.pk].id,
+                        "version_id": version.id,
+                        "text": explanations[version.pk].text,
+                    }
+                    if version is not None
+                    else None
+                )
+                for version in assigned_versions
+            ]
+        }
+    )
+
+
 def submit_result_of_explanation(request):
     """
     # Submits a scalar score (1-7) associated with a particular student who received a
@@ -199,7 +309,7 @@ def submit_quiz_grade(request):
     quiz_id = int(request.GET["quiz_id"])
     quiz = Quiz.objects.get(pk=quiz_id)
 
-    Grade = Variable.objects.get(name="quiz_grade")
+    Grade = Variable.objects.get_cached("quiz_grade")
     value = Value(variable=Grade, user=user, object_id=quiz_id, value=grade)
     value.save()
 
@@ -248,21 +358,24 @@ def submit_value(request):
             # skip text variables since they aren't implemented
             try:
                 variable_value = float(request.GET[param])
-
-                variable, created = Variable.objects.get_or_create(
-                    name=param, content_type=content_type, is_user_variable=True
-                )
-                value = Value(
-                    variable=variable,
-                    user=user,
-                    object_id=object_id,
-                    value=variable_value,
-                )
-                value.save()
-                count_saved_params = count_saved_params + 1
             except ValueError:
                 count_unsaved_params = count_unsaved_params + 1
-                pass
+                continue
+
+            variable, created = Variable.objects.get_or_create_cached(
+                param, content_type, is_user_variable=True
+            )
+            value = Value(
+                variable=variable,
+                user=user,
+                object_id=object_id,
+                value=variable_value,
+            )
+            # the value and its summary are saved together or not at all
+            with transaction.atomic():
+                value.save()
+                ValueSummary.objects.record_value(value)
+            count_saved_params = count_saved_params + 1
 
     message = "{} User variables successfully submitted".format(str(count_saved_params))
     if count_unsaved_params > 0:
@@ -279,7 +392,6 @@ def update_intermediates(request):
     """
 
     token = "jjw"
-    version_content_type = ContentType.objects.get_for_model(Version)
     if "token" not in request.GET or request.GET["token"] != token:
         return JsonResponse(
             {"message": "Required parameter token not found or incorrect"}
@@ -300,141 +412,42 @@ def update_intermediates(request):
             {"message": "Required parameter question_id not found in GET parameters"}
         )
 
-    # update version level intermediate variables
-    version = Version.objects.get(pk=int(request.GET["version_id"]))
-    mooclet = version.mooclet
-    versions = mooclet.version_set.all()
-    student_ratings = (
-        Variable.objects.get(name="student_rating").get_data({"version": version}).all()
+    version = Version.objects.select_related("mooclet").get(
+        pk=int(request.GET["version_id"])
     )
-    rating_count = student_ratings.count()
-    rating_average = student_ratings.aggregate(Avg("value"))
-    rating_average = rating_average["value__avg"]
+    question = Question.objects.get(pk=int(request.GET["question_id"]))
+    # rating statistics, explanation probabilities and answer proportions are
+    # recomputed by the run_recompute_worker command
+    RecomputeRequest.objects.enqueue(version.mooclet, question)
+
+    rating_summary = ValueSummary.objects.get_summary(
+        Variable.objects.get_cached("student_rating"), version.pk
+    )
+    rating_count = rating_summary.count
+    rating_average = rating_summary.mean
     if rating_average is None:
         rating_average = 0
     std_dev = 0
-    ratings = [
-        v.value
-        for v in Variable.objects.filter(name="student_rating")
-        .first()
-        .get_data({"version": version})
-        .all()
-    ]
-    if len(ratings) >= 1:
-        std_dev = std(ratings)
-    num_students_db, created = Variable.objects.get_or_create(
-        name="num_students",
-        display_name="Number of Students",
-        content_type=version_content_type,
-    )
-    mean_rating_db, created = Variable.objects.get_or_create(
-        name="mean_student_rating",
-        display_name="Mean Student Rating",
-        content_type=version_content_type,
-    )
-    std_dev_db, created = Variable.objects.get_or_create(
-        name="rating_std_dev",
-        display_name="Standard Deviation of Rating",
-        content_type=version_content_type,
-    )
-
-    current_num_students = Value.objects.filter(
-        variable=num_students_db, object_id=version.pk
-    ).last()
-    current_mean = Value.objects.filter(
-        variable=mean_rating_db, object_id=version.pk
-    ).last()
-    current_std_dev = Value.objects.filter(
-        variable=num_students_db, object_id=version.pk
-    ).last()
-
-    if current_num_students:
-        current_num_students.value = float(rating_count)
-        current_num_students.save()
-    elif not current_num_students and rating_count:
-        current_num_students = Value.objects.create(
-            variable=num_students_db, object_id=version.pk, value=rating_count
-        )
-
-    if current_mean:
-        current_mean.value = rating_average
-        current_mean.save()
-    elif not current_mean and rating_average:
-        current_mean = Value.objects.create(
-            variable=mean_rating_db, object_id=version.pk, value=rating_average
-        )
-
-    if current_std_dev:
-        current_std_dev.value = std_dev
-        current_std_dev.save()
-    elif not current_std_dev and std_dev:
-        current_std_dev = Value.objects.create(
-            variable=std_dev_db, object_id=version.pk, value=std_dev
+    if rating_count >= 1:
+        std_dev = rating_summary.std_dev
+    # last computed probabilities, the scheduled recompute hasn't run yet
+    probabilities = dict(
+        CurrentValue.objects.filter(
+            variable__in=Variable.objects.filter(name="explanation_probability"),
+            object_id__in=version.mooclet.get_version_ids(),
+            user=None,
         )
-
-    # simulate probabilities
-    mooclet_context = {"mooclet": mooclet}
-    probabilities = mooclet.simulate_probabilities(mooclet_context, iterations=10000)
-    # version_counts = {version: 0 for version in versions}
-
-    # #get versions 100 times and keep track of how often each is picked
-    # num_iterations = 100
-    # for i in range(1, num_iterations):
-    #     version = mooclet.get_version(mooclet_context)
-    #     #version = unicode(version)
-    #     version_counts[version] = version_counts[version] + 1
-    # versions = version_counts.keys()
-
-    # probabilities = [float(version_counts[version]) / sum(version_counts.values()) for version in versions]
-    # explanation_probability, created = Variable.objects.get_or_create(name='explanation_probability', content_type=version_content_type)
-    # for version, probability in zip(versions, probabilities):
-    #     explanation_probability_value = explanation_probability.get_data({'version': version}).last()
-    #     if explanation_probability_value:
-    #         explanation_probability_value.value = probability
-    #         explanation_probability_value.save()
-    #     else:
-    #         #no current probability stored
-    #         explanation_probability_value = Value.objects.create(variable=explanation_probability, object_id=version.pk, value=probability)
-
-    # Question Level variables
-    question = Question.objects.get(pk=int(request.GET["question_id"]))
-    answers = question.answer_set.all()
-    answer_content_type = ContentType.objects.get_for_model(Answer)
-
-    answer_count = Variable.objects.get(name="answer_choice_count")
-    answer_counts = {
-        answer: answer_count.get_data({"question": question, "answer": answer}).last()
-        for answer in answers
-    }
-    total_count = sum(filter(None, answer_counts.values()))
-    answer_proportion, created = Variable.objects.get_or_create(
-        name="answer_proportion", content_type=answer_content_type
+        .order_by("object_id")
+        .values_list("object_id", "value")
     )
-    for answer in answer_counts:
-        # generate the proportion of answers
-        if answer_counts[answer]:
-            proportion = answer_counts[answer] / total_count
-        else:  # no answer_choice_count, no one has chosen this answer
-            proportion = 0.0
-
-        value = answer_proportion.get_data(
-            {"question": question, "answer": answer}
-        ).last()
-        if not value:
-            value = Value.objects.create(
-                variable=answer_proportion, object_id=answer.pk, value=proportion
-            )
-        else:
-            value.value = proportion
-        value.save()
 
     return JsonResponse(
         {
-            "message": "Success. New variables:",
+            "message": "Success. Recompute scheduled, current variables:",
             "count": rating_count,
             "mean": rating_average,
             "standard deviation": std_dev,
-            "probabilities": probabilities.values(),
+            "probabilities": list(probabilities.values()),
         }
     )
 
@@ -37,6 +37,14 @@ class VersionAdmin(admin.ModelAdmin):
     list_display = ["id", "mooclet"]
 
 
+class ValueAdmin(admin.ModelAdmin):
+    list_display = ["id", "__str__", "user", "timestamp"]
+    list_select_related = ["user"]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_objects()
+
+
 class PolicyAdmin(admin.ModelAdmin):
     filter_horizontal = ("variables",)
 
@@ -48,8 +56,15 @@ admin.site.register(Explanation)
 admin.site.register(Mooclet, MoocletAdmin)
 admin.site.register(Version, VersionAdmin)
 admin.site.register(Variable)
-admin.site.register(Value)
+admin.site.register(Value, ValueAdmin)
+admin.site.register(CurrentValue)
+admin.site.register(Counter)
 admin.site.register(Policy, PolicyAdmin)
+admin.site.register(VersionPolicyState)
+admin.site.register(ValueSummary)
+admin.site.register(MoocletAssignment)
+admin.site.register(RecomputeRequest)
+admin.site.register(AssignmentLog)
 admin.site.register(Collaborator)
 admin.site.register(Course)
 admin.site.register(LtiParameters)
@@ -1,19 +1,67 @@
 import numpy as np
 
 
+class ThompsonState(object):
+    """
+    beta-bernoulli thompson sampling state for a set of explanations
+    kept as arrays of success and trial counts, so a decision costs O(explanations)
+    however many results have been recorded
+    """
+
+    def __init__(self, numExplanations=0, successes=None, trials=None):
+        if successes is None:
+            successes = np.zeros(numExplanations)
+        if trials is None:
+            trials = np.zeros(len(successes))
+        self.successes = np.array(successes, dtype=float)
+        self.trials = np.array(trials, dtype=float)
+
+    @classmethod
+    def fromResults(cls, allExplanationResults):
+        """
+        state from lists of raw per-student outcomes, one list per explanation
+        """
+        return cls(
+            successes=[np.sum(results) for results in allExplanationResults],
+            trials=[len(results) for results in allExplanationResults],
+        )
+
+    def posterior(self):
+        # beta(1, 1) prior
+        a = 1 + self.successes
+        b = 1 + self.trials - self.successes
+        return a, b
+
+    def means(self):
+        a, b = self.posterior()
+        return a / (a + b)
+
+    def choose(self, random_state=np.random):
+        """
+        index of the explanation with the largest posterior draw, and its posterior mean
+        """
+        a, b = self.posterior()
+        # Sample from posterior distribution P(\theta | D) for each explanation
+        idx = np.argmax(random_state.beta(a, b))
+        return idx, a[idx] / (a[idx] + b[idx])
+
+    def update(self, idx, result):
+        """
+        record one outcome (between 0 and 1) for explanation idx
+        """
+        self.successes[idx] += result
+        self.trials[idx] += 1
+
+
+def computeExplanation_ThompsonCounts(student, allExplanations, successes, trials):
+    # successes and trials are arrays with one entry per explanation
+    idx, mean = ThompsonState(successes=successes, trials=trials).choose()
+    return allExplanations[idx], mean
+
+
 # Thompson sampling
 def computeExplanation_Thompson(student, allExplanations, allExplanationResults):
-    # Sample from posterior distribution P(\theta | D) for each explanation
-    probabilities = np.zeros(len(allExplanationResults))
-    means = np.zeros(len(allExplanationResults))
-    for i in range(len(allExplanationResults)):
-        # print(allExplanationResults)
-        sumValues = np.sum(allExplanationResults[i])
-        a = 1 + sumValues
-        b = 1 + len(allExplanationResults[i]) - sumValues
-        # print(a,b)
-        means[i] = float(a) / (a + b)
-        probabilities[i] = np.random.beta(a, b)
-    # print(means)
-    idx = np.argmax(probabilities)
-    return allExplanations[idx], means[idx]
+    # allExplanationResults holds every outcome of each explanation,
+    # prefer computeExplanation_ThompsonCounts or a ThompsonState
+    idx, mean = ThompsonState.fromResults(allExplanationResults).choose()
+    return allExplanations[idx], mean
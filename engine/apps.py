@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class EngineConfig(AppConfig):
+    name = "engine"
+
+    def ready(self):
+        # register the system checks
+        from . import checks
@@ -0,0 +1,317 @@
+"""
+benchmarks for the assignment path and the probability simulations
+
+builds synthetic mooclets (n versions, m student ratings) and measures, for every policy
+in engine.policies and every simulator in engine.policy_probabilities:
+    latency per call, database queries per call, and peak memory allocated per call
+policies that learn online (linucb, decayed_thompson_sampling) start from the state
+their update functions would have stored for the ratings, and their updates are timed
+run through the benchmark_policies management command, which uses a throwaway SQLite db
+"""
+
+import time
+import tracemalloc
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import policies, policy_probabilities, policy_registry
+from .models import (
+    Explanation,
+    Mooclet,
+    Policy,
+    Value,
+    ValueSummary,
+    Variable,
+    Version,
+    VersionPolicyState,
+)
+
+# policies in engine.policies that can be benchmarked on a synthetic mooclet
+BENCHMARK_POLICIES = [
+    "uniform_random",
+    "weighted_random",
+    "thompson_sampling_placeholder",
+    "thompson_sampling",
+    "prompt_shortlong_condition",
+    "linucb",
+    "decayed_thompson_sampling",
+]
+
+# ratings are generated and inserted this many at a time
+RATING_CHUNK_SIZE = 10000
+
+
+def get_benchmark_variables():
+    version_content_type = ContentType.objects.get_for_model(Version)
+    names = ["student_rating", "version_weight", "edxshortlongcondition"]
+    variables = {
+        name: Variable.objects.get_or_create(
+            name=name, content_type=version_content_type
+        )[0]
+        for name in names
+    }
+    # context feature of the benchmark users, for linucb
+    variables["benchmark_feature"] = Variable.objects.get_or_create(
+        name="benchmark_feature", defaults={"is_user_variable": True}
+    )[0]
+    return variables
+
+
+def seed_policy_state(policy, version_ids, arms, rewards, features):
+    """
+    store the state the policy's update function would have left after the ratings
+    (bulk created ratings never reach it). rewards are scaled ratings, features the
+    (ratings, d) context vectors of the rating users
+    """
+    if policy.name not in ("linucb", "decayed_thompson_sampling"):
+        return
+    now = timezone.now()
+    states = []
+    for arm, version_id in enumerate(version_ids):
+        rated = arms == arm
+        state = VersionPolicyState(
+            version_id=version_id, policy=policy, **policies.THOMPSON_PRIORS
+        )
+        if policy.name == "linucb":
+            ridge = policy.get_parameters().get("ridge", 1.0)
+            x = features[rated]
+            a = ridge * np.identity(x.shape[1]) + x.T @ x
+            b = rewards[rated] @ x
+            state.linear_state = policies.pack_linear_state(np.linalg.inv(a), b)
+        elif policy.name == "decayed_thompson_sampling":
+            # the ratings were all just created, nothing has decayed yet
+            state.decayed_success = rewards[rated].sum()
+            state.decayed_failure = (1.0 - rewards[rated]).sum()
+            state.decayed_at = now
+        states.append(state)
+    VersionPolicyState.objects.bulk_create(states)
+
+
+def build_mooclet(policy_name, versions, ratings, users=100, seed=0):
+    """
+    synthetic mooclet with the given number of versions and student ratings (0-10)
+    """
+    random_state = np.random.RandomState(seed)
+    variables = get_benchmark_variables()
+    policy, created = Policy.objects.get_or_create(name=policy_name)
+    policy.variables.add(variables["version_weight"])
+    if policy_name == "linucb":
+        policy.variables.add(
+            variables["student_rating"], variables["benchmark_feature"]
+        )
+    mooclet = Mooclet.objects.create(
+        name="benchmark {} {}x{}".format(policy_name, versions, ratings), policy=policy
+    )
+    version_ids = [
+        Explanation.objects.create(mooclet=mooclet, text="version {}".format(i)).pk
+        for i in range(versions)
+    ]
+    Value.objects.bulk_create(
+        [
+            Value(variable=variables["version_weight"], object_id=version_id, value=1.0)
+            for version_id in version_ids
+        ]
+    )
+
+    user_ids = list(
+        User.objects.filter(username__startswith="benchmark").values_list(
+            "id", flat=True
+        )
+    )
+    if len(user_ids) < users:
+        User.objects.bulk_create(
+            [
+                User(username="benchmark{}".format(i))
+                for i in range(len(user_ids), users)
+            ]
+        )
+        user_ids = list(
+            User.objects.filter(username__startswith="benchmark").values_list(
+                "id", flat=True
+            )
+        )
+    user_features = dict(
+        Value.objects.filter(
+            variable=variables["benchmark_feature"], user_id__in=user_ids
+        ).values_list("user_id", "value")
+    )
+    new_features = {
+        user_id: float(random_state.uniform(0, 1))
+        for user_id in user_ids
+        if user_id not in user_features
+    }
+    Value.objects.bulk_create(
+        [
+            Value(variable=variables["benchmark_feature"], user_id=user_id, value=value)
+            for user_id, value in new_features.items()
+        ]
+    )
+    user_features.update(new_features)
+
+    # each version gets its own true mean rating
+    version_means = random_state.uniform(3, 8, size=versions)
+    all_arms = [np.zeros(0, dtype=int)]
+    all_values = [np.zeros(0)]
+    all_users = [np.zeros(0, dtype=int)]
+    for start in range(0, ratings, RATING_CHUNK_SIZE):
+        size = min(RATING_CHUNK_SIZE, ratings - start)
+        arms = random_state.randint(versions, size=size)
+        values = np.clip(random_state.normal(version_means[arms], 2.0), 0, 10)
+        rating_users = random_state.choice(user_ids, size=size)
+        all_arms.append(arms)
+        all_values.append(values)
+        all_users.append(rating_users)
+        Value.objects.bulk_create(
+            [
+                Value(
+                    variable=variables["student_rating"],
+                    object_id=version_ids[arm],
+                    user_id=int(user_id),
+                    value=float(value),
+                )
+                for arm, value, user_id in zip(arms, values, rating_users)
+            ]
+        )
+    ValueSummary.objects.rebuild(variables["student_rating"])
+
+    rating_users = np.concatenate(all_users)
+    seed_policy_state(
+        policy,
+        version_ids,
+        np.concatenate(all_arms),
+        # scaled by 0.1, as the update functions do
+        np.concatenate(all_values) * 0.1,
+        np.column_stack(
+            [
+                np.ones(len(rating_users)),
+                [user_features[user_id] for user_id in rating_users],
+            ]
+        ),
+    )
+    return mooclet
+
+
+def measure(function, calls):
+    """
+    call function repeatedly, returns latency, query and allocation stats per call
+    """
+    function()  # warm up caches, as a long-running worker would be
+
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        for i in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+
+    # allocations are measured separately, tracemalloc slows everything down
+    peaks = []
+    tracemalloc.start()
+    for i in range(min(calls, 20)):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function()
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    return {
+        "calls": calls,
+        "latency_ms": 1000.0 * elapsed / calls,
+        "queries": float(len(queries.captured_queries)) / calls,
+        "peak_alloc_kib": max(peaks) / 1024.0,
+    }
+
+
+def benchmark_mooclet(
+    mooclet, assignments=200, simulations=5, iterations=10000, updates=200
+):
+    user = User.objects.filter(username__startswith="benchmark").first()
+    results = {}
+    results["assignment"] = measure(
+        lambda: mooclet.get_version({"mooclet": mooclet, "user": user}), assignments
+    )
+    compiled_policy = policy_registry.get_compiled_policy(mooclet.policy_id)
+    if compiled_policy.update_function is not None:
+        # a new rating of the first version, fed to the update function again and again
+        rating = Value(
+            variable=Variable.objects.get_cached("student_rating"),
+            object_id=mooclet.version_set.values_list("id", flat=True).first(),
+            user=user,
+            value=5.0,
+        )
+        results["update"] = measure(lambda: compiled_policy.update(rating), updates)
+    if hasattr(policy_probabilities, mooclet.policy.name):
+        results["simulation"] = measure(
+            lambda: mooclet.simulate_probabilities(
+                {"mooclet": mooclet}, iterations=iterations
+            ),
+            simulations,
+        )
+    return results
+
+
+def run_benchmarks(
+    policies=BENCHMARK_POLICIES,
+    version_counts=(2, 10, 50),
+    rating_counts=(0, 1000, 100000),
+    assignments=200,
+    simulations=5,
+    iterations=10000,
+    updates=200,
+    seed=0,
+):
+    """
+    benchmark each policy on a synthetic mooclet for each (versions, ratings) scale
+    returns a list of result dicts
+    """
+    results = []
+    for policy_name in policies:
+        for versions in version_counts:
+            for ratings in rating_counts:
+                mooclet = build_mooclet(policy_name, versions, ratings, seed=seed)
+                result = {
+                    "policy": policy_name,
+                    "versions": versions,
+                    "ratings": ratings,
+                }
+                result.update(
+                    benchmark_mooclet(
+                        mooclet, assignments, simulations, iterations, updates
+                    )
+                )
+                results.append(result)
+    return results
+
+
+def compare_results(previous, current):
+    """
+    latency ratio (current / previous) of each benchmark present in both runs
+    """
+
+    def key(result):
+        return (result["policy"], result["versions"], result["ratings"])
+
+    previous_results = {key(result): result for result in previous}
+    comparisons = []
+    for result in current:
+        old = previous_results.get(key(result))
+        if old is None:
+            continue
+        comparison = {
+            "policy": result["policy"],
+            "versions": result["versions"],
+            "ratings": result["ratings"],
+        }
+        for stage in ["assignment", "update", "simulation"]:
+            if stage in result and stage in old:
+                comparison[stage] = {
+                    "latency_ratio": result[stage]["latency_ms"]
+                    / max(old[stage]["latency_ms"], 1e-9),
+                    "queries_change": result[stage]["queries"] - old[stage]["queries"],
+                }
+        comparisons.append(comparison)
+    return comparisons
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# cache backends that keep their entries in each process
+PER_PROCESS_CACHES = ("django.core.cache.backends.locmem.LocMemCache",)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    policy snapshots are invalidated through stamps in the default cache, they are
+    only seen by every process if the cache is shared
+    """
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if backend in PER_PROCESS_CACHES:
+        return [
+            Error(
+                "The default cache ({}) is not shared between processes.".format(
+                    backend
+                ),
+                hint=(
+                    "Policy snapshots would go stale in every process but the one "
+                    "that changed them. Configure memcached in CACHES."
+                ),
+                id="engine.E001",
+            )
+        ]
+    return []
@@ -0,0 +1,179 @@
+"""
+off-policy evaluation over the assignment log
+
+each logged assignment records the probability (propensity) the running policy had of
+choosing the assigned version. joined with the student's rating of that version, the
+log gives unbiased estimates of how a candidate policy would have done:
+    inverse propensity scoring (IPS), its self-normalized form (SNIPS), and the
+    doubly robust estimator (DR), which corrects a per-version reward model with IPS
+candidate policies are given as the probability they assign to each version, either
+one vector for every event or one row per event. no policy is re-run per decision.
+
+assignments that were never rated are left out, so estimates assume whether a student
+rates doesn't depend on the version they were shown
+"""
+
+import numpy as np
+from django.apps import apps
+
+from . import policy_registry
+
+
+def load_logged_events(mooclet, variable_name="student_rating", reward_scale=0.1):
+    """
+    rated assignments of the mooclet with a known propensity, in log order
+    returns (version ids, arms, propensities, rewards), arms index into version ids
+    """
+    AssignmentLog = apps.get_model("engine", "AssignmentLog")
+    Value = apps.get_model("engine", "Value")
+    Variable = apps.get_model("engine", "Variable")
+
+    version_ids = list(mooclet.version_set.values_list("id", flat=True))
+    arm_index = {version_id: i for i, version_id in enumerate(version_ids)}
+    ratings = {}
+    rated = Value.objects.filter(
+        variable__in=Variable.objects.filter(name=variable_name),
+        object_id__in=version_ids,
+        user__isnull=False,
+    ).order_by("id")
+    for user_id, version_id, value in rated.values_list(
+        "user_id", "object_id", "value"
+    ):
+        # the first rating follows the assignment
+        ratings.setdefault((user_id, version_id), value)
+
+    assignments = (
+        AssignmentLog.objects.filter(
+            mooclet=mooclet, user__isnull=False, propensity__isnull=False
+        )
+        .order_by("timestamp", "id")
+        .values_list("user_id", "version_id", "propensity")
+    )
+    arms = []
+    propensities = []
+    rewards = []
+    seen = set()
+    for user_id, version_id, propensity in assignments.iterator(chunk_size=10000):
+        key = (user_id, version_id)
+        # one event per rating, matched to the first assignment of that version
+        if key in seen or key not in ratings or version_id not in arm_index:
+            continue
+        seen.add(key)
+        arms.append(arm_index[version_id])
+        propensities.append(propensity)
+        rewards.append(ratings[key])
+    return (
+        version_ids,
+        np.array(arms, dtype=int),
+        np.array(propensities, dtype=float),
+        np.array(rewards, dtype=float) * reward_scale,
+    )
+
+
+def target_matrix(target, events, versions):
+    """
+    (events, versions) matrix of candidate policy probabilities
+    """
+    target = np.asarray(target, dtype=float)
+    if target.ndim == 1:
+        target = np.broadcast_to(target, (events, versions))
+    if target.shape != (events, versions):
+        raise ValueError(
+            "target probabilities have shape {}, expected {}".format(
+                target.shape, (events, versions)
+            )
+        )
+    return target
+
+
+def reward_model(arms, rewards, versions):
+    """
+    mean logged reward of each version (0 for versions never rated)
+    """
+    counts = np.bincount(arms, minlength=versions)
+    totals = np.bincount(arms, weights=rewards, minlength=versions)
+    return np.divide(totals, counts, out=np.zeros(versions), where=counts > 0)
+
+
+def evaluate(target, arms, propensities, rewards, versions, reward_estimates=None):
+    """
+    IPS, SNIPS and doubly robust estimates of the candidate policy's mean reward
+    reward_estimates: (versions,) or (events, versions) rewards for DR, defaults to
+    the per-version mean of the log
+    """
+    events = len(arms)
+    result = {"events": events}
+    if not events:
+        result.update(
+            {"ips": None, "snips": None, "dr": None, "effective_sample_size": 0.0}
+        )
+        return result
+
+    target = target_matrix(target, events, versions)
+    rows = np.arange(events)
+    weights = target[rows, arms] / propensities
+    if reward_estimates is None:
+        reward_estimates = reward_model(arms, rewards, versions)
+    reward_estimates = target_matrix(reward_estimates, events, versions)
+
+    ips = weights * rewards
+    dr = (target * reward_estimates).sum(axis=1) + weights * (
+        rewards - reward_estimates[rows, arms]
+    )
+    result.update(
+        {
+            "logged": float(rewards.mean()),
+            "ips": float(ips.mean()),
+            "ips_standard_error": float(ips.std() / np.sqrt(events)),
+            "snips": float(ips.sum() / weights.sum()) if weights.sum() else None,
+            "dr": float(dr.mean()),
+            "dr_standard_error": float(dr.std() / np.sqrt(events)),
+            "effective_sample_size": (
+                float(weights.sum() ** 2 / (weights**2).sum()) if weights.any() else 0.0
+            ),
+        }
+    )
+    return result
+
+
+def get_target_probabilities(mooclet, policy_name):
+    """
+    probability the named policy would give each version of the mooclet, now
+    computed from the stored policy state, without writing to it
+    """
+    Policy = apps.get_model("engine", "Policy")
+    probability_function = policy_registry.get_policy_probability_function(policy_name)
+    if probability_function is None:
+        raise ValueError("no probability function for policy {}".format(policy_name))
+    policy = mooclet.policy
+    if policy is None or policy.name != policy_name:
+        policy = Policy.objects.filter(name=policy_name).first()
+    if policy is None:
+        raise ValueError("policy {} not found".format(policy_name))
+    versions = list(mooclet.version_set.all())
+    context = {
+        "mooclet": mooclet,
+        "versions": versions,
+        "policy": policy,
+        "read_only": True,
+    }
+    probabilities = probability_function(
+        policy_registry.get_compiled_policy(policy.pk).variables, context
+    )
+    return np.array([probabilities.get(version, 0.0) for version in versions])
+
+
+def evaluate_mooclet(mooclet, policy_name, reward_scale=0.1):
+    """
+    estimate how the named policy would have done on the mooclet's logged assignments
+    """
+    version_ids, arms, propensities, rewards = load_logged_events(
+        mooclet, reward_scale=reward_scale
+    )
+    target = get_target_probabilities(mooclet, policy_name)
+    result = evaluate(target, arms, propensities, rewards, len(version_ids))
+    result["policy"] = policy_name
+    result["mooclet"] = mooclet.pk
+    result["version_ids"] = version_ids
+    result["target_probabilities"] = target.tolist()
+    return result
@@ -0,0 +1,110 @@
+import json
+import platform
+import subprocess
+
+import numpy
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from engine.benchmarks import BENCHMARK_POLICIES, compare_results, run_benchmarks
+
+
+def get_git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark policies and probability simulations on synthetic mooclets, "
+        "e.g. manage.py benchmark_policies "
+        "--settings=adaptive_mooclet_lti.settings.benchmark --output bench.json"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--policies", nargs="+", default=BENCHMARK_POLICIES, metavar="POLICY"
+        )
+        parser.add_argument(
+            "--versions", nargs="+", type=int, default=[2, 10, 50], metavar="N"
+        )
+        parser.add_argument(
+            "--ratings", nargs="+", type=int, default=[0, 1000, 100000], metavar="N"
+        )
+        parser.add_argument(
+            "--assignments",
+            type=int,
+            default=200,
+            help="timed assignments per mooclet",
+        )
+        parser.add_argument(
+            "--simulations",
+            type=int,
+            default=5,
+            help="timed probability simulations per mooclet",
+        )
+        parser.add_argument("--iterations", type=int, default=10000)
+        parser.add_argument(
+            "--updates",
+            type=int,
+            default=200,
+            help="timed rating updates per mooclet, for policies that learn online",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="write the JSON results to this file")
+        parser.add_argument(
+            "--compare", help="JSON results of an earlier run to compare against"
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError(
+                "Benchmarks run on SQLite, use "
+                "--settings=adaptive_mooclet_lti.settings.benchmark"
+            )
+        for count in options["versions"]:
+            if count < 1:
+                raise CommandError("Mooclets need at least one version")
+
+        # never build synthetic data in a real database
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = run_benchmarks(
+                policies=options["policies"],
+                version_counts=options["versions"],
+                rating_counts=options["ratings"],
+                assignments=options["assignments"],
+                simulations=options["simulations"],
+                iterations=options["iterations"],
+                updates=options["updates"],
+                seed=options["seed"],
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        report = {
+            "commit": get_git_commit(),
+            "python": platform.python_version(),
+            "numpy": numpy.__version__,
+            "results": results,
+        }
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f)
+            report["compared_to"] = previous.get("commit")
+            report["comparison"] = compare_results(previous["results"], results)
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from engine.evaluation import evaluate_mooclet
+from engine.models import Mooclet
+
+
+class Command(BaseCommand):
+    help = (
+        "Estimate a policy's mean reward on a mooclet from its logged assignment "
+        "propensities (IPS, SNIPS, doubly robust)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("mooclet_id", type=int)
+        parser.add_argument(
+            "--policy", help="policy function name, defaults to the mooclet's policy"
+        )
+        parser.add_argument(
+            "--reward-scale",
+            type=float,
+            default=0.1,
+            help="multiplier turning a rating into a reward between 0 and 1",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            mooclet = Mooclet.objects.get(pk=options["mooclet_id"])
+        except Mooclet.DoesNotExist:
+            raise CommandError("Mooclet {} not found".format(options["mooclet_id"]))
+        policy_name = options["policy"] or mooclet.policy.name
+        try:
+            result = evaluate_mooclet(
+                mooclet, policy_name, reward_scale=options["reward_scale"]
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(result, indent=2))
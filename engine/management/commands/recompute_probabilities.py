@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from engine.models import Course, Mooclet
+from engine.recompute import get_course_mooclet_ids, recompute_probabilities
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute explanation_probability for every mooclet of the given courses "
+        "(all mooclets if no course is given), in parallel"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("course_ids", nargs="*", type=int)
+        parser.add_argument("--iterations", type=int, default=10000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="worker processes, defaults to the number of cores",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=None,
+            help="seed for simulated probabilities, the same for any number of workers",
+        )
+
+    def handle(self, *args, **options):
+        if options["course_ids"]:
+            mooclet_ids = []
+            for course_id in options["course_ids"]:
+                try:
+                    course = Course.objects.get(pk=course_id)
+                except Course.DoesNotExist:
+                    raise CommandError("Course {} not found".format(course_id))
+                mooclet_ids.extend(get_course_mooclet_ids(course))
+        else:
+            mooclet_ids = list(Mooclet.objects.values_list("id", flat=True))
+
+        start = time.perf_counter()
+        probabilities = recompute_probabilities(
+            mooclet_ids,
+            iterations=options["iterations"],
+            workers=options["workers"],
+            seed=options["seed"],
+        )
+        self.stdout.write(
+            "Recomputed {} mooclets ({} versions) in {:.2f}s".format(
+                len(probabilities),
+                sum(len(p) for p in probabilities.values()),
+                time.perf_counter() - start,
+            )
+        )
@@ -0,0 +1,64 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from engine.recompute import process_recompute_requests
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Process scheduled recomputes of intermediate variables and probabilities"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="process the requests that are due and exit",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=5.0,
+            help="seconds to wait between polls when nothing is due",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="largest number of mooclets recomputed together",
+        )
+        parser.add_argument("--iterations", type=int, default=10000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="worker processes, defaults to the number of cores",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                processed = process_recompute_requests(
+                    limit=options["batch_size"],
+                    iterations=options["iterations"],
+                    workers=options["workers"],
+                )
+            except Exception:
+                # e.g. the database is unreachable, failed recomputes are retried
+                # by process_recompute_requests itself
+                logger.exception("processing recompute requests failed")
+                self.stderr.write("Processing recompute requests failed")
+                if options["once"]:
+                    return
+                # reconnect on the next poll
+                close_old_connections()
+                time.sleep(options["interval"])
+                continue
+            if processed:
+                self.stdout.write("Recomputed {} mooclets".format(processed))
+            if options["once"]:
+                return
+            if processed < options["batch_size"]:
+                time.sleep(options["interval"])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 06:53
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0006_auto_20160908_1732"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="VersionPolicyState",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("prior_success", models.FloatField(default=1.0)),
+                ("prior_failure", models.FloatField(default=1.0)),
+                ("posterior_success", models.FloatField(blank=True, null=True)),
+                ("posterior_failure", models.FloatField(blank=True, null=True)),
+                (
+                    "policy",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Policy",
+                    ),
+                ),
+                (
+                    "version",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Version",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("version", "policy")},
+            },
+        ),
+    ]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 07:20
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SUMMARIZED_VARIABLES = ("student_rating", "version_rating")
+
+
+def summarize_existing_values(apps, schema_editor):
+    Value = apps.get_model("engine", "Value")
+    ValueSummary = apps.get_model("engine", "ValueSummary")
+    totals = (
+        Value.objects.filter(variable__name__in=SUMMARIZED_VARIABLES)
+        .values("variable_id", "object_id")
+        .annotate(
+            count=models.Count("id"),
+            total=models.Sum("value"),
+            total_squares=models.Sum(models.F("value") * models.F("value")),
+        )
+        .values_list("variable_id", "object_id", "count", "total", "total_squares")
+    )
+    ValueSummary.objects.bulk_create(
+        [
+            ValueSummary(
+                variable_id=variable_id,
+                object_id=object_id,
+                count=count,
+                total=total,
+                total_squares=total_squares,
+            )
+            for variable_id, object_id, count, total, total_squares in totals
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0007_versionpolicystate"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ValueSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("object_id", models.PositiveIntegerField(null=True)),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("total", models.FloatField(default=0.0)),
+                ("total_squares", models.FloatField(default=0.0)),
+                (
+                    "variable",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Variable",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("variable", "object_id")},
+            },
+        ),
+        migrations.RunPython(summarize_existing_values, migrations.RunPython.noop),
+    ]
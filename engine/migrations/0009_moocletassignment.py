@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 08:05
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_condition_assignments(apps, schema_editor):
+    """
+    create assignments from the condition values prompt_shortlong_condition used to look up
+    """
+    Value = apps.get_model("engine", "Value")
+    Version = apps.get_model("engine", "Version")
+    MoocletAssignment = apps.get_model("engine", "MoocletAssignment")
+    conditions = (
+        Value.objects.filter(
+            variable__name="edxshortlongcondition",
+            user__isnull=False,
+            object_id__isnull=False,
+        )
+        .order_by("id")
+        .values_list("user_id", "object_id")
+    )
+    version_mooclets = dict(
+        Version.objects.filter(mooclet__isnull=False).values_list("id", "mooclet_id")
+    )
+    assignments = {}
+    for user_id, version_id in conditions:
+        mooclet_id = version_mooclets.get(version_id)
+        if mooclet_id is not None:
+            # the earliest condition value was the one in use
+            assignments.setdefault((user_id, mooclet_id), version_id)
+    MoocletAssignment.objects.bulk_create(
+        [
+            MoocletAssignment(
+                user_id=user_id, mooclet_id=mooclet_id, version_id=version_id
+            )
+            for (user_id, mooclet_id), version_id in assignments.items()
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("engine", "0008_valuesummary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MoocletAssignment",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+                (
+                    "mooclet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Mooclet",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "version",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Version",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "mooclet")},
+            },
+        ),
+        migrations.AddIndex(
+            model_name="moocletassignment",
+            index=models.Index(
+                fields=["user", "mooclet", "version"],
+                name="engine_assign_user_version_idx",
+            ),
+        ),
+        migrations.RunPython(copy_condition_assignments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 08:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0009_moocletassignment"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="policy",
+            name="parameters",
+            field=models.TextField(blank=True, default="{}"),
+        ),
+    ]
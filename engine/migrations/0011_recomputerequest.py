@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 10:05
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0010_policy_parameters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecomputeRequest",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("requested", models.DateTimeField(auto_now_add=True)),
+                ("due_at", models.DateTimeField(db_index=True)),
+                (
+                    "mooclet",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Mooclet",
+                    ),
+                ),
+                (
+                    "question",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Question",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0011_recomputerequest"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="versionpolicystate",
+            name="linear_state",
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 12:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0012_versionpolicystate_linear_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="versionpolicystate",
+            name="decayed_success",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="versionpolicystate",
+            name="decayed_failure",
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name="versionpolicystate",
+            name="decayed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 13:00
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("engine", "0013_versionpolicystate_decayed_counts"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AssignmentLog",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("propensity", models.FloatField(blank=True, null=True)),
+                (
+                    "timestamp",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "mooclet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Mooclet",
+                    ),
+                ),
+                (
+                    "policy",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Policy",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "version",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Version",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="assignmentlog",
+            index=models.Index(
+                fields=["mooclet", "timestamp"], name="engine_assignlog_mooclet_idx"
+            ),
+        ),
+    ]
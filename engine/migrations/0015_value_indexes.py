@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 14:10
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+INDEXES = [
+    models.Index(
+        fields=["variable", "object_id", "id"], name="engine_value_object_idx"
+    ),
+    models.Index(
+        fields=["variable", "user", "object_id"], name="engine_value_user_idx"
+    ),
+]
+
+
+def create_indexes(apps, schema_editor):
+    Value = apps.get_model("engine", "Value")
+    if schema_editor.connection.vendor != "postgresql":
+        for index in INDEXES:
+            schema_editor.add_index(Value, index)
+        return
+    # the value table is large and written to with every student action, build the
+    # indexes without blocking writes
+    quote_name = schema_editor.quote_name
+    for index in INDEXES:
+        columns = [Value._meta.get_field(field).column for field in index.fields]
+        schema_editor.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} ({})".format(
+                quote_name(index.name),
+                quote_name(Value._meta.db_table),
+                ", ".join(quote_name(column) for column in columns),
+            )
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    Value = apps.get_model("engine", "Value")
+    if schema_editor.connection.vendor != "postgresql":
+        for index in INDEXES:
+            schema_editor.remove_index(Value, index)
+        return
+    for index in INDEXES:
+        schema_editor.execute(
+            "DROP INDEX CONCURRENTLY IF EXISTS {}".format(
+                schema_editor.quote_name(index.name)
+            )
+        )
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("engine", "0014_assignmentlog"),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(create_indexes, drop_indexes, atomic=False)
+            ],
+            state_operations=[
+                migrations.AddIndex(model_name="value", index=index)
+                for index in INDEXES
+            ],
+        )
+    ]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 15:30
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("engine", "0015_value_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CurrentValue",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("object_id", models.PositiveIntegerField()),
+                ("value", models.FloatField()),
+                (
+                    "timestamp",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "variable",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Variable",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="currentvalue",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(user__isnull=False),
+                fields=("variable", "object_id", "user"),
+                name="engine_currentvalue_user_key",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="currentvalue",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(user__isnull=True),
+                fields=("variable", "object_id"),
+                name="engine_currentvalue_key",
+            ),
+        ),
+    ]
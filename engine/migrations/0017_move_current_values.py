@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 15:35
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.utils import timezone
+
+# engine.models.CURRENT_VALUE_VARIABLES when this migration was written
+CURRENT_VALUE_VARIABLES = (
+    "explanation_probability",
+    "mean_student_rating",
+    "num_students",
+    "rating_std_dev",
+    "answer_choice_count",
+    "answer_proportion",
+)
+
+
+def move_to_current_values(apps, schema_editor):
+    """
+    keep the latest Value of each (variable, object, user) as its current value
+    """
+    Value = apps.get_model("engine", "Value")
+    CurrentValue = apps.get_model("engine", "CurrentValue")
+    values = Value.objects.filter(
+        variable__name__in=CURRENT_VALUE_VARIABLES, object_id__isnull=False
+    )
+    latest = {}
+    for value in values.order_by("id").iterator(chunk_size=10000):
+        latest[(value.variable_id, value.object_id, value.user_id)] = value
+    CurrentValue.objects.bulk_create(
+        [
+            CurrentValue(
+                variable_id=value.variable_id,
+                object_id=value.object_id,
+                user_id=value.user_id,
+                value=value.value,
+                timestamp=value.timestamp or timezone.now(),
+            )
+            for value in latest.values()
+        ]
+    )
+    values.delete()
+
+
+def move_to_values(apps, schema_editor):
+    Value = apps.get_model("engine", "Value")
+    CurrentValue = apps.get_model("engine", "CurrentValue")
+    Value.objects.bulk_create(
+        [
+            Value(
+                variable_id=current.variable_id,
+                object_id=current.object_id,
+                user_id=current.user_id,
+                value=current.value,
+            )
+            for current in CurrentValue.objects.order_by("id").iterator()
+        ]
+    )
+    CurrentValue.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0016_currentvalue"),
+    ]
+
+    operations = [
+        migrations.RunPython(move_to_current_values, move_to_values),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 16:40
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0017_move_current_values"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Counter",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("object_id", models.PositiveIntegerField()),
+                ("shard", models.PositiveSmallIntegerField(default=0)),
+                ("value", models.FloatField(default=0.0)),
+                (
+                    "variable",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        to="engine.Variable",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("variable", "object_id", "shard")},
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 16:45
+from __future__ import unicode_literals
+
+from django.db import migrations
+from django.db.models import Sum
+
+# engine.models.COUNTER_VARIABLES when this migration was written
+COUNTER_VARIABLES = ("answer_choice_count",)
+
+
+def move_to_counters(apps, schema_editor):
+    """
+    current counts become shard 0 of each counter
+    """
+    CurrentValue = apps.get_model("engine", "CurrentValue")
+    Counter = apps.get_model("engine", "Counter")
+    counts = CurrentValue.objects.filter(
+        variable__name__in=COUNTER_VARIABLES, user__isnull=True
+    )
+    Counter.objects.bulk_create(
+        [
+            Counter(
+                variable_id=count.variable_id,
+                object_id=count.object_id,
+                shard=0,
+                value=count.value,
+            )
+            for count in counts.iterator()
+        ]
+    )
+    counts.delete()
+
+
+def move_to_current_values(apps, schema_editor):
+    CurrentValue = apps.get_model("engine", "CurrentValue")
+    Counter = apps.get_model("engine", "Counter")
+    CurrentValue.objects.bulk_create(
+        [
+            CurrentValue(variable_id=variable_id, object_id=object_id, value=total)
+            for variable_id, object_id, total in Counter.objects.values(
+                "variable_id", "object_id"
+            )
+            .annotate(total=Sum("value"))
+            .values_list("variable_id", "object_id", "total")
+        ]
+    )
+    Counter.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0018_counter"),
+    ]
+
+    operations = [
+        migrations.RunPython(move_to_counters, move_to_current_values),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 2.2 on 2026-10-18 18:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("engine", "0019_move_answer_choice_counts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recomputerequest",
+            name="claimed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="recomputerequest",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="recomputerequest",
+            name="last_error",
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -1,15 +1,26 @@
 from __future__ import unicode_literals
 
+import json
+import random
+from datetime import timedelta
+from math import sqrt
+from time import monotonic
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.query import ModelIterable
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.shortcuts import redirect
+from django.utils import timezone
 
 # from qualtrics.models import Template
 from django.urls import reverse
 
-from . import policies, policy_probabilities
+from . import policies, policy_probabilities, policy_registry, snapshots
 
 ####################################
 #### Generalized mooclet models ####
@@ -53,20 +64,51 @@ class Mooclet(models.Model):
         return "Mooclet: {}".format(self.id)
 
     def get_version_ids(self):
-        return self.version_set.values_list("id", flat=True)
-        # return [version_id for version in self.version_set.all()]
+        """
+        tuple of the mooclet's version ids, cached until one of its versions is saved
+        or deleted
+        """
+        return snapshots.get_version_ids(
+            self.pk,
+            lambda: self.version_set.order_by("id").values_list("id", flat=True),
+        )
 
     def get_version(self, context={}):
         context["versions"] = self.version_set.all()
         # context['version_ids'] = self.get_version_ids()
-        version = self.policy.run_policy(context)
+        context.pop("propensity", None)
+        compiled_policy = policy_registry.get_compiled_policy(self.policy_id)
+        version = compiled_policy.run(context)
         # version = self.version_set.get(pk=version_id)
+        if version is not None:
+            AssignmentLog.objects.log(
+                self,
+                version,
+                context.get("user"),
+                compiled_policy.policy,
+                context.get("propensity"),
+            )
         return version
 
+    def get_versions(self, context, users):
+        """
+        assign a version to each of users (None for anonymous), running the policy once
+        """
+        context["versions"] = self.version_set.all()
+        compiled_policy = policy_registry.get_compiled_policy(self.policy_id)
+        # policies return None when the mooclet has no versions
+        versions = compiled_policy.run_batch(context, users) or [None] * len(users)
+        propensities = context.pop("propensities", None) or [None] * len(versions)
+        AssignmentLog.objects.log_many(
+            self, compiled_policy.policy, zip(versions, users, propensities)
+        )
+        return versions
+
     def simulate_probabilities(self, context={}, iterations=100):
         context["versions"] = self.version_set.all()
         # context['version_ids'] = self.get_version_ids()
-        probabilites = self.policy.run_simulation(context, iterations)
+        policy = policy_registry.get_compiled_policy(self.policy_id).policy
+        probabilites = policy.run_simulation(context, iterations)
         # version = self.version_set.get(pk=version_id)
         return probabilites
 
@@ -92,6 +134,8 @@ class Policy(models.Model):
     # TODO should name be the primary key?
     name = models.CharField(max_length=100)
     variables = models.ManyToManyField("Variable")
+    # JSON object of policy settings, e.g. {"buffer_size": 500, "buffer_max_age": 30}
+    parameters = models.TextField(default="{}", blank=True)
 
     class Meta:
         verbose_name_plural = "policies"
@@ -99,21 +143,23 @@ class Policy(models.Model):
     def __str__(self):
         return self.name
 
+    def get_parameters(self):
+        return json.loads(self.parameters or "{}")
+
     def get_policy_function(self):
-        try:
-            return getattr(policies, self.name)
-        except:
+        # custom user-provided functions take precedence over engine.policies
+        policy_function = policy_registry.get_policy_function(self.name)
+        if policy_function is None:
             print("policy function matching specified name not found")
-            # TODO look through custom user-provided functions
-            return None
+        return policy_function
 
     def get_policy_probability_function(self):
-        try:
-            return getattr(policy_probabilities, self.name)
-        except:
+        policy_probability_function = policy_registry.get_policy_probability_function(
+            self.name
+        )
+        if policy_probability_function is None:
             print("policy probability function matching specified name not found")
-            # TODO look through custom user-provided functions
-            return None
+        return policy_probability_function
 
     def get_variables(self):
         # TODO implement returning all, subsets, etc.
@@ -121,44 +167,127 @@ class Policy(models.Model):
 
     def run_policy(self, context):
         # insert all version ids here?
-        policy_function = self.get_policy_function()
-        variables = self.get_variables()
-        version_id = policy_function(variables, context)
+        version_id = policy_registry.get_compiled_policy(self.pk).run(context)
         return version_id
 
     def run_simulation(self, context, iterations):
-        policy_probability_function = self.get_policy_probability_function()
-        if policy_probability_function == None:
+        compiled_policy = policy_registry.get_compiled_policy(self.pk)
+        if compiled_policy.probability_function == None:
             return {"probabilities": "n/a"}
-        variables = self.get_variables()
         version_content_type = ContentType.objects.get_for_model(Version)
 
-        # get versions 100 times and keep track of how often each is picked
-        probabilities = policy_probability_function(
-            variables, context, iterations=iterations
-        )
+        probabilities = compiled_policy.simulate(context, iterations)
 
-        explanation_probability, created = Variable.objects.get_or_create(
-            name="explanation_probability", content_type=version_content_type
+        explanation_probability, created = Variable.objects.get_or_create_cached(
+            "explanation_probability", version_content_type
+        )
+        CurrentValue.objects.set_values(
+            explanation_probability,
+            {version.pk: probability for version, probability in probabilities.items()},
         )
-        for version, probability in probabilities.iteritems():
-            explanation_probability_value = explanation_probability.get_data(
-                {"version": version}
-            ).last()
-            if explanation_probability_value:
-                explanation_probability_value.value = probability
-                explanation_probability_value.save()
-            else:
-                # no current probability stored
-                explanation_probability_value = Value.objects.create(
-                    variable=explanation_probability,
-                    object_id=version.pk,
-                    value=probability,
-                )
 
         return probabilities
 
 
+# process-level cache of every Variable row, keyed by name and by id
+# read from the whole table at once, cleared by clear_variable_cache and reloaded when
+# the shared variables stamp changes (a variable saved or deleted in another process)
+_variable_cache = {"by_name": None, "by_id": None, "stamp": None}
+# content_type argument of get_cached that leaves the content type unfiltered
+ANY_CONTENT_TYPE = object()
+
+
+class VariableManager(models.Manager):
+    def load_cache(self):
+        """
+        read every variable into the cache, returns {name: [variables]}
+        """
+        # read the stamp before loading, a change made while loading bumps it again
+        stamp = snapshots.get_variables_stamp()
+        by_name = {}
+        by_id = {}
+        for variable in self.select_related("content_type").order_by("pk"):
+            by_name.setdefault(variable.name, []).append(variable)
+            by_id[variable.pk] = variable
+        _variable_cache.update(by_name=by_name, by_id=by_id, stamp=stamp)
+        return by_name
+
+    def get_cache(self):
+        """
+        the cached {name: [variables]} and {id: variable}, reloaded if out of date
+        """
+        if (
+            _variable_cache["by_name"] is None
+            or _variable_cache["stamp"] != snapshots.get_variables_stamp()
+        ):
+            self.load_cache()
+        return _variable_cache["by_name"], _variable_cache["by_id"]
+
+    def get_cached_by_id(self, variable_id):
+        """
+        the variable with the given id, None if there is none
+        """
+        by_name, by_id = self.get_cache()
+        if variable_id not in by_id:
+            self.load_cache()
+            by_id = _variable_cache["by_id"]
+        return by_id.get(variable_id)
+
+    def get_cached(self, name, content_type=ANY_CONTENT_TYPE, first=False, **fields):
+        """
+        the variable with the given name (and content type and field values, if
+        given), like get() but without a query once the cache is loaded
+        content_type=None matches variables without a content type
+        first=True is like filter().first() instead: the matching variable with the
+        lowest id, or None, for callers that tolerate duplicate names
+        """
+        by_name, by_id = self.get_cache()
+        if name not in by_name:
+            # a variable created by another process, before its stamp was bumped
+            by_name = self.load_cache()
+        if content_type is not ANY_CONTENT_TYPE:
+            fields["content_type_id"] = getattr(content_type, "pk", content_type)
+        variables = [
+            variable
+            for variable in by_name.get(name, [])
+            if all(getattr(variable, field) == value for field, value in fields.items())
+        ]
+        if first:
+            return variables[0] if variables else None
+        if len(variables) == 1:
+            return variables[0]
+        if variables:
+            raise self.model.MultipleObjectsReturned(
+                "{} variables named {}".format(len(variables), name)
+            )
+        raise self.model.DoesNotExist("no variable named {}".format(name))
+
+    def get_or_create_cached(self, name, content_type, defaults=None, **fields):
+        """
+        (variable, created), like
+        get_or_create(name=name, content_type=content_type, **fields)
+        """
+        try:
+            return self.get_cached(name, content_type, **fields), False
+        except self.model.DoesNotExist:
+            return self.get_or_create(
+                name=name, content_type=content_type, defaults=defaults, **fields
+            )
+
+
+# variables with a single current value per object (and user), overwritten as they
+# are recomputed: stored in CurrentValue, Value keeps the observations
+CURRENT_VALUE_VARIABLES = (
+    "explanation_probability",
+    "mean_student_rating",
+    "num_students",
+    "rating_std_dev",
+    "answer_proportion",
+)
+# variables counted with atomic increments: stored in Counter, summed on read
+COUNTER_VARIABLES = ("answer_choice_count",)
+
+
 class Variable(models.Model):
     name = models.CharField(max_length=100)
     display_name = models.CharField(max_length=200, default="")
@@ -171,6 +300,8 @@ class Variable(models.Model):
     # policy_relevance = [vpal_researcher, harvard_researcher, course_team, external_researcher]
     # policy_relevance2 = [student_judgements, instructor_judgements]
 
+    objects = VariableManager()
+
     def __str__(self):
         return self.display_name or self.name
 
@@ -178,9 +309,19 @@ class Variable(models.Model):
     def object_name(self):
         return self.content_type.__str__()
 
+    @property
+    def is_current_value(self):
+        return self.name in CURRENT_VALUE_VARIABLES
+
+    @property
+    def is_counter(self):
+        return self.name in COUNTER_VARIABLES
+
     def get_data(self, context=None):
         """
         return relevant value objects for the variable type
+        CurrentValue objects for CURRENT_VALUE_VARIABLES, Counter shards for
+        COUNTER_VARIABLES (Counter.objects.get_counts sums them)
         """
         # context is a dictionary that contains model objects user, course, quiz, mooclet, version
         if context:
@@ -202,9 +343,16 @@ class Variable(models.Model):
                 query["object_id"] = context[
                     related_object
                 ].id  # pk of related content object instance
-            return self.value_set.filter(**query)
+            return self.get_value_set().filter(**query)
         else:
-            return self.value_set.all()
+            return self.get_value_set().all()
+
+    def get_value_set(self):
+        if self.is_current_value:
+            return self.currentvalue_set
+        if self.is_counter:
+            return self.counter_set
+        return self.value_set
 
     def get_data_dicts(self, context=None):
         """
@@ -213,6 +361,61 @@ class Variable(models.Model):
         return self.get_data(context).values()
 
 
+def attach_content_objects(values, using=None):
+    """
+    load the related content objects of the values with one query per content
+    type, for get_object_content
+    """
+    object_ids = {}
+    for value in values:
+        content_type_id = value.variable.content_type_id
+        if content_type_id is not None and value.object_id is not None:
+            object_ids.setdefault(content_type_id, set()).add(value.object_id)
+    objects = {}
+    for content_type_id, ids in object_ids.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            continue
+        for pk, obj in model._base_manager.using(using).in_bulk(ids).items():
+            objects[(content_type_id, pk)] = obj
+    for value in values:
+        key = (value.variable.content_type_id, value.object_id)
+        if key in objects:
+            value._content_object = (value.object_id, objects[key])
+
+
+class ValueQuerySet(models.QuerySet):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._with_objects = False
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._with_objects = self._with_objects
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super()._fetch_all()
+        if (
+            fetched
+            and self._with_objects
+            and self._result_cache
+            and issubclass(self._iterable_class, ModelIterable)
+        ):
+            attach_content_objects(self._result_cache, self.db)
+
+    def with_objects(self):
+        """
+        load the related content objects (value.version, value.quiz, ...) of the
+        results with one query per content type, instead of one query per value
+        not applied by iterator()
+        """
+        clone = self.select_related("variable__content_type")
+        clone._with_objects = True
+        return clone
+
+
 class Value(models.Model):
     """
     user variable observation, can be associated with either course, mooclet, or mooclet version
@@ -231,6 +434,20 @@ class Value(models.Model):
     value = models.FloatField()
     timestamp = models.DateTimeField(null=True, auto_now=True)
 
+    objects = ValueQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # values of objects, latest first: get_data(...).last()
+            models.Index(
+                fields=["variable", "object_id", "id"], name="engine_value_object_idx"
+            ),
+            # a user's values of a variable
+            models.Index(
+                fields=["variable", "user", "object_id"], name="engine_value_user_idx"
+            ),
+        ]
+
     def __str__(self):
         var_name = self.variable.name or ""
         value = self.value or ""
@@ -245,10 +462,17 @@ class Value(models.Model):
         retrieve the related content object associated with the Value
         takes as input the name of the content object
         """
-        ct = self.variable.content_type
+        if self.variable.content_type_id is None:
+            return None
+        ct = ContentType.objects.get_for_id(self.variable.content_type_id)
         if ct.__str__() != content_object_name:
             return None
-        return ct.get_object_for_this_type(pk=self.object_id)
+        # loaded by ValueQuerySet.with_objects, or on first access
+        cached = getattr(self, "_content_object", None)
+        if cached is None or cached[0] != self.object_id:
+            cached = (self.object_id, ct.get_object_for_this_type(pk=self.object_id))
+            self._content_object = cached
+        return cached[1]
 
     @property
     def object_name(self):
@@ -272,6 +496,418 @@ class Value(models.Model):
         return self.get_object_content("version")
 
 
+class CurrentValueManager(models.Manager):
+    def get_value(self, variable, object_id, user=None, default=None):
+        """
+        the current value of the variable for the object (and user), one index lookup
+        """
+        values = list(
+            self.filter(variable=variable, object_id=object_id, user=user).values_list(
+                "value", flat=True
+            )[:1]
+        )
+        return values[0] if values else default
+
+    def get_values(self, variable, object_ids, user=None):
+        """
+        dict of object id -> current value of the variable, for the objects that have one
+        """
+        return dict(
+            self.filter(
+                variable=variable, object_id__in=list(object_ids), user=user
+            ).values_list("object_id", "value")
+        )
+
+    def set_values(self, variable, object_values, user=None):
+        """
+        store {object id: value} for the variable, replacing the current values
+        returns the number of values written
+        """
+        return self.upsert(variable, object_values, user, add=False)
+
+    def add_values(self, variable, object_increments, user=None):
+        """
+        add {object id: increment} to the current values of the variable, missing
+        values start from 0
+        returns the number of values written
+        """
+        return self.upsert(variable, object_increments, user, add=True)
+
+    def upsert(self, variable, object_values, user, add):
+        """
+        one INSERT ... ON CONFLICT DO UPDATE per batch, atomic per row, so concurrent
+        writers neither lose updates nor create duplicate rows
+        """
+        connection = connections[self.db]
+        if connection.vendor not in ("postgresql", "sqlite"):
+            return self.upsert_rows(variable, object_values, user, add)
+
+        user_id = getattr(user, "pk", user)
+        timestamp = self.model._meta.get_field("timestamp").get_db_prep_value(
+            timezone.now(), connection
+        )
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        columns = ["variable_id", "object_id", "user_id", "value", "timestamp"]
+        if user_id is None:
+            conflict = "(variable_id, object_id) WHERE user_id IS NULL"
+        else:
+            conflict = "(variable_id, object_id, user_id) WHERE user_id IS NOT NULL"
+        if add:
+            new_value = "{}.{} + EXCLUDED.{}".format(
+                table, quote("value"), quote("value")
+            )
+        else:
+            new_value = "EXCLUDED.{}".format(quote("value"))
+
+        rows = [
+            (variable.pk, object_id, user_id, float(value), timestamp)
+            for object_id, value in object_values.items()
+        ]
+        fields = [self.model._meta.get_field(column) for column in columns]
+        batch_size = max(connection.ops.bulk_batch_size(fields, rows), 1)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start : start + batch_size]
+                cursor.execute(
+                    "INSERT INTO {table} ({columns}) VALUES {rows} "
+                    "ON CONFLICT {conflict} DO UPDATE SET {value} = {new_value}, "
+                    "{timestamp} = EXCLUDED.{timestamp}".format(
+                        table=table,
+                        columns=", ".join(quote(column) for column in columns),
+                        rows=", ".join(
+                            ["({})".format(", ".join(["%s"] * len(columns)))]
+                            * len(batch)
+                        ),
+                        conflict=conflict,
+                        value=quote("value"),
+                        new_value=new_value,
+                        timestamp=quote("timestamp"),
+                    ),
+                    [param for row in batch for param in row],
+                )
+        return len(rows)
+
+    def upsert_rows(self, variable, object_values, user, add):
+        # backends without ON CONFLICT: lock the existing rows, then write
+        with transaction.atomic(using=self.db):
+            current = {
+                row.object_id: row
+                for row in self.select_for_update().filter(
+                    variable=variable, object_id__in=list(object_values), user=user
+                )
+            }
+            now = timezone.now()
+            for object_id, value in object_values.items():
+                row = current.get(object_id)
+                if row is None:
+                    self.create(
+                        variable=variable,
+                        object_id=object_id,
+                        user=user,
+                        value=value,
+                        timestamp=now,
+                    )
+                else:
+                    row.value = row.value + value if add else value
+                    row.timestamp = now
+                    row.save(update_fields=["value", "timestamp"])
+        return len(object_values)
+
+
+class CurrentValue(models.Model):
+    """
+    current value of a variable in CURRENT_VALUE_VARIABLES for an object (and user),
+    one row per (variable, object_id, user) updated in place
+    """
+
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING)
+    variable = models.ForeignKey(Variable, on_delete=models.DO_NOTHING)
+    object_id = models.PositiveIntegerField()
+    value = models.FloatField()
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    objects = CurrentValueManager()
+
+    class Meta:
+        constraints = [
+            # NULLs never conflict in a unique index, users and no user need one each
+            models.UniqueConstraint(
+                fields=["variable", "object_id", "user"],
+                condition=models.Q(user__isnull=False),
+                name="engine_currentvalue_user_key",
+            ),
+            models.UniqueConstraint(
+                fields=["variable", "object_id"],
+                condition=models.Q(user__isnull=True),
+                name="engine_currentvalue_key",
+            ),
+        ]
+
+    def __str__(self):
+        return "{}={}, {}={}".format(
+            self.variable.name, self.value, self.variable.object_name, self.object_id
+        )
+
+    @property
+    def object_name(self):
+        return self.variable.object_name
+
+
+class CounterManager(models.Manager):
+    def increment(self, variable, object_id, amount=1.0, shards=None):
+        self.increment_many(variable, {object_id: amount}, shards)
+
+    def increment_many(self, variable, object_amounts, shards=None):
+        """
+        add {object id: amount} to the counters of the variable, with one F() update
+        of a random shard: concurrent increments neither read nor lose each other's
+        counts, and spread their row locks over the shards
+        """
+        if not object_amounts:
+            return
+        if shards is None:
+            shards = getattr(settings, "MOOCLET_COUNTER_SHARDS", 1)
+        shard = random.randrange(shards)
+        rows = self.filter(variable=variable, shard=shard)
+        # one update once the counter has a row on this shard
+        if len(object_amounts) == 1 and self.add(rows, object_amounts):
+            return
+        # objects without a row on this shard start from 0, concurrent creates of the
+        # same row are ignored
+        self.bulk_create(
+            [
+                self.model(variable=variable, object_id=object_id, shard=shard)
+                for object_id in object_amounts
+            ],
+            ignore_conflicts=True,
+        )
+        self.add(rows, object_amounts)
+
+    def add(self, rows, object_amounts):
+        """
+        add the amounts to the rows' values in one UPDATE, returns the rows updated
+        """
+        if len(object_amounts) == 1:
+            [(object_id, amount)] = object_amounts.items()
+            return rows.filter(object_id=object_id).update(
+                value=models.F("value") + float(amount)
+            )
+        return rows.filter(object_id__in=list(object_amounts)).update(
+            value=models.F("value")
+            + models.Case(
+                *[
+                    models.When(object_id=object_id, then=float(amount))
+                    for object_id, amount in object_amounts.items()
+                ],
+                output_field=models.FloatField(),
+            )
+        )
+
+    def get_count(self, variable, object_id):
+        return self.get_counts(variable, [object_id]).get(object_id, 0.0)
+
+    def get_counts(self, variable, object_ids):
+        """
+        dict of object id -> total of the shards, for the objects that have a count
+        """
+        return dict(
+            self.filter(variable=variable, object_id__in=list(object_ids))
+            .values("object_id")
+            .annotate(total=models.Sum("value"))
+            .values_list("object_id", "total")
+        )
+
+
+class Counter(models.Model):
+    """
+    one shard of the counter of a variable in COUNTER_VARIABLES for an object, the
+    count is the sum of its shards
+    """
+
+    variable = models.ForeignKey(Variable, on_delete=models.DO_NOTHING)
+    object_id = models.PositiveIntegerField()
+    shard = models.PositiveSmallIntegerField(default=0)
+    value = models.FloatField(default=0.0)
+
+    objects = CounterManager()
+
+    class Meta:
+        unique_together = (
+            "variable",
+            "object_id",
+            "shard",
+        )
+
+    def __str__(self):
+        return "{}={}, {}={} (shard {})".format(
+            self.variable.name,
+            self.value,
+            self.variable.object_name,
+            self.object_id,
+            self.shard,
+        )
+
+
+def bump_version_snapshots(version_ids):
+    """
+    mark the policy snapshots of the versions' mooclets out of date
+    """
+    mooclet_ids = (
+        Version.objects.filter(pk__in=version_ids, mooclet__isnull=False)
+        .values_list("mooclet_id", flat=True)
+        .distinct()
+    )
+    for mooclet_id in mooclet_ids:
+        snapshots.bump_stamp(mooclet_id)
+
+
+# variables whose values are summarized in ValueSummary as they are recorded
+SUMMARIZED_VARIABLES = ("student_rating", "version_rating")
+
+
+class ValueSummaryManager(models.Manager):
+    def record_value(self, value):
+        """
+        add a newly saved Value to the running summary of its variable and object
+        call it in the transaction that saved the value, so the value, its summary and
+        the policy's update are committed together
+        """
+        if value.variable.name not in SUMMARIZED_VARIABLES:
+            return
+        observation = value.value
+        summary = self.filter(variable_id=value.variable_id, object_id=value.object_id)
+        changes = {
+            "count": models.F("count") + 1,
+            "total": models.F("total") + observation,
+            "total_squares": models.F("total_squares") + observation * observation,
+        }
+        if not summary.update(**changes):
+            try:
+                with transaction.atomic():
+                    self.create(
+                        variable_id=value.variable_id,
+                        object_id=value.object_id,
+                        count=1,
+                        total=observation,
+                        total_squares=observation * observation,
+                    )
+            except IntegrityError:
+                # another request created the summary first
+                summary.update(**changes)
+
+        version = (
+            Version.objects.filter(pk=value.object_id)
+            .values_list("mooclet_id", "mooclet__policy_id")
+            .first()
+        )
+        # versions drawn ahead of time and snapshots built from the old summaries are
+        # out of date once the rating is committed, not before: another process could
+        # otherwise rebuild them from the old rows under the new stamp
+        transaction.on_commit(
+            lambda: policy_registry.clear_assignment_buffers(value.object_id)
+        )
+        if version is None or version[0] is None:
+            return
+        mooclet_id, policy_id = version
+        # policies that learn online (e.g. linucb) update their state from the rating
+        if value.variable.name == "student_rating" and policy_id is not None:
+            policy_registry.get_compiled_policy(policy_id).update(value)
+        transaction.on_commit(lambda: snapshots.bump_stamp(mooclet_id))
+
+    def get_summaries(self, variable, object_ids):
+        """
+        return a dict of object id -> ValueSummary for the variable
+        """
+        summaries = self.filter(variable=variable, object_id__in=object_ids)
+        return {summary.object_id: summary for summary in summaries}
+
+    def get_summary(self, variable, object_id):
+        """
+        return the ValueSummary for the variable and object, empty if nothing was recorded
+        """
+        summary = self.filter(variable=variable, object_id=object_id).first()
+        if summary is None:
+            summary = self.model(variable=variable, object_id=object_id)
+        return summary
+
+    def rebuild(self, variable):
+        """
+        recompute all summaries of a variable from its raw values
+        """
+        with transaction.atomic():
+            self.filter(variable=variable).delete()
+            totals = (
+                variable.value_set.values("object_id")
+                .annotate(
+                    count=models.Count("id"),
+                    total=models.Sum("value"),
+                    total_squares=models.Sum(models.F("value") * models.F("value")),
+                )
+                .values_list("object_id", "count", "total", "total_squares")
+            )
+            self.bulk_create(
+                [
+                    self.model(
+                        variable=variable,
+                        object_id=object_id,
+                        count=count,
+                        total=total,
+                        total_squares=total_squares,
+                    )
+                    for object_id, count, total, total_squares in totals
+                ]
+            )
+        bump_version_snapshots(self.filter(variable=variable).values("object_id"))
+
+
+class ValueSummary(models.Model):
+    """
+    sufficient statistics (n, sum, sum of squares) of a variable's values for one object
+    kept up to date as values are recorded, so readers don't scan the raw values
+    """
+
+    variable = models.ForeignKey(Variable, on_delete=models.DO_NOTHING)
+    object_id = models.PositiveIntegerField(null=True)
+    count = models.PositiveIntegerField(default=0)
+    total = models.FloatField(default=0.0)
+    total_squares = models.FloatField(default=0.0)
+
+    objects = ValueSummaryManager()
+
+    class Meta:
+        unique_together = (
+            "variable",
+            "object_id",
+        )
+
+    def __str__(self):
+        return "{} n={}, {}={}".format(
+            self.variable, self.count, self.variable.object_name, self.object_id
+        )
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    @property
+    def variance(self):
+        """
+        population variance, matches numpy.std
+        """
+        if not self.count:
+            return None
+        return max(self.total_squares / self.count - self.mean**2, 0.0)
+
+    @property
+    def std_dev(self):
+        if not self.count:
+            return None
+        return sqrt(self.variance)
+
+
 #################################
 #### Quiz application models ####
 #################################
@@ -406,8 +1042,389 @@ class Collaborator(models.Model):
 #     quiz = models.ForeignKey(Quiz)
 #     grade = models.FloatField()
 
-## TODO use for policies that need persistent storage (e.g. priors)
-# class VersionPolicyState(models.Model):
-#     version = models.ForeignKey(Version)
-#     policy = models.ForeignKey(Policy)
-#     state = models.FloatField()
+
+class MoocletAssignmentManager(models.Manager):
+    def get_or_assign(self, user, mooclet, choose_version):
+        """
+        return (version, created): the version previously assigned to the user for the
+        mooclet, or a new assignment made with choose_version()
+        concurrent first assignments resolve to a single row
+        """
+        version_id = (
+            self.filter(user=user, mooclet=mooclet)
+            .values_list("version_id", flat=True)
+            .first()
+        )
+        if version_id is not None:
+            return Version.objects.get(pk=version_id), False
+        version = choose_version()
+        try:
+            with transaction.atomic():
+                self.create(user=user, mooclet=mooclet, version=version)
+        except IntegrityError:
+            # another request assigned a version first, use that one
+            assignment = self.select_related("version").get(user=user, mooclet=mooclet)
+            return assignment.version, False
+        return version, True
+
+
+class MoocletAssignment(models.Model):
+    """
+    version assigned to a user for a mooclet, for policies that keep assignments stable
+    """
+
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING)
+    mooclet = models.ForeignKey(Mooclet, on_delete=models.DO_NOTHING)
+    version = models.ForeignKey(Version, on_delete=models.DO_NOTHING)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    objects = MoocletAssignmentManager()
+
+    class Meta:
+        unique_together = (
+            "user",
+            "mooclet",
+        )
+        indexes = [
+            # covers the (user, mooclet) -> version lookup
+            models.Index(
+                fields=["user", "mooclet", "version"],
+                name="engine_assign_user_version_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return "{} / {}: {}".format(self.user, self.mooclet, self.version_id)
+
+
+# process-level cache of VersionPolicyState rows, keyed by (policy_id, version_id)
+# entries are (state, time read), read again after MOOCLET_SNAPSHOT_TIMEOUT seconds
+# so changes made by other processes are seen
+_version_policy_states = {}
+
+
+class VersionPolicyStateManager(models.Manager):
+    def get_states(self, policy, version_ids, create=True, fresh=False, **defaults):
+        """
+        return a dict of version id -> VersionPolicyState for the policy
+        rows are cached per process for a while and created with defaults if missing
+        create=False leaves the table as it is, missing states are unsaved defaults
+        fresh=True reads every row from the database
+        """
+        now = monotonic()
+        timeout = getattr(settings, "MOOCLET_SNAPSHOT_TIMEOUT", 60)
+        states = {}
+        missing = []
+        for version_id in version_ids:
+            cached = (
+                None if fresh else _version_policy_states.get((policy.pk, version_id))
+            )
+            if cached is None or now - cached[1] > timeout:
+                missing.append(version_id)
+            else:
+                states[version_id] = cached[0]
+        if not missing:
+            return states
+        found = {
+            state.version_id: state
+            for state in self.filter(policy=policy, version_id__in=missing)
+        }
+        absent = [version_id for version_id in missing if version_id not in found]
+        if absent and create:
+            self.bulk_create(
+                [
+                    self.model(policy=policy, version_id=version_id, **defaults)
+                    for version_id in absent
+                ],
+                ignore_conflicts=True,
+            )
+            for state in self.filter(policy=policy, version_id__in=absent):
+                found[state.version_id] = state
+        for version_id in missing:
+            state = found.get(version_id)
+            if state is None:
+                state = self.model(policy=policy, version_id=version_id, **defaults)
+            else:
+                _version_policy_states[(policy.pk, version_id)] = (state, now)
+            states[version_id] = state
+        return states
+
+    def lock_state(self, policy, version_id, **defaults):
+        """
+        the version's state row locked for update, inside a transaction
+        read again (and created) if it was deleted since it was cached
+        """
+        state = self.get_states(policy, [version_id], **defaults)[version_id]
+        try:
+            return self.select_for_update().get(pk=state.pk)
+        except self.model.DoesNotExist:
+            state = self.get_states(policy, [version_id], fresh=True, **defaults)[
+                version_id
+            ]
+            return self.select_for_update().get(pk=state.pk)
+
+    def update_state(self, state, **fields):
+        """
+        write the given fields only if they differ from the stored state
+        """
+        changed = {
+            field: value
+            for field, value in fields.items()
+            if getattr(state, field) != value
+        }
+        if changed:
+            self.filter(pk=state.pk).update(**changed)
+            for field, value in changed.items():
+                setattr(state, field, value)
+        return state
+
+
+class VersionPolicyState(models.Model):
+    """
+    persistent storage for policies, one row per version and policy (e.g. priors)
+    """
+
+    version = models.ForeignKey(Version, on_delete=models.DO_NOTHING)
+    policy = models.ForeignKey(Policy, on_delete=models.DO_NOTHING)
+    prior_success = models.FloatField(default=1.0)
+    prior_failure = models.FloatField(default=1.0)
+    posterior_success = models.FloatField(null=True, blank=True)
+    posterior_failure = models.FloatField(null=True, blank=True)
+    # packed float64 arrays of linear policies (see policies.pack_linear_state)
+    linear_state = models.BinaryField(null=True, blank=True)
+    # exponentially decayed rating counts, as of decayed_at
+    decayed_success = models.FloatField(default=0.0)
+    decayed_failure = models.FloatField(default=0.0)
+    decayed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = VersionPolicyStateManager()
+
+    class Meta:
+        unique_together = (
+            "version",
+            "policy",
+        )
+
+    def __str__(self):
+        return "{} / {}".format(self.policy, self.version_id)
+
+
+class RecomputeRequestManager(models.Manager):
+    def enqueue(self, mooclet, question=None):
+        """
+        schedule a recompute of the mooclet's intermediate variables and probabilities
+        requests for a mooclet that is already scheduled are merged into the pending one
+        """
+        debounce = getattr(settings, "MOOCLET_RECOMPUTE_DEBOUNCE", 30)
+        pending = self.filter(mooclet=mooclet)
+        # a request a worker is running may have read the data before this change,
+        # release it so it runs again
+        pending.filter(claimed_at__isnull=False).update(
+            claimed_at=None, due_at=timezone.now() + timedelta(seconds=debounce)
+        )
+        if question is not None:
+            if pending.update(question=question):
+                return
+        elif pending.exists():
+            return
+        try:
+            with transaction.atomic():
+                self.create(
+                    mooclet=mooclet,
+                    question=question,
+                    due_at=timezone.now() + timedelta(seconds=debounce),
+                )
+        except IntegrityError:
+            # another request scheduled the mooclet first
+            if question is not None:
+                pending.update(question=question)
+
+    def claim_due(self, limit=None):
+        """
+        claim and return the requests that are due
+        claimed requests are left in the table, due again once
+        MOOCLET_RECOMPUTE_LEASE has passed, so the work of a worker that dies is
+        picked up by another. complete() or retry() them once processed
+        """
+        lease = getattr(settings, "MOOCLET_RECOMPUTE_LEASE", 600)
+        now = timezone.now()
+        with transaction.atomic():
+            due = (
+                self.select_for_update(skip_locked=True)
+                .filter(due_at__lte=now)
+                .order_by("due_at")
+            )
+            if limit:
+                due = due[:limit]
+            requests = list(due)
+            self.filter(pk__in=[request.pk for request in requests]).update(
+                claimed_at=now, due_at=now + timedelta(seconds=lease)
+            )
+        for request in requests:
+            request.claimed_at = now
+        return requests
+
+    def complete(self, requests):
+        """
+        remove the processed requests, unless they were enqueued again (or claimed
+        again after their lease ran out) in the meantime
+        """
+        claims = {}
+        for request in requests:
+            claims.setdefault(request.claimed_at, []).append(request.pk)
+        for claimed_at, request_ids in claims.items():
+            self.filter(pk__in=request_ids, claimed_at=claimed_at).delete()
+
+    def retry(self, request, error=""):
+        """
+        release a request that failed, due again after a delay doubling with each
+        failed attempt (MOOCLET_RECOMPUTE_RETRY_DELAY, at most an hour)
+        """
+        delay = getattr(settings, "MOOCLET_RECOMPUTE_RETRY_DELAY", 60)
+        delay = min(delay * 2**request.attempts, 3600)
+        self.filter(pk=request.pk, claimed_at=request.claimed_at).update(
+            claimed_at=None,
+            attempts=models.F("attempts") + 1,
+            last_error=str(error)[:1000],
+            due_at=timezone.now() + timedelta(seconds=delay),
+        )
+
+
+class RecomputeRequest(models.Model):
+    """
+    pending recompute of a mooclet's intermediate variables, processed by the
+    run_recompute_worker command. at most one per mooclet
+    """
+
+    mooclet = models.OneToOneField(Mooclet, on_delete=models.DO_NOTHING)
+    # question whose answer proportions should be updated too
+    question = models.ForeignKey(
+        Question, null=True, blank=True, on_delete=models.DO_NOTHING
+    )
+    requested = models.DateTimeField(auto_now_add=True)
+    due_at = models.DateTimeField(db_index=True)
+    # set while a worker processes the request
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    # failed attempts so far, and the error of the last one
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    objects = RecomputeRequestManager()
+
+    def __str__(self):
+        return "{} due {}".format(self.mooclet, self.due_at)
+
+
+@receiver([post_save, post_delete], sender=VersionPolicyState)
+def clear_version_policy_state(sender, instance, **kwargs):
+    _version_policy_states.pop((instance.policy_id, instance.version_id), None)
+
+
+class AssignmentLogManager(models.Manager):
+    def log(self, mooclet, version, user, policy, propensity):
+        """
+        append an assignment to the log
+        """
+        self.log_many(mooclet, policy, [(version, user, propensity)])
+
+    def log_many(self, mooclet, policy, assignments):
+        """
+        append (version, user, propensity) assignments to the log, in one insert
+        """
+        now = timezone.now()
+        self.bulk_create(
+            [
+                self.model(
+                    mooclet_id=mooclet.pk,
+                    version_id=version.pk,
+                    # anonymous users aren't logged by id
+                    user_id=getattr(user, "pk", None),
+                    policy_id=policy.pk,
+                    propensity=propensity,
+                    timestamp=now,
+                )
+                for version, user, propensity in assignments
+                if version is not None
+            ]
+        )
+
+
+class AssignmentLog(models.Model):
+    """
+    append-only log of assignments with the probability the policy had of choosing
+    the assigned version (propensity), for offline policy evaluation
+    """
+
+    mooclet = models.ForeignKey(Mooclet, on_delete=models.DO_NOTHING)
+    version = models.ForeignKey(Version, on_delete=models.DO_NOTHING)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.DO_NOTHING)
+    policy = models.ForeignKey(Policy, null=True, on_delete=models.DO_NOTHING)
+    # null when the policy doesn't report its probabilities
+    propensity = models.FloatField(null=True, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    objects = AssignmentLogManager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["mooclet", "timestamp"], name="engine_assignlog_mooclet_idx"
+            )
+        ]
+
+    def __str__(self):
+        return "{} / {}: {} ({})".format(
+            self.user_id, self.mooclet_id, self.version_id, self.propensity
+        )
+
+
+@receiver([post_save, post_delete], sender=VersionPolicyState)
+def clear_version_policy_snapshots(sender, instance, **kwargs):
+    bump_version_snapshots([instance.version_id])
+
+
+@receiver([post_save, post_delete])
+def clear_mooclet_snapshots(sender, instance, **kwargs):
+    # any Version subclass, e.g. Explanation
+    if isinstance(instance, Version) and instance.mooclet_id is not None:
+        snapshots.clear_version_ids(instance.mooclet_id)
+        snapshots.bump_stamp(instance.mooclet_id)
+
+
+@receiver([post_save, post_delete], sender=Policy)
+def clear_compiled_policy(sender, instance, **kwargs):
+    policy_registry.clear_compiled_policies(instance.pk)
+    # other processes rebuild theirs once the stamp changes
+    snapshots.bump_policy_stamp(instance.pk)
+
+
+@receiver(m2m_changed, sender=Policy.variables.through)
+def clear_compiled_policy_variables(sender, instance, **kwargs):
+    if isinstance(instance, Policy):
+        policy_registry.clear_compiled_policies(instance.pk)
+        snapshots.bump_policy_stamp(instance.pk)
+    else:
+        policy_registry.clear_compiled_policies()
+        snapshots.bump_variables_stamp()
+
+
+@receiver([post_save, post_delete], sender=Variable)
+def clear_compiled_policies(sender, instance, **kwargs):
+    # compiled policies hold Variable rows
+    policy_registry.clear_compiled_policies()
+    snapshots.bump_variables_stamp()
+
+
+@receiver([post_save, post_delete], sender=Variable)
+def clear_variable_cache(sender, instance, **kwargs):
+    # other processes reload theirs once the variables stamp changes, bumped by
+    # clear_compiled_policies
+    _variable_cache.update(by_name=None, by_id=None, stamp=None)
+
+
+@receiver([post_save, post_delete], sender=Value)
+def bump_weight_table_snapshots(sender, instance, **kwargs):
+    # weighted_random alias tables are snapshots of the version weights
+    variable = Variable.objects.get_cached_by_id(instance.variable_id)
+    if variable is not None and variable.name == "version_weight":
+        bump_version_snapshots([instance.object_id])
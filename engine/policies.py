@@ -1,148 +1,649 @@
 from django.apps import apps
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Avg
+from django.db import transaction
 from django.urls import reverse
+from django.utils import timezone
+from numpy import (
+    argmax,
+    array,
+    concatenate,
+    flatnonzero,
+    frombuffer,
+    identity,
+    maximum,
+    outer,
+    sqrt,
+    zeros,
+)
 from numpy.random import beta, choice
 
+from . import sampling, snapshots
+
 # arguments to policies:
 
 # variables: list of variable objects, can be used to retrieve related data
 # context: dict passed from view, contains current user, course, quiz, question context
+# size (optional): number of independent assignments to draw at once, as in numpy.random
+#   policies that accept it return a list of versions instead of a single version
+
+# policies record the probability they had of choosing the returned version in
+# context["propensity"] (context["propensities"], a list, when drawing size versions)
+# Mooclet.get_version logs it with the assignment, for offline evaluation
+
+
+def set_propensities(context, probabilities, drawn, size=None):
+    """
+    record the probabilities of the drawn indices, probabilities is indexed like versions
+    """
+    if size is None:
+        context["propensity"] = float(probabilities[drawn])
+    else:
+        context["propensities"] = [float(probabilities[i]) for i in drawn]
+
+
+def load_versions(version_ids, drawn, size=None):
+    """
+    load the drawn versions (indices into version_ids) with their explanations
+    """
+    Version = apps.get_model("engine", "Version")
+    versions = Version.objects.select_related("explanation")
+    if size is None:
+        return versions.get(pk=version_ids[drawn])
+    drawn_ids = [version_ids[i] for i in drawn]
+    loaded = versions.in_bulk(set(drawn_ids))
+    return [loaded[version_id] for version_id in drawn_ids]
+
+
+def draw_version_ids(version_ids, size=None, context=None):
+    """
+    uniform draw from the cached version ids, loading only the drawn versions
+    """
+    if not version_ids:
+        return None
+    drawn = choice(len(version_ids), size=size)
+    if context is not None:
+        set_propensities(
+            context, [1.0 / len(version_ids)] * len(version_ids), drawn, size
+        )
+    return load_versions(version_ids, drawn, size)
+
 
+def uniform_random(variables, context, size=None):
+    return draw_version_ids(
+        context["mooclet"].get_version_ids(), size=size, context=context
+    )
 
-def uniform_random(variables, context):
-    return choice(context["mooclet"].version_set.all())
 
+def get_weight_table(variables, context):
+    """
+    return (version ids, AliasTable) built from the normalized version weights of the mooclet
+    cached with the mooclet's snapshots, rebuilt once a weight or version changes
+    """
 
-def weighted_random(variables, context):
-    Weight = variables.get(name="version_weight")
-    weight_data = Weight.get_data(context)
+    def build():
+        Weight = variables.get(name="version_weight")
+        weight_data = Weight.get_data(context).values_list("object_id", "value")
+        version_ids = [version_id for version_id, weight in weight_data]
+        weights = [weight for version_id, weight in weight_data]
+        return version_ids, sampling.AliasTable(weights)
 
-    versions = [weight.version for weight in weight_data]
-    weights = [weight.value for weight in weight_data]
-    return choice(versions, p=weights)
+    return snapshots.get_snapshot(
+        context["mooclet"].pk,
+        "weight_table:{}".format(context["policy"].pk),
+        build,
+    )
 
 
-def thompson_sampling_placeholder(variables, context):
-    return choice(context["mooclet"].version_set.all())
+def weighted_random(variables, context, size=None):
+    version_ids, weight_table = get_weight_table(variables, context)
 
+    drawn = weight_table.sample(size)
+    set_propensities(context, weight_table.probabilities, drawn, size)
+    return load_versions(version_ids, drawn, size)
 
-def thompson_sampling(variables, context):
-    versions = context["versions"]
-    # import models individually to avoid circular dependency
+
+def thompson_sampling_placeholder(variables, context, size=None):
+    return draw_version_ids(
+        context["mooclet"].get_version_ids(), size=size, context=context
+    )
+
+
+def get_rating_totals(version_ids):
+    """
+    count and sum of student ratings for each version id, read from their summaries
+    returns two float arrays aligned with version_ids
+    """
     Variable = apps.get_model("engine", "Variable")
-    Value = apps.get_model("engine", "Value")
-    Version = apps.get_model("engine", "Version")
-    version_content_type = ContentType.objects.get_for_model(Version)
-    # priors we set by hand - will use instructor rating and confidence in future
-    prior_success = 1.9
-    prior_failure = 0.1
+    ValueSummary = apps.get_model("engine", "ValueSummary")
+    student_rating = Variable.objects.get_cached("student_rating", first=True)
+    rating_totals = ValueSummary.objects.filter(
+        variable=student_rating, object_id__in=version_ids
+    ).values_list("object_id", "count", "total")
+    index = {version_id: i for i, version_id in enumerate(version_ids)}
+    counts = zeros(len(version_ids))
+    totals = zeros(len(version_ids))
+    for version_id, count, total in rating_totals:
+        counts[index[version_id]] = count
+        totals[index[version_id]] = total
+    return counts, totals
+
+
+# priors we set by hand - will use instructor rating and confidence in future
+THOMPSON_PRIORS = {"prior_success": 1.9, "prior_failure": 0.1}
+
+
+def get_thompson_priors(policy, version_ids, create=True, fresh=False):
+    """
+    VersionPolicyState for each version id, with their prior (success, failure) arrays
+    create=False doesn't store the states of versions that have none, fresh=True
+    reads them from the database rather than the process-level cache
+    """
+    VersionPolicyState = apps.get_model("engine", "VersionPolicyState")
+    states = VersionPolicyState.objects.get_states(
+        policy, version_ids, create=create, fresh=fresh, **THOMPSON_PRIORS
+    )
+    prior_success = array(
+        [states[version_id].prior_success for version_id in version_ids]
+    )
+    prior_failure = array(
+        [states[version_id].prior_failure for version_id in version_ids]
+    )
+    return states, prior_success, prior_failure
+
+
+def thompson_posteriors(rating_counts, rating_totals, prior_success, prior_failure):
+    """
+    beta posterior parameters (successes, failures) from rating counts and sums
+    """
     # max value of version rating, from qualtrics
     max_rating = 1
+    # ratings are scaled by 0.1 before they count as successes
+    rating_totals = rating_totals * 0.1
 
-    version_to_show = None
-    max_beta = 0
+    successes = rating_totals + prior_success
+    failures = (max_rating * rating_counts) - rating_totals + prior_failure
+    return successes, failures
 
-    for version in versions:
-        student_ratings = (
-            Variable.objects.get(name="student_rating")
-            .get_data({"version": version})
-            .all()
+
+def store_thompson_posteriors(states, version_ids, successes, failures):
+    VersionPolicyState = apps.get_model("engine", "VersionPolicyState")
+    for version_id, success, failure in zip(version_ids, successes, failures):
+        VersionPolicyState.objects.update_state(
+            states[version_id],
+            posterior_success=float(success),
+            posterior_failure=float(failure),
         )
-        rating_count = student_ratings.count()
-        rating_average = student_ratings.aggregate(Avg("value"))
-        rating_average = rating_average["value__avg"]
-        if rating_average is None:
-            rating_average = 0
-        else:
-            rating_average = rating_average * 0.1
-
-        # get instructor conf and use for priors later
-        # add priors to db
-        prior_success_db, created = Variable.objects.get_or_create(
-            name="thompson_prior_success", content_type=version_content_type
+
+
+def get_thompson_parameters(policy, version_ids, read_only=False):
+    """
+    beta posterior parameters (successes, failures) for each version id
+    priors come from VersionPolicyState, posteriors are only written back when they change
+    read_only=True writes nothing
+    """
+    states, prior_success, prior_failure = get_thompson_priors(
+        policy, version_ids, create=not read_only
+    )
+    rating_counts, rating_totals = get_rating_totals(version_ids)
+    successes, failures = thompson_posteriors(
+        rating_counts, rating_totals, prior_success, prior_failure
+    )
+    if not read_only:
+        store_thompson_posteriors(states, version_ids, successes, failures)
+    return successes, failures
+
+
+def get_thompson_snapshot(mooclet, policy):
+    """
+    (version ids, successes, failures) of the mooclet, from its cached snapshot
+    """
+
+    def build():
+        version_ids = list(mooclet.get_version_ids())
+        # snapshots are rebuilt when the priors change, read them from the db
+        states, prior_success, prior_failure = get_thompson_priors(
+            policy, version_ids, fresh=True
         )
-        prior_success_db_value = Value.objects.filter(
-            variable=prior_success_db, object_id=version.id
-        ).last()
-        if prior_success_db_value:
-            # there is already a value, so update it
-            prior_success_db_value.value = prior_success
-            prior_success_db_value.save()
-        else:
-            # no db value
-            prior_success_db_value = Value.objects.create(
-                variable=prior_success_db, object_id=version.id, value=prior_success
-            )
+        rating_counts, rating_totals = get_rating_totals(version_ids)
+        successes, failures = thompson_posteriors(
+            rating_counts, rating_totals, prior_success, prior_failure
+        )
+        store_thompson_posteriors(states, version_ids, successes, failures)
+        return {
+            "version_ids": version_ids,
+            "rating_counts": rating_counts.tolist(),
+            "rating_totals": rating_totals.tolist(),
+            "prior_success": prior_success.tolist(),
+            "prior_failure": prior_failure.tolist(),
+        }
+
+    snapshot = snapshots.get_snapshot(
+        mooclet.pk, "thompson_sampling:{}".format(policy.pk), build
+    )
+    successes, failures = thompson_posteriors(
+        array(snapshot["rating_counts"]),
+        array(snapshot["rating_totals"]),
+        array(snapshot["prior_success"]),
+        array(snapshot["prior_failure"]),
+    )
+    return snapshot["version_ids"], successes, failures
+
+
+def get_probability_settings():
+    """
+    keyword arguments for sampling.win_probabilities, from the django settings
+    """
+    return {
+        "method": getattr(settings, "MOOCLET_PROBABILITY_METHOD", "quadrature"),
+        "tolerance": getattr(
+            settings, "MOOCLET_PROBABILITY_TOLERANCE", sampling.DEFAULT_TOLERANCE
+        ),
+        "standard_error": getattr(
+            settings,
+            "MOOCLET_SIMULATION_STANDARD_ERROR",
+            sampling.DEFAULT_STANDARD_ERROR,
+        ),
+    }
+
+
+def get_win_probabilities(mooclet, policy, successes, failures):
+    """
+    probability of each version having the largest beta draw, cached with the
+    mooclet's snapshots so it is only computed again once the posteriors change
+    """
+    return snapshots.get_snapshot(
+        mooclet.pk,
+        "win_probabilities:{}".format(policy.pk),
+        lambda: sampling.win_probabilities(
+            successes, failures, **get_probability_settings()
+        ),
+    )
+
+
+def draw_beta_versions(
+    version_ids,
+    successes,
+    failures,
+    size=None,
+    versions=None,
+    context=None,
+    probabilities=None,
+):
+    """
+    thompson sampling draw from beta posteriors, versions are loaded by id if not given
+    probabilities of each version being drawn are recorded in context if given
+    """
+    if size is None:
+        # one beta draw per version, all versions at once
+        drawn = argmax(beta(successes, failures))
+    else:
+        # one row of beta draws per assignment
+        drawn = argmax(beta(successes, failures, size=(size, len(version_ids))), axis=1)
+    if context is not None and probabilities is not None:
+        set_propensities(context, probabilities, drawn, size)
+
+    if versions is None:
+        return load_versions(version_ids, drawn, size)
+    if size is None:
+        return versions[drawn]
+    return [versions[i] for i in drawn]
+
+
+def thompson_sampling(variables, context, size=None):
+    if "mooclet" in context:
+        # posterior inputs come from the cache, versions are loaded once drawn
+        version_ids, successes, failures = get_thompson_snapshot(
+            context["mooclet"], context["policy"]
+        )
+        if not version_ids:
+            return None
+        probabilities = get_win_probabilities(
+            context["mooclet"], context["policy"], successes, failures
+        )
+        return draw_beta_versions(
+            version_ids,
+            successes,
+            failures,
+            size,
+            context=context,
+            probabilities=probabilities,
+        )
+    versions = list(context["versions"])
+    version_ids = [version.pk for version in versions]
+    if not version_ids:
+        return None
+    successes, failures = get_thompson_parameters(context["policy"], version_ids)
+    return draw_beta_versions(version_ids, successes, failures, size, versions)
 
-        prior_failure_db, created = Variable.objects.get_or_create(
-            name="thompson_prior_failure", content_type=version_content_type
+
+def get_half_life(policy):
+    # seconds, from the half_life_days policy parameter
+    return policy.get_parameters().get("half_life_days", 14) * 86400.0
+
+
+def get_decay_time(policy):
+    """
+    the current time rounded down to decay_step_seconds (policy parameter, default
+    60): counts decayed to the same time give the same posteriors, so their win
+    probabilities can be cached
+    """
+    step = policy.get_parameters().get("decay_step_seconds", 60)
+    now = timezone.now().timestamp()
+    return now - now % step
+
+
+def get_decayed_parameters(mooclet, policy, decay_time=None, read_only=False):
+    """
+    (version ids, successes, failures) of the mooclet with the rating counts decayed
+    to decay_time (a timestamp, defaults to now), from its cached snapshot
+    read_only=True reads the counts without creating missing states or a snapshot
+    """
+    VersionPolicyState = apps.get_model("engine", "VersionPolicyState")
+
+    def build():
+        version_ids = list(mooclet.get_version_ids())
+        states, prior_success, prior_failure = get_thompson_priors(
+            policy, version_ids, create=not read_only, fresh=True
         )
-        prior_failure_db_value = Value.objects.filter(
-            variable=prior_failure_db, object_id=version.id
-        ).last()
-        if prior_failure_db_value:
-            # there is already a value, so update it
-            prior_failure_db_value.value = prior_failure
-            prior_failure_db_value.save()
-        else:
-            # no db value
-            prior_failure_db_value = Value.objects.create(
-                variable=prior_failure_db, object_id=version.id, value=prior_failure
+        # the counts change with every rating, read them from the db rather than
+        # the process-level cache of states
+        decayed = {
+            version_id: (success, failure, timestamp)
+            for version_id, success, failure, timestamp in VersionPolicyState.objects.filter(
+                policy=policy, version_id__in=version_ids
+            ).values_list(
+                "version_id", "decayed_success", "decayed_failure", "decayed_at"
             )
+        }
+        # versions without a state yet have no counts
+        counts = [
+            decayed.get(version_id, (0.0, 0.0, None)) for version_id in version_ids
+        ]
+        return {
+            "version_ids": version_ids,
+            "prior_success": prior_success.tolist(),
+            "prior_failure": prior_failure.tolist(),
+            "decayed_success": [success for success, failure, timestamp in counts],
+            "decayed_failure": [failure for success, failure, timestamp in counts],
+            "decayed_at": [
+                timestamp.timestamp() if timestamp else 0.0
+                for success, failure, timestamp in counts
+            ],
+        }
 
-        # TODO - log to db later?
-        successes = (rating_average * rating_count) + prior_success
-        failures = (
-            (max_rating * rating_count)
-            - (rating_average * rating_count)
-            + prior_failure
+    if read_only:
+        snapshot = build()
+    else:
+        snapshot = snapshots.get_snapshot(
+            mooclet.pk, "decayed_thompson_sampling:{}".format(policy.pk), build
         )
+    # counts were last decayed at decayed_at, bring them up to decay_time
+    if decay_time is None:
+        decay_time = timezone.now().timestamp()
+    elapsed = maximum(decay_time - array(snapshot["decayed_at"]), 0.0)
+    factor = 0.5 ** (elapsed / get_half_life(policy))
+    successes = array(snapshot["prior_success"]) + factor * array(
+        snapshot["decayed_success"]
+    )
+    failures = array(snapshot["prior_failure"]) + factor * array(
+        snapshot["decayed_failure"]
+    )
+    return snapshot["version_ids"], successes, failures
 
-        version_beta = beta(successes, failures)
 
-        if version_beta > max_beta:
-            max_beta = version_beta
-            version_to_show = version
+def decayed_thompson_sampling(variables, context, size=None):
+    """
+    thompson sampling on exponentially decayed rating counts, so older ratings count
+    less as explanation quality changes over a semester
+    parameters: half_life_days (default 14)
+    """
+    mooclet = context["mooclet"]
+    policy = context["policy"]
+    # the draw and its recorded probabilities use the same decayed posteriors
+    decay_time = get_decay_time(policy)
+    version_ids, successes, failures = get_decayed_parameters(
+        mooclet, policy, decay_time
+    )
+    if not version_ids:
+        return None
+    probabilities = snapshots.get_snapshot(
+        mooclet.pk,
+        "decayed_win_probabilities:{}:{}".format(policy.pk, decay_time),
+        lambda: sampling.win_probabilities(
+            successes, failures, **get_probability_settings()
+        ),
+    )
+    return draw_beta_versions(
+        version_ids,
+        successes,
+        failures,
+        size,
+        context=context,
+        probabilities=probabilities,
+    )
 
-    return version_to_show
 
+def decayed_thompson_sampling_update(variables, context, value):
+    """
+    decay the rated version's counts to now and add the new rating, in constant time
+    """
+    VersionPolicyState = apps.get_model("engine", "VersionPolicyState")
+    policy = context["policy"]
+    # max value of version rating, from qualtrics
+    max_rating = 1
+    # ratings are scaled by 0.1 before they count as successes
+    reward = value.value * 0.1
 
-def check_version(variable, user, mooclet):
-    Variable = apps.get_model("engine", "Variable")
+    now = timezone.now()
+    with transaction.atomic():
+        state = VersionPolicyState.objects.lock_state(
+            policy, value.object_id, **THOMPSON_PRIORS
+        )
+        factor = 1.0
+        if state.decayed_at is not None:
+            elapsed = (now - state.decayed_at).total_seconds()
+            factor = 0.5 ** (max(elapsed, 0.0) / get_half_life(policy))
+        VersionPolicyState.objects.filter(pk=state.pk).update(
+            decayed_success=state.decayed_success * factor + reward,
+            decayed_failure=state.decayed_failure * factor + max_rating - reward,
+            decayed_at=now,
+        )
+
+
+def get_feature_variables(variables):
+    """
+    user variables of the policy used as context features, in a stable order
+    """
+    return sorted(
+        (
+            variable
+            for variable in variables.filter(is_user_variable=True)
+            if variable.name != "student_rating"
+        ),
+        key=lambda variable: variable.pk,
+    )
+
+
+def get_user_features(feature_variables, user):
+    """
+    context vector: a constant 1 followed by the user's latest value of each feature
+    variable (0 when missing or for anonymous users)
+    """
     Value = apps.get_model("engine", "Value")
-    Version = apps.get_model("engine", "Version")
-    Mooclet = apps.get_model("engine", "Mooclet")
-    version_ids = mooclet.version_set.all().values_list("id", flat=True)
-    # version_content_type = ContentType.objects.get_for_model(Version)
-    return Value.objects.filter(
-        user=user, variable=variable, object_id__in=version_ids
-    ).first()
+    features = zeros(len(feature_variables) + 1)
+    features[0] = 1.0
+    if user is None or not feature_variables:
+        return features
+    index = {variable.pk: i + 1 for i, variable in enumerate(feature_variables)}
+    # ordered by id so the latest value of each variable wins
+    latest = dict(
+        Value.objects.filter(user=user, variable_id__in=list(index))
+        .order_by("id")
+        .values_list("variable_id", "value")
+    )
+    for variable_id, value in latest.items():
+        features[index[variable_id]] = value
+    return features
+
+
+def get_users_features(feature_variables, users):
+    """
+    context vectors of many users at once, as in get_user_features: {user id: vector}
+    users without values are left out
+    """
+    Value = apps.get_model("engine", "Value")
+    index = {variable.pk: i + 1 for i, variable in enumerate(feature_variables)}
+    features = {}
+    if not index:
+        return features
+    # ordered by id so the latest value of each variable wins
+    values = (
+        Value.objects.filter(user_id__in=list(users), variable_id__in=list(index))
+        .order_by("id")
+        .values_list("user_id", "variable_id", "value")
+    )
+    for user_id, variable_id, value in values.iterator():
+        if user_id not in features:
+            features[user_id] = zeros(len(index) + 1)
+            features[user_id][0] = 1.0
+        features[user_id][index[variable_id]] = value
+    return features
+
+
+def linucb_scores(a_inverse, b, features, alpha):
+    """
+    upper confidence bound of every version for one context vector, from the
+    versions' A inverses (versions, d, d) and b vectors (versions, d)
+    """
+    # all versions at once: estimate theta = A^-1 b, bound sqrt(x^T A^-1 x)
+    a_inverse_x = a_inverse @ features
+    return (b * a_inverse_x).sum(axis=1) + alpha * sqrt(a_inverse_x @ features)
+
+
+def linear_update(a_inverse, b, features, reward):
+    """
+    add one rated context to a version's A inverse and b in place, with the
+    sherman-morrison rank-one update instead of inverting A again
+    """
+    a_inverse_x = a_inverse @ features
+    a_inverse -= outer(a_inverse_x, a_inverse_x) / (1.0 + features @ a_inverse_x)
+    b += reward * features
+
+
+def pack_linear_state(a_inverse, b):
+    return concatenate([a_inverse.ravel(), b]).tobytes()
+
+
+def unpack_linear_state(data, dimension, ridge):
+    """
+    (A inverse, b) of one version, the ridge prior if nothing (or a different
+    number of features) was stored
+    """
+    if data is not None:
+        state = frombuffer(bytes(data), dtype=float)
+        if len(state) == dimension * dimension + dimension:
+            return (
+                state[: dimension * dimension].reshape(dimension, dimension).copy(),
+                state[dimension * dimension :].copy(),
+            )
+    return identity(dimension) / ridge, zeros(dimension)
+
+
+def get_linear_snapshot(mooclet, policy, dimension, ridge):
+    """
+    (version ids, A inverses (versions, d, d), b vectors (versions, d)) of the mooclet,
+    from its cached snapshot
+    """
+    VersionPolicyState = apps.get_model("engine", "VersionPolicyState")
+
+    def build():
+        version_ids = list(mooclet.get_version_ids())
+        stored = dict(
+            VersionPolicyState.objects.filter(
+                policy=policy, version_id__in=version_ids
+            ).values_list("version_id", "linear_state")
+        )
+        states = [
+            unpack_linear_state(stored.get(version_id), dimension, ridge)
+            for version_id in version_ids
+        ]
+        return {
+            "version_ids": version_ids,
+            "a_inverse": array([a_inverse for a_inverse, b in states]),
+            "b": array([b for a_inverse, b in states]),
+        }
+
+    snapshot = snapshots.get_snapshot(
+        mooclet.pk, "linucb:{}:{}".format(policy.pk, dimension), build
+    )
+    return snapshot["version_ids"], snapshot["a_inverse"], snapshot["b"]
+
+
+def linucb(variables, context):
+    """
+    linear upper confidence bound (Li et al. 2010), one ridge regression of the scaled
+    rating on the user's features per version
+    parameters: alpha (width of the confidence bound), ridge (regularization)
+    """
+    parameters = context["policy"].get_parameters()
+    alpha = parameters.get("alpha", 1.0)
+    ridge = parameters.get("ridge", 1.0)
+
+    features = get_user_features(get_feature_variables(variables), context.get("user"))
+    version_ids, a_inverse, b = get_linear_snapshot(
+        context["mooclet"], context["policy"], len(features), ridge
+    )
+    if not version_ids:
+        return None
+    scores = linucb_scores(a_inverse, b, features, alpha)
+    # ties (e.g. before any rating) are broken at random
+    best = flatnonzero(scores >= scores.max() - 1e-12)
+    context["propensity"] = 1.0 / len(best)
+    return load_versions(version_ids, choice(best))
+
+
+def linucb_update(variables, context, value):
+    """
+    rank-one (sherman-morrison) update of the rated version's A inverse and b
+    """
+    VersionPolicyState = apps.get_model("engine", "VersionPolicyState")
+    policy = context["policy"]
+    ridge = policy.get_parameters().get("ridge", 1.0)
+    features = get_user_features(get_feature_variables(variables), context.get("user"))
+    # ratings are scaled by 0.1, as in thompson_sampling
+    reward = value.value * 0.1
+
+    with transaction.atomic():
+        state = VersionPolicyState.objects.lock_state(policy, value.object_id)
+        a_inverse, b = unpack_linear_state(state.linear_state, len(features), ridge)
+        linear_update(a_inverse, b, features, reward)
+        VersionPolicyState.objects.filter(pk=state.pk).update(
+            linear_state=pack_linear_state(a_inverse, b)
+        )
 
 
 def prompt_shortlong_condition(variables, context):
     user = context["user"]
+    mooclet = context["mooclet"]
 
     Variable = apps.get_model("engine", "Variable")
     Value = apps.get_model("engine", "Value")
-    Version = apps.get_model("engine", "Version")
-    # Mooclet = apps.get_model('engine', 'Mooclet')
-    version_content_type = ContentType.objects.get_for_model(Version)
-    condition_var = Variable.objects.get(name="edxshortlongcondition")
+    MoocletAssignment = apps.get_model("engine", "MoocletAssignment")
 
     # use the pk of the mooclet version as the condition value?
     # or a bunch of if statements?
-    # check if a version has been previously assigned
-    previous_condition_value = check_version(condition_var, user, context["mooclet"])
-
-    if previous_condition_value is not None:
-        mooclet_version = Version.objects.get(pk=previous_condition_value.object_id)
+    # reuse the version previously assigned to this user, if any
+    versions = mooclet.version_set.all()
+    mooclet_version, created = MoocletAssignment.objects.get_or_assign(
+        user, mooclet, lambda: choice(versions)
+    )
+    # a returning user gets their earlier version for certain
+    context["propensity"] = 1.0 / len(versions) if created else 1.0
 
-        return mooclet_version
-
-    else:
+    if created:
+        condition_var = Variable.objects.get_cached("edxshortlongcondition")
         value = 0
-        mooclet_version = choice(context["mooclet"].version_set.all())
         if mooclet_version.explanation.text == "shortnoprompt":
             value = 12
         elif mooclet_version.explanation.text == "shortexplanationprompt":
@@ -155,4 +656,4 @@ def prompt_shortlong_condition(variables, context):
             variable=condition_var, user=user, object_id=mooclet_version.pk, value=value
         )
         condition.save()
-        return mooclet_version
+    return mooclet_version
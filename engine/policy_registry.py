@@ -0,0 +1,226 @@
+from collections import deque
+from inspect import signature
+from time import monotonic
+
+from django.apps import apps
+
+from . import policies, policy_probabilities, snapshots
+
+# custom user-provided policy functions, by policy name
+custom_policies = {}
+custom_policy_probabilities = {}
+custom_policy_updates = {}
+
+# compiled policies, by Policy pk
+# entries are dropped by the signal handlers in models.py when a policy or variable
+# changes, and rebuilt when the policy's stamp was bumped by another process
+_compiled_policies = {}
+
+
+def register_policy(
+    name, policy_function, probability_function=None, update_function=None
+):
+    """
+    register a custom policy function (and optionally its probability and update functions)
+    policies named `name` will use it instead of the built-in functions
+    """
+    custom_policies[name] = policy_function
+    if probability_function is not None:
+        custom_policy_probabilities[name] = probability_function
+    if update_function is not None:
+        custom_policy_updates[name] = update_function
+    clear_compiled_policies()
+
+
+def get_policy_function(name):
+    if name in custom_policies:
+        return custom_policies[name]
+    return getattr(policies, name, None)
+
+
+def get_policy_probability_function(name):
+    if name in custom_policy_probabilities:
+        return custom_policy_probabilities[name]
+    return getattr(policy_probabilities, name, None)
+
+
+def get_policy_update_function(name):
+    """
+    function(variables, context, value) called with each student rating of a version,
+    for policies that learn online. named <policy name>_update in engine.policies
+    """
+    if name in custom_policy_updates:
+        return custom_policy_updates[name]
+    return getattr(policies, name + "_update", None)
+
+
+class PolicyVariables(list):
+    """
+    prefetched variables of a policy
+    supports the queryset lookups policy functions use (all, filter, get) without queries
+    """
+
+    def _matches(self, variable, lookups):
+        return all(
+            getattr(variable, field) == value for field, value in lookups.items()
+        )
+
+    def all(self):
+        return self
+
+    def filter(self, **lookups):
+        return PolicyVariables(v for v in self if self._matches(v, lookups))
+
+    def get(self, **lookups):
+        Variable = apps.get_model("engine", "Variable")
+        matches = self.filter(**lookups)
+        if not matches:
+            raise Variable.DoesNotExist(
+                "Policy variable matching {} does not exist.".format(lookups)
+            )
+        if len(matches) > 1:
+            raise Variable.MultipleObjectsReturned(
+                "More than one policy variable matches {}.".format(lookups)
+            )
+        return matches[0]
+
+
+class AssignmentBuffer(object):
+    """
+    block of versions drawn ahead of time for one mooclet
+    """
+
+    def __init__(self, versions, propensities=None, stamp=None):
+        if propensities is None:
+            propensities = [None] * len(versions)
+        self.versions = deque(zip(versions, propensities))
+        self.version_ids = {version.pk for version in versions}
+        self.filled_at = monotonic()
+        # the mooclet's snapshot stamp when the versions were drawn
+        self.stamp = stamp
+
+
+class CompiledPolicy(object):
+    """
+    a Policy row with its functions resolved and its variables loaded
+
+    stochastic policies that accept size can keep a buffer of pre-drawn versions per
+    mooclet, enabled with the buffer_size policy parameter. a buffer is refilled once
+    it is empty, older than buffer_max_age seconds, or the mooclet's snapshot stamp has
+    changed (a rating was recorded or a version added, in any process)
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.function = get_policy_function(policy.name)
+        self.probability_function = get_policy_probability_function(policy.name)
+        self.update_function = get_policy_update_function(policy.name)
+        self.variables = PolicyVariables(policy.variables.all())
+        # policies taking a size argument can draw many assignments in one call
+        self.supports_size = (
+            self.function is not None and "size" in signature(self.function).parameters
+        )
+        self.parameters = policy.get_parameters()
+        self.buffer_size = self.parameters.get("buffer_size", 0)
+        self.buffer_max_age = self.parameters.get("buffer_max_age", 60)
+        self.buffers = {}
+        # snapshots.get_policy_stamp when compiled, set by get_compiled_policy
+        self.stamp = None
+        if self.function is None:
+            print("policy function matching specified name not found")
+
+    def run(self, context):
+        context["policy"] = self.policy
+        if self.buffer_size and self.supports_size and "mooclet" in context:
+            return self.run_buffered(context)
+        return self.function(self.variables, context)
+
+    def run_buffered(self, context):
+        mooclet_id = context["mooclet"].pk
+        buffer = self.buffers.get(mooclet_id)
+        stamp = snapshots.get_stamp(mooclet_id)
+        if (
+            buffer is None
+            or not buffer.versions
+            or buffer.stamp != stamp
+            or monotonic() - buffer.filled_at > self.buffer_max_age
+        ):
+            versions = self.function(self.variables, context, size=self.buffer_size)
+            buffer = AssignmentBuffer(
+                versions, context.pop("propensities", None), stamp
+            )
+            self.buffers[mooclet_id] = buffer
+        version, propensity = buffer.versions.popleft()
+        if propensity is not None:
+            context["propensity"] = propensity
+        return version
+
+    def clear_buffers(self, version_id=None):
+        """
+        drop pre-drawn versions, only the buffers containing version_id if given
+        """
+        if version_id is None:
+            self.buffers.clear()
+            return
+        for mooclet_id, buffer in list(self.buffers.items()):
+            if version_id in buffer.version_ids:
+                del self.buffers[mooclet_id]
+
+    def update(self, value):
+        """
+        pass a newly recorded rating of a version to the policy's update function
+        """
+        if self.update_function is None:
+            return
+        context = {"policy": self.policy}
+        if value.user_id is not None:
+            context["user"] = value.user
+        self.update_function(self.variables, context, value)
+
+    def run_batch(self, context, users):
+        """
+        one version per user, drawn in a single policy call when the policy supports it
+        their propensities are recorded in context["propensities"]
+        """
+        context["policy"] = self.policy
+        if self.supports_size:
+            return self.function(self.variables, context, size=len(users))
+        versions = []
+        propensities = []
+        for user in users:
+            user_context = dict(context)
+            if user is not None:
+                user_context["user"] = user
+            versions.append(self.function(self.variables, user_context))
+            propensities.append(user_context.get("propensity"))
+        context["propensities"] = propensities
+        return versions
+
+    def simulate(self, context, iterations):
+        context["policy"] = self.policy
+        return self.probability_function(self.variables, context, iterations=iterations)
+
+
+def get_compiled_policy(policy_id):
+    # read the stamp before loading, a change made while loading bumps it again
+    stamp = snapshots.get_policy_stamp(policy_id)
+    compiled = _compiled_policies.get(policy_id)
+    if compiled is None or compiled.stamp != stamp:
+        Policy = apps.get_model("engine", "Policy")
+        policy = Policy.objects.prefetch_related("variables").get(pk=policy_id)
+        compiled = CompiledPolicy(policy)
+        compiled.stamp = stamp
+        _compiled_policies[policy_id] = compiled
+    return compiled
+
+
+def clear_assignment_buffers(version_id=None):
+    for compiled in list(_compiled_policies.values()):
+        compiled.clear_buffers(version_id)
+
+
+def clear_compiled_policies(policy_id=None):
+    if policy_id is None:
+        _compiled_policies.clear()
+    else:
+        _compiled_policies.pop(policy_id, None)
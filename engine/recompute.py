@@ -0,0 +1,344 @@
+"""
+bulk recompute of explanation_probability for many mooclets at once
+
+rating counts and sums for every version are read from their summaries in one query,
+thompson sampling probabilities are computed in a pool of worker processes (the
+workers only see numpy arrays, never the database), and every explanation_probability
+is written back with batched upserts into CurrentValue
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from django.apps import apps
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from . import policy_probabilities, policy_registry, sampling
+from .policies import get_thompson_priors, thompson_posteriors
+
+logger = logging.getLogger(__name__)
+
+# below this many thompson sampling mooclets, starting worker processes costs more
+# than it saves
+MIN_POOL_MOOCLETS = 8
+
+
+def get_course_mooclet_ids(course):
+    """
+    explanation and next question mooclets of the course's quizzes
+    """
+    Mooclet = apps.get_model("engine", "Mooclet")
+    return list(
+        Mooclet.objects.filter(
+            Q(answer__question__quiz__course=course) | Q(quiz__course=course)
+        )
+        .distinct()
+        .values_list("id", flat=True)
+    )
+
+
+def load_rating_totals(version_ids):
+    """
+    dicts of version id -> rating count and version id -> rating sum, in one query
+    """
+    ValueSummary = apps.get_model("engine", "ValueSummary")
+    counts = {}
+    totals = {}
+    summaries = ValueSummary.objects.filter(
+        variable__name="student_rating", object_id__in=version_ids
+    ).values_list("object_id", "count", "total")
+    for version_id, count, total in summaries:
+        counts[version_id] = count
+        totals[version_id] = total
+    return counts, totals
+
+
+def _thompson_probabilities(jobs, iterations, probability_settings, seed=None):
+    """
+    worker: win probabilities for a chunk of (mooclet id, successes, failures) jobs
+    with a seed, each mooclet's draws are seeded from (seed, mooclet id), so they don't
+    depend on which worker or chunk the mooclet lands in
+    """
+    # forked workers would otherwise share the parent's global random state
+    random_state = np.random.RandomState()
+    results = []
+    for mooclet_id, successes, failures in jobs:
+        if seed is not None:
+            random_state = np.random.RandomState([seed, mooclet_id])
+        results.append(
+            (
+                mooclet_id,
+                sampling.win_probabilities(
+                    successes,
+                    failures,
+                    iterations=iterations,
+                    random_state=random_state,
+                    **probability_settings
+                ).tolist(),
+            )
+        )
+    return results
+
+
+def compute_probabilities(mooclet_ids, iterations=10000, workers=None, seed=None):
+    """
+    returns a dict of mooclet id -> {version id: probability}
+    mooclets whose policy has no probability function are left out
+    seed makes the simulated thompson sampling probabilities reproducible
+    """
+    Mooclet = apps.get_model("engine", "Mooclet")
+    Version = apps.get_model("engine", "Version")
+    mooclets = Mooclet.objects.filter(pk__in=mooclet_ids, policy__isnull=False)
+
+    mooclet_versions = {}
+    versions = Version.objects.filter(mooclet_id__in=mooclet_ids).order_by(
+        "mooclet_id", "_order"
+    )
+    for mooclet_id, version_id in versions.values_list("mooclet_id", "id"):
+        mooclet_versions.setdefault(mooclet_id, []).append(version_id)
+    rating_counts, rating_totals = load_rating_totals(
+        [version_id for ids in mooclet_versions.values() for version_id in ids]
+    )
+
+    probabilities = {}
+    # thompson sampling mooclets, by policy
+    thompson_mooclets = {}
+    for mooclet in mooclets:
+        version_ids = mooclet_versions.get(mooclet.pk)
+        compiled_policy = policy_registry.get_compiled_policy(mooclet.policy_id)
+        if not version_ids or compiled_policy.probability_function is None:
+            continue
+        if (
+            compiled_policy.probability_function
+            is policy_probabilities.thompson_sampling
+        ):
+            thompson_mooclets.setdefault(compiled_policy.policy, []).append(mooclet.pk)
+        else:
+            # the other probability functions are cheap, run them here
+            context = {"mooclet": mooclet, "versions": mooclet.version_set.all()}
+            version_probabilities = compiled_policy.simulate(context, iterations)
+            probabilities[mooclet.pk] = {
+                version.pk: probability
+                for version, probability in version_probabilities.items()
+            }
+
+    thompson_jobs = []
+    for policy, policy_mooclet_ids in thompson_mooclets.items():
+        version_ids = [
+            version_id
+            for mooclet_id in policy_mooclet_ids
+            for version_id in mooclet_versions[mooclet_id]
+        ]
+        states, prior_success, prior_failure = get_thompson_priors(
+            policy, version_ids, fresh=True
+        )
+        successes, failures = thompson_posteriors(
+            np.array([rating_counts.get(v, 0) for v in version_ids], dtype=float),
+            np.array([rating_totals.get(v, 0.0) for v in version_ids]),
+            prior_success,
+            prior_failure,
+        )
+        start = 0
+        for mooclet_id in policy_mooclet_ids:
+            end = start + len(mooclet_versions[mooclet_id])
+            thompson_jobs.append(
+                (mooclet_id, successes[start:end], failures[start:end])
+            )
+            start = end
+
+    compute = partial(
+        _thompson_probabilities,
+        iterations=iterations,
+        probability_settings=policy_probabilities.get_probability_settings(),
+        seed=seed,
+    )
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(thompson_jobs) < MIN_POOL_MOOCLETS:
+        results = compute(thompson_jobs)
+    else:
+        # a few chunks per worker keeps them all busy without pickling every job alone
+        chunks = [thompson_jobs[i :: 4 * workers] for i in range(4 * workers)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [
+                result
+                for chunk_results in executor.map(compute, chunks)
+                for result in chunk_results
+            ]
+    for mooclet_id, version_probabilities in results:
+        probabilities[mooclet_id] = dict(
+            zip(mooclet_versions[mooclet_id], version_probabilities)
+        )
+    return probabilities
+
+
+def write_probabilities(probabilities):
+    """
+    store {mooclet id: {version id: probability}} as explanation_probability values
+    returns the number of values written
+    """
+    CurrentValue = apps.get_model("engine", "CurrentValue")
+    Variable = apps.get_model("engine", "Variable")
+    Version = apps.get_model("engine", "Version")
+    explanation_probability, created = Variable.objects.get_or_create_cached(
+        "explanation_probability", ContentType.objects.get_for_model(Version)
+    )
+    return CurrentValue.objects.set_values(
+        explanation_probability,
+        {
+            version_id: probability
+            for mooclet_probabilities in probabilities.values()
+            for version_id, probability in mooclet_probabilities.items()
+        },
+    )
+
+
+def recompute_probabilities(mooclet_ids, iterations=10000, workers=None, seed=None):
+    """
+    recompute and store explanation_probability for every version of the mooclets
+    returns the computed probabilities
+    """
+    probabilities = compute_probabilities(
+        mooclet_ids, iterations=iterations, workers=workers, seed=seed
+    )
+    write_probabilities(probabilities)
+    return probabilities
+
+
+def recompute_course(course, iterations=10000, workers=None, seed=None):
+    return recompute_probabilities(
+        get_course_mooclet_ids(course),
+        iterations=iterations,
+        workers=workers,
+        seed=seed,
+    )
+
+
+def update_rating_statistics(mooclet_ids):
+    """
+    store the number of ratings, mean rating and rating std dev of each version
+    """
+    CurrentValue = apps.get_model("engine", "CurrentValue")
+    Variable = apps.get_model("engine", "Variable")
+    Version = apps.get_model("engine", "Version")
+    ValueSummary = apps.get_model("engine", "ValueSummary")
+    version_content_type = ContentType.objects.get_for_model(Version)
+    version_ids = list(
+        Version.objects.filter(mooclet_id__in=mooclet_ids).values_list("id", flat=True)
+    )
+    student_rating = Variable.objects.get_cached("student_rating", first=True)
+    summaries = ValueSummary.objects.get_summaries(student_rating, version_ids)
+    summaries = [summaries.get(v, ValueSummary()) for v in version_ids]
+
+    num_students, created = Variable.objects.get_or_create_cached(
+        "num_students", version_content_type, display_name="Number of Students"
+    )
+    mean_rating, created = Variable.objects.get_or_create_cached(
+        "mean_student_rating", version_content_type, display_name="Mean Student Rating"
+    )
+    std_dev, created = Variable.objects.get_or_create_cached(
+        "rating_std_dev",
+        version_content_type,
+        display_name="Standard Deviation of Rating",
+    )
+    CurrentValue.objects.set_values(
+        num_students,
+        {v: float(summary.count) for v, summary in zip(version_ids, summaries)},
+    )
+    CurrentValue.objects.set_values(
+        mean_rating,
+        {v: summary.mean or 0.0 for v, summary in zip(version_ids, summaries)},
+    )
+    CurrentValue.objects.set_values(
+        std_dev,
+        {v: summary.std_dev or 0.0 for v, summary in zip(version_ids, summaries)},
+    )
+
+
+def update_answer_proportions(question_ids):
+    """
+    store the proportion of answer choices among all answers of each question
+    """
+    Answer = apps.get_model("engine", "Answer")
+    Counter = apps.get_model("engine", "Counter")
+    CurrentValue = apps.get_model("engine", "CurrentValue")
+    Variable = apps.get_model("engine", "Variable")
+    answer_questions = dict(
+        Answer.objects.filter(question_id__in=question_ids).values_list(
+            "id", "question_id"
+        )
+    )
+    answer_content_type = ContentType.objects.get_for_model(Answer)
+    answer_counts = Counter.objects.get_counts(
+        Variable.objects.get_or_create_cached(
+            "answer_choice_count", answer_content_type, display_name="Count"
+        )[0],
+        answer_questions,
+    )
+    question_totals = {}
+    for answer_id, question_id in answer_questions.items():
+        question_totals[question_id] = question_totals.get(
+            question_id, 0.0
+        ) + answer_counts.get(answer_id, 0.0)
+
+    answer_proportion, created = Variable.objects.get_or_create_cached(
+        "answer_proportion", answer_content_type
+    )
+    proportions = {}
+    for answer_id, question_id in answer_questions.items():
+        # no answer_choice_count, no one has chosen this answer
+        count = answer_counts.get(answer_id, 0.0)
+        proportions[answer_id] = count / question_totals[question_id] if count else 0.0
+    CurrentValue.objects.set_values(answer_proportion, proportions)
+
+
+def run_recompute_requests(requests, iterations=10000, workers=None):
+    mooclet_ids = [request.mooclet_id for request in requests]
+    question_ids = {request.question_id for request in requests if request.question_id}
+    update_rating_statistics(mooclet_ids)
+    recompute_probabilities(mooclet_ids, iterations=iterations, workers=workers)
+    update_answer_proportions(question_ids)
+
+
+def process_recompute_requests(limit=None, iterations=10000, workers=None):
+    """
+    run the recompute requests that are due, returns the number processed
+    if the batch fails its mooclets are run one at a time, and the ones that fail
+    alone are retried later
+    """
+    RecomputeRequest = apps.get_model("engine", "RecomputeRequest")
+    requests = RecomputeRequest.objects.claim_due(limit)
+    if not requests:
+        return 0
+    failed = []
+    try:
+        run_recompute_requests(requests, iterations=iterations, workers=workers)
+    except Exception as e:
+        if len(requests) == 1:
+            logger.exception("recompute of mooclet %s failed", requests[0].mooclet_id)
+            failed.append((requests[0], e))
+        else:
+            logger.exception(
+                "recompute of %s mooclets failed, running them one at a time",
+                len(requests),
+            )
+            for request in requests:
+                try:
+                    run_recompute_requests(
+                        [request], iterations=iterations, workers=workers
+                    )
+                except Exception as error:
+                    logger.exception(
+                        "recompute of mooclet %s failed", request.mooclet_id
+                    )
+                    failed.append((request, error))
+    for request, error in failed:
+        RecomputeRequest.objects.retry(request, error)
+    failed_requests = {request for request, error in failed}
+    RecomputeRequest.objects.complete(
+        [request for request in requests if request not in failed_requests]
+    )
+    return len(requests) - len(failed)
@@ -0,0 +1,315 @@
+"""
+offline replay of policies over logged ratings
+
+each logged student_rating says which version a student was shown and how they rated it.
+a candidate policy is replayed over those events in timestamp order: whenever it picks
+the version that was actually shown, the event counts towards its reward and the policy
+learns from it, otherwise the event is skipped (Li et al., "Unbiased offline evaluation
+of contextual-bandit-based news article recommendation algorithms").
+
+all events are loaded into numpy arrays once, nothing touches the database while replaying.
+"""
+
+import numpy as np
+from django.apps import apps
+
+from . import policies, sampling
+
+# max value of version rating (after scaling), as in policies.thompson_sampling
+MAX_RATING = 1
+
+
+def load_rating_events(mooclet, variable_name="student_rating", reward_scale=0.1):
+    """
+    logged ratings for the mooclet's versions, in timestamp order
+    returns (version ids, arms, rewards, users, times), arms index into version ids,
+    anonymous users are -1 and times are unix timestamps
+    """
+    Value = apps.get_model("engine", "Value")
+    Variable = apps.get_model("engine", "Variable")
+    version_ids = list(mooclet.version_set.values_list("id", flat=True))
+    arm_index = {version_id: i for i, version_id in enumerate(version_ids)}
+    ratings = (
+        Value.objects.filter(
+            variable__in=Variable.objects.filter(name=variable_name),
+            object_id__in=version_ids,
+        )
+        .order_by("timestamp", "id")
+        .values_list("object_id", "value", "user_id", "timestamp")
+    )
+    arms = []
+    rewards = []
+    users = []
+    times = []
+    for version_id, value, user_id, timestamp in ratings.iterator(chunk_size=10000):
+        arms.append(arm_index[version_id])
+        rewards.append(value)
+        users.append(-1 if user_id is None else user_id)
+        times.append(timestamp.timestamp())
+    return (
+        version_ids,
+        np.array(arms, dtype=int),
+        np.array(rewards, dtype=float) * reward_scale,
+        np.array(users, dtype=int),
+        np.array(times, dtype=float),
+    )
+
+
+class UniformReplay(object):
+    learns = False
+
+    def __init__(self, versions, random_state, **kwargs):
+        self.versions = versions
+        self.random_state = random_state
+
+    def choose(self, users, times):
+        return self.random_state.randint(self.versions, size=len(users))
+
+    def update(self, arm, reward, user, time):
+        pass
+
+
+class WeightedReplay(UniformReplay):
+    def __init__(self, versions, random_state, weights=None, **kwargs):
+        super(WeightedReplay, self).__init__(versions, random_state)
+        self.table = sampling.AliasTable(weights)
+
+    def choose(self, users, times):
+        return self.table.sample(len(users), random_state=self.random_state)
+
+
+class StickyReplay(UniformReplay):
+    """
+    each user keeps the version drawn for their first event
+    """
+
+    def __init__(self, versions, random_state, **kwargs):
+        super(StickyReplay, self).__init__(versions, random_state)
+        self.assignments = {}
+
+    def choose(self, users, times):
+        choices = self.random_state.randint(self.versions, size=len(users))
+        for i, user in enumerate(users):
+            if user >= 0:
+                choices[i] = self.assignments.setdefault(user, choices[i])
+        return choices
+
+
+class ThompsonReplay(UniformReplay):
+    learns = True
+
+    def __init__(
+        self, versions, random_state, prior_success=1.9, prior_failure=0.1, **kwargs
+    ):
+        super(ThompsonReplay, self).__init__(versions, random_state)
+        self.successes = np.full(versions, prior_success, dtype=float)
+        self.failures = np.full(versions, prior_failure, dtype=float)
+
+    def choose(self, users, times):
+        draws = self.random_state.beta(
+            self.successes, self.failures, size=(len(users), self.versions)
+        )
+        return np.argmax(draws, axis=1)
+
+    def update(self, arm, reward, user, time):
+        self.successes[arm] += reward
+        self.failures[arm] += MAX_RATING - reward
+
+
+class DecayedThompsonReplay(UniformReplay):
+    """
+    as policies.decayed_thompson_sampling: counts are halved every half_life_days,
+    using the logged timestamps as the clock
+    """
+
+    learns = True
+
+    def __init__(
+        self,
+        versions,
+        random_state,
+        half_life_days=14,
+        prior_success=1.9,
+        prior_failure=0.1,
+        **kwargs
+    ):
+        super(DecayedThompsonReplay, self).__init__(versions, random_state)
+        self.half_life = half_life_days * 86400.0
+        self.prior_success = prior_success
+        self.prior_failure = prior_failure
+        self.decayed_success = np.zeros(versions)
+        self.decayed_failure = np.zeros(versions)
+        self.decayed_at = np.zeros(versions)
+
+    def decay(self, times):
+        # (events, versions) factors bringing the counts up to each event's time
+        elapsed = np.maximum(times[:, np.newaxis] - self.decayed_at, 0.0)
+        return 0.5 ** (elapsed / self.half_life)
+
+    def choose(self, users, times):
+        factor = self.decay(times)
+        draws = self.random_state.beta(
+            self.prior_success + factor * self.decayed_success,
+            self.prior_failure + factor * self.decayed_failure,
+        )
+        return np.argmax(draws, axis=1)
+
+    def update(self, arm, reward, user, time):
+        factor = self.decay(np.array([time]))[0, arm]
+        self.decayed_success[arm] = self.decayed_success[arm] * factor + reward
+        self.decayed_failure[arm] = (
+            self.decayed_failure[arm] * factor + MAX_RATING - reward
+        )
+        self.decayed_at[arm] = time
+
+
+class LinUCBReplay(UniformReplay):
+    """
+    as policies.linucb, features maps user ids to their context vectors (users
+    without one get the constant feature only)
+    """
+
+    learns = True
+
+    def __init__(
+        self,
+        versions,
+        random_state,
+        features=None,
+        dimension=1,
+        alpha=1.0,
+        ridge=1.0,
+        **kwargs
+    ):
+        super(LinUCBReplay, self).__init__(versions, random_state)
+        self.features = features or {}
+        self.default_features = np.zeros(dimension)
+        self.default_features[0] = 1.0
+        self.alpha = alpha
+        self.a_inverse = np.array([np.identity(dimension) / ridge] * versions)
+        self.b = np.zeros((versions, dimension))
+
+    def get_features(self, user):
+        return self.features.get(user, self.default_features)
+
+    def choose(self, users, times):
+        choices = np.empty(len(users), dtype=int)
+        for i, user in enumerate(users):
+            scores = policies.linucb_scores(
+                self.a_inverse, self.b, self.get_features(user), self.alpha
+            )
+            # ties (e.g. before any rating) are broken at random
+            choices[i] = self.random_state.choice(
+                np.flatnonzero(scores >= scores.max() - 1e-12)
+            )
+        return choices
+
+    def update(self, arm, reward, user, time):
+        policies.linear_update(
+            self.a_inverse[arm], self.b[arm], self.get_features(user), reward
+        )
+
+
+# in-memory replay models for the functions in engine.policies, by policy name
+replay_policies = {
+    "uniform_random": UniformReplay,
+    "thompson_sampling_placeholder": UniformReplay,
+    "weighted_random": WeightedReplay,
+    "thompson_sampling": ThompsonReplay,
+    "decayed_thompson_sampling": DecayedThompsonReplay,
+    "linucb": LinUCBReplay,
+    "prompt_shortlong_condition": StickyReplay,
+}
+
+
+def replay(
+    policy_name, arms, rewards, users, versions, seed=None, times=None, **policy_kwargs
+):
+    """
+    replay the named policy over logged events, returns a dict of results
+    times are the events' unix timestamps, needed by policies that decay
+    """
+    if policy_name not in replay_policies:
+        raise ValueError("no replay model for policy {}".format(policy_name))
+    random_state = np.random.RandomState(seed)
+    policy = replay_policies[policy_name](versions, random_state, **policy_kwargs)
+    if times is None:
+        times = np.zeros(len(arms))
+
+    matched = np.zeros(len(arms), dtype=bool)
+    # policies that learn only change after a matched event, so candidates are drawn
+    # a block at a time and everything up to the first match in the block is consumed
+    block = max(4 * versions, 16) if policy.learns else len(arms)
+    position = 0
+    while position < len(arms):
+        end = min(position + block, len(arms))
+        choices = policy.choose(users[position:end], times[position:end])
+        hits = np.flatnonzero(choices == arms[position:end]) + position
+        if not policy.learns:
+            matched[hits] = True
+            position = end
+        elif len(hits):
+            hit = hits[0]
+            matched[hit] = True
+            policy.update(arms[hit], rewards[hit], users[hit], times[hit])
+            position = hit + 1
+        else:
+            position = end
+
+    matched_rewards = rewards[matched]
+    return {
+        "policy": policy_name,
+        "events": int(len(arms)),
+        "matched": int(matched.sum()),
+        "total_reward": float(matched_rewards.sum()),
+        "mean_reward": float(matched_rewards.mean()) if len(matched_rewards) else None,
+        "version_counts": np.bincount(arms[matched], minlength=versions).tolist(),
+    }
+
+
+def replay_mooclet(mooclet, policy_name=None, seed=None, reward_scale=0.1):
+    """
+    replay a policy (by default the mooclet's own) over the mooclet's logged ratings
+    """
+    Policy = apps.get_model("engine", "Policy")
+    Variable = apps.get_model("engine", "Variable")
+    policy_name = policy_name or mooclet.policy.name
+    version_ids, arms, rewards, users, times = load_rating_events(
+        mooclet, reward_scale=reward_scale
+    )
+
+    # parameters come from the mooclet's policy, or another policy row of that name
+    if mooclet.policy is not None and mooclet.policy.name == policy_name:
+        policy = mooclet.policy
+    else:
+        policy = Policy.objects.filter(name=policy_name).first()
+    policy_kwargs = policy.get_parameters() if policy is not None else {}
+    if policy_name == "weighted_random":
+        weights = dict(
+            Variable.objects.get_cached("version_weight")
+            .get_data({"mooclet": mooclet})
+            .values_list("object_id", "value")
+        )
+        policy_kwargs["weights"] = [weights.get(v, 0.0) for v in version_ids]
+    elif policy_name == "linucb":
+        if policy is None:
+            raise ValueError("linucb needs a policy row for its feature variables")
+        feature_variables = policies.get_feature_variables(policy.variables.all())
+        policy_kwargs["dimension"] = len(feature_variables) + 1
+        policy_kwargs["features"] = policies.get_users_features(
+            feature_variables, set(users[users >= 0].tolist())
+        )
+
+    result = replay(
+        policy_name,
+        arms,
+        rewards,
+        users,
+        len(version_ids),
+        seed=seed,
+        times=times,
+        **policy_kwargs
+    )
+    result["mooclet"] = mooclet.pk
+    result["version_ids"] = version_ids
+    return result
@@ -0,0 +1,195 @@
+import numpy as np
+
+# numerical helpers shared by policies and policy_probabilities
+# nothing in here touches the database, inputs and outputs are numpy arrays
+
+# default accuracy target for beta_win_probabilities (max absolute error per version)
+DEFAULT_TOLERANCE = 1e-4
+
+# default target for simulate_win_probabilities (max standard error per version)
+DEFAULT_STANDARD_ERROR = 0.005
+
+
+def _logit_windows(successes, failures, spread=8.0, tail=30.0):
+    """
+    integration window for each beta posterior, in logit space
+    covers the gaussian core around the mode plus the exponential tails
+    """
+    mode = np.log(successes) - np.log(failures)
+    scale = np.sqrt((successes + failures) / (successes * failures))
+    lower = mode - spread * scale - tail / successes
+    upper = mode + spread * scale + tail / failures
+    return lower, upper
+
+
+def _product_of_others(cdf):
+    """
+    for each row i, the elementwise product of every other row
+    """
+    ones = np.ones((1, cdf.shape[1]))
+    before = np.cumprod(np.vstack([ones, cdf[:-1]]), axis=0)
+    after = np.cumprod(np.vstack([ones, cdf[:0:-1]]), axis=0)[::-1]
+    return before * after
+
+
+def _win_probabilities_on_grid(successes, failures, lower, upper, nodes):
+    # union of an evenly spaced grid over each version's window
+    grid = np.unique(
+        np.concatenate([np.linspace(l, u, nodes) for l, u in zip(lower, upper)])
+    )
+    # beta density after substituting x = 1 / (1 + exp(-t)), up to a constant
+    log_x = -np.logaddexp(0.0, -grid)
+    log_1mx = -np.logaddexp(0.0, grid)
+    log_density = successes[:, None] * log_x + failures[:, None] * log_1mx
+    density = np.exp(log_density - log_density.max(axis=1, keepdims=True))
+
+    # cdf at each grid node, trapezoid rule
+    mass = 0.5 * (density[:, 1:] + density[:, :-1]) * np.diff(grid)
+    cdf = np.hstack([np.zeros((len(successes), 1)), np.cumsum(mass, axis=1)])
+    cdf /= cdf[:, -1:]
+
+    # P(version i is best) = integral of prod_{j != i} F_j dF_i
+    others = _product_of_others(cdf)
+    probabilities = np.sum(
+        np.diff(cdf, axis=1) * 0.5 * (others[:, 1:] + others[:, :-1]), axis=1
+    )
+    return probabilities / probabilities.sum()
+
+
+def beta_win_probabilities(
+    successes, failures, tolerance=DEFAULT_TOLERANCE, max_nodes=8192
+):
+    """
+    probability that each beta posterior produces the largest draw, i.e. the
+    probability thompson sampling picks each version
+
+    computed by numerical integration rather than simulation, so the result is
+    deterministic. the grid is refined until no probability moves by more than
+    tolerance (or max_nodes per version is reached)
+
+    the grid holds nodes for every version's window, so the cost grows faster than
+    the number of versions: about a millisecond up to 10 versions, 25-50 ms for 50
+    """
+    successes = np.asarray(successes, dtype=float)
+    failures = np.asarray(failures, dtype=float)
+    if len(successes) <= 1:
+        return np.ones(len(successes))
+
+    lower, upper = _logit_windows(successes, failures)
+    nodes = 128
+    probabilities = _win_probabilities_on_grid(successes, failures, lower, upper, nodes)
+    while nodes < max_nodes:
+        nodes *= 2
+        refined = _win_probabilities_on_grid(successes, failures, lower, upper, nodes)
+        converged = np.max(np.abs(refined - probabilities)) < tolerance
+        probabilities = refined
+        if converged:
+            break
+    return probabilities
+
+
+def beta_draws(successes, failures, random_state=np.random):
+    """
+    returns a function drawing a (size, versions) matrix of beta posterior samples
+    """
+    successes = np.asarray(successes, dtype=float)
+    failures = np.asarray(failures, dtype=float)
+
+    def draw(size):
+        return random_state.beta(successes, failures, size=(size, len(successes)))
+
+    return draw
+
+
+def simulate_win_probabilities(
+    draw,
+    versions,
+    iterations=10000,
+    standard_error=DEFAULT_STANDARD_ERROR,
+    max_iterations=1000000,
+):
+    """
+    monte carlo estimate of how often each version has the largest draw
+
+    draw(size) returns a (size, versions) sample matrix. iterations are drawn as
+    one block, and the sample size keeps doubling until the largest standard
+    error of the estimated probabilities is below standard_error
+    """
+    counts = np.zeros(versions)
+    total = 0
+    block = iterations
+    while True:
+        winners = np.argmax(draw(block), axis=1)
+        counts += np.bincount(winners, minlength=versions)
+        total += block
+        probabilities = counts / total
+        error = np.sqrt(probabilities * (1 - probabilities) / total).max()
+        if error <= standard_error or total >= max_iterations:
+            return probabilities
+        block = min(total, max_iterations - total)
+
+
+def win_probabilities(
+    successes,
+    failures,
+    method="quadrature",
+    iterations=10000,
+    tolerance=DEFAULT_TOLERANCE,
+    standard_error=DEFAULT_STANDARD_ERROR,
+    random_state=np.random,
+):
+    """
+    probability that each beta posterior produces the largest draw
+    integrated with beta_win_probabilities, or simulated when method is monte_carlo
+    """
+    if method == "monte_carlo":
+        return simulate_win_probabilities(
+            beta_draws(successes, failures, random_state=random_state),
+            len(successes),
+            iterations=iterations,
+            standard_error=standard_error,
+        )
+    return beta_win_probabilities(successes, failures, tolerance=tolerance)
+
+
+class AliasTable(object):
+    """
+    walker alias table for drawing from a fixed discrete distribution in O(1)
+    weights don't need to be normalized, zero weights are never drawn
+    raises ValueError, as numpy.random.choice does, unless the weights are finite,
+    non-negative and have a positive sum
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        if not np.all(np.isfinite(weights)) or np.any(weights < 0):
+            raise ValueError("weights must be finite and non-negative")
+        if not weights.sum() > 0:
+            raise ValueError("weights must have a positive sum")
+        self.probabilities = weights / weights.sum()
+        versions = len(weights)
+        scaled = self.probabilities * versions
+        self.accept = np.ones(versions)
+        self.alias = np.arange(versions)
+        small = [i for i in range(versions) if scaled[i] < 1.0]
+        large = [i for i in range(versions) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.accept[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+
+    def sample(self, size=None, random_state=np.random):
+        """
+        index of the drawn outcome, or an array of size indices
+        """
+        columns = random_state.randint(len(self.accept), size=size)
+        accepted = random_state.random_sample(size) < self.accept[columns]
+        if size is None:
+            return int(columns if accepted else self.alias[columns])
+        return np.where(accepted, columns, self.alias[columns])
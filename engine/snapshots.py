@@ -0,0 +1,146 @@
+"""
+policy input snapshots kept in django's cache framework
+
+each mooclet has a stamp in the cache, bumped whenever something a snapshot is derived
+from changes (ratings recorded, versions added or removed, priors edited). snapshots
+are stored with the stamp they were built under and rebuilt from the database when the
+stamps differ, so processes sharing a cache backend share warm snapshots.
+
+policies and variables have stamps too, bumped when a Policy or Variable row changes.
+the process-level caches of compiled policies and variable rows compare them to
+notice changes made in other processes.
+
+the cache must be shared by every process (memcached, see CACHES in settings): with
+a per-process cache (locmem) a stamp bumped in one process isn't seen by the others.
+manage.py check --deploy reports a per-process cache as an error (engine.E001)
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def stamp_key(mooclet_id):
+    return "engine:mooclet_stamp:{}".format(mooclet_id)
+
+
+def snapshot_key(mooclet_id, name):
+    return "engine:mooclet_snapshot:{}:{}".format(mooclet_id, name)
+
+
+def new_stamp():
+    # stamps start from the clock so a stamp evicted and recreated never goes back
+    return time.time_ns()
+
+
+def read_stamp(key):
+    """
+    the current stamp stored under key, created if there is none
+    """
+    stamp = cache.get(key)
+    if stamp is None:
+        stamp = new_stamp()
+        if not cache.add(key, stamp, None):
+            stamp = cache.get(key, stamp)
+    return stamp
+
+
+def increment_stamp(key):
+    """
+    change the stamp stored under key, so nothing built under the old one matches
+    """
+    try:
+        cache.incr(key)
+    except ValueError:
+        # no stamp yet, so nothing can match it
+        cache.add(key, new_stamp(), None)
+
+
+def get_stamp(mooclet_id):
+    """
+    the mooclet's current stamp, created if it has none
+    """
+    return read_stamp(stamp_key(mooclet_id))
+
+
+def get_snapshot(mooclet_id, name, build):
+    """
+    the mooclet's snapshot called name, calling build() to rebuild it when its stamp
+    is out of date
+    """
+    keys = [stamp_key(mooclet_id), snapshot_key(mooclet_id, name)]
+    cached = cache.get_many(keys)
+    stamp = cached.get(keys[0])
+    if stamp is None:
+        stamp = get_stamp(mooclet_id)
+    snapshot = cached.get(keys[1])
+    if snapshot is not None and snapshot[0] == stamp:
+        return snapshot[1]
+
+    # read the stamp before building, a change made while building bumps it again
+    data = build()
+    timeout = getattr(settings, "MOOCLET_SNAPSHOT_TIMEOUT", 60)
+    cache.set(keys[1], (stamp, data), timeout)
+    return data
+
+
+def bump_stamp(mooclet_id):
+    """
+    mark every snapshot of the mooclet out of date
+    """
+    increment_stamp(stamp_key(mooclet_id))
+
+
+# bumped whenever any Variable row changes
+VARIABLES_STAMP_KEY = "engine:variables_stamp"
+
+
+def policy_stamp_key(policy_id):
+    return "engine:policy_stamp:{}".format(policy_id)
+
+
+def get_policy_stamp(policy_id):
+    """
+    (variables stamp, policy stamp): a compiled policy holds the Policy row and its
+    Variable rows, so it is out of date once either changes
+    """
+    keys = [VARIABLES_STAMP_KEY, policy_stamp_key(policy_id)]
+    cached = cache.get_many(keys)
+    return tuple(
+        cached[key] if cached.get(key) is not None else read_stamp(key) for key in keys
+    )
+
+
+def bump_policy_stamp(policy_id):
+    increment_stamp(policy_stamp_key(policy_id))
+
+
+def get_variables_stamp():
+    return read_stamp(VARIABLES_STAMP_KEY)
+
+
+def bump_variables_stamp():
+    increment_stamp(VARIABLES_STAMP_KEY)
+
+
+def version_ids_key(mooclet_id):
+    return "engine:mooclet_version_ids:{}".format(mooclet_id)
+
+
+def get_version_ids(mooclet_id, build):
+    """
+    the mooclet's version ids, calling build() to load them when they aren't cached
+    kept apart from the stamped snapshots, so recording a rating doesn't reload them
+    """
+    key = version_ids_key(mooclet_id)
+    version_ids = cache.get(key)
+    if version_ids is None:
+        version_ids = tuple(build())
+        timeout = getattr(settings, "MOOCLET_SNAPSHOT_TIMEOUT", 60)
+        cache.set(key, version_ids, timeout)
+    return version_ids
+
+
+def clear_version_ids(mooclet_id):
+    cache.delete(version_ids_key(mooclet_id))
@@ -1,3 +1,1446 @@
-from django.test import TestCase
+import json
+import math
+import re
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import (
+    algorithms,
+    benchmarks,
+    evaluation,
+    models,
+    policies,
+    policy_probabilities,
+    policy_registry,
+    recompute,
+    replay,
+    sampling,
+    snapshots,
+)
+from .models import (
+    Answer,
+    AssignmentLog,
+    Counter,
+    Course,
+    CurrentValue,
+    Explanation,
+    Mooclet,
+    MoocletAssignment,
+    Policy,
+    Question,
+    Quiz,
+    RecomputeRequest,
+    Value,
+    ValueSummary,
+    Variable,
+    Version,
+    VersionPolicyState,
+)
+
+VALUE_TABLES = ("engine_value", "engine_currentvalue", "engine_counter")
+# plan lines of a full read of a value table, sqlite and postgresql
+VALUE_SCAN = re.compile(
+    r"\b(SCAN (TABLE )?|Seq Scan on )(engine_value|engine_currentvalue|engine_counter)\b"
+)
+
+
+class EngineTestCase(TestCase):
+    """
+    starts each test without the engine's cached data: the rows of earlier tests are
+    rolled back without signals, and their ids used again
+    """
+
+    def setUp(self):
+        cache.clear()
+        models._variable_cache.update(by_name=None, by_id=None)
+        models._version_policy_states.clear()
+        policy_registry.clear_compiled_policies()
+
+
+class ValueQueryPlanTests(EngineTestCase):
+    """
+    EXPLAIN the queries the engine sends to the value tables and fail on any that
+    would read a whole table. the value table grows with every student action,
+    these lookups must stay index searches however many rows it holds
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        version_content_type = ContentType.objects.get_for_model(Version)
+        cls.rating = Variable.objects.create(
+            name="student_rating",
+            content_type=version_content_type,
+            is_user_variable=True,
+        )
+        cls.weight = Variable.objects.create(
+            name="version_weight", content_type=version_content_type
+        )
+        cls.probability = Variable.objects.create(
+            name="explanation_probability", content_type=version_content_type
+        )
+        cls.feature = Variable.objects.create(
+            name="prior_grade",
+            content_type=version_content_type,
+            is_user_variable=True,
+        )
+        cls.count = Variable.objects.create(
+            name="answer_choice_count", content_type=version_content_type
+        )
+        cls.policy = Policy.objects.create(name="uniform_random")
+        cls.mooclet = Mooclet.objects.create(policy=cls.policy)
+        cls.versions = [
+            Explanation.objects.create(mooclet=cls.mooclet, text="e{}".format(i))
+            for i in range(3)
+        ]
+        cls.users = [User.objects.create(username="u{}".format(i)) for i in range(3)]
+        for version in cls.versions:
+            Value.objects.create(variable=cls.weight, object_id=version.pk, value=1.0)
+            CurrentValue.objects.create(
+                variable=cls.probability, object_id=version.pk, value=0.3
+            )
+            Counter.objects.increment(cls.count, version.pk, shards=2)
+            for user in cls.users:
+                Value.objects.create(
+                    variable=cls.rating, object_id=version.pk, user=user, value=5.0
+                )
+                AssignmentLog.objects.create(
+                    mooclet=cls.mooclet, version=version, user=user, propensity=0.3
+                )
+
+    def capture_value_queries(self, run):
+        """
+        call run(), returning the (sql, params) of each select it sent to the value
+        tables
+        """
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith("SELECT") and any(
+                table in sql for table in VALUE_TABLES
+            ):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(record):
+            run()
+        self.assertTrue(queries, "no queries on the value table")
+        return queries
+
+    def explain(self, sql, params):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # on a table this small the planner prefers a sequential scan even
+                # when an index applies, ask whether it has any other choice
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(
+                "{} {}".format(connection.ops.explain_query_prefix(), sql), params
+            )
+            return "\n".join(
+                " ".join(str(column) for column in row) for row in cursor.fetchall()
+            )
+
+    def assertNoValueScans(self, run):
+        for sql, params in self.capture_value_queries(run):
+            plan = self.explain(sql, params)
+            self.assertIsNone(
+                VALUE_SCAN.search(plan),
+                "sequential scan:\n{}\n{}".format(sql, plan),
+            )
+
+    def assertUsesIndex(self, run, index_name):
+        for sql, params in self.capture_value_queries(run):
+            plan = self.explain(sql, params)
+            self.assertIn(index_name, plan, "{}\n{}".format(sql, plan))
+
+    def test_indexes_exist(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Value._meta.db_table
+            )
+        self.assertEqual(
+            constraints["engine_value_object_idx"]["columns"],
+            ["variable_id", "object_id", "id"],
+        )
+        self.assertEqual(
+            constraints["engine_value_user_idx"]["columns"],
+            ["variable_id", "user_id", "object_id"],
+        )
+
+    def test_latest_object_value(self):
+        version = self.versions[0]
+        self.assertNoValueScans(
+            lambda: self.weight.get_data({"version": version}).last()
+        )
+        self.assertUsesIndex(
+            lambda: self.weight.get_data({"version": version}).last(),
+            "engine_value_object_idx",
+        )
+
+    def test_mooclet_values(self):
+        self.assertNoValueScans(
+            lambda: list(self.weight.get_data({"mooclet": self.mooclet}))
+        )
+
+    def test_latest_user_value(self):
+        version = self.versions[0]
+        user = self.users[0]
+        self.assertNoValueScans(
+            lambda: self.rating.get_data({"version": version, "user": user}).last()
+        )
+        self.assertNoValueScans(
+            lambda: Value.objects.filter(
+                object_id=version.pk, variable=self.rating, user=user
+            ).last()
+        )
+        self.assertUsesIndex(
+            lambda: Value.objects.filter(
+                object_id=version.pk, variable=self.rating, user=user
+            ).last(),
+            "engine_value_user_idx",
+        )
+
+    def test_user_features(self):
+        self.assertNoValueScans(
+            lambda: policies.get_user_features([self.feature], self.users[0])
+        )
+
+    def test_current_values(self):
+        version_ids = [version.pk for version in self.versions]
+        self.assertNoValueScans(
+            lambda: self.probability.get_data({"version": self.versions[0]}).last()
+        )
+        self.assertNoValueScans(
+            lambda: CurrentValue.objects.get_value(self.probability, version_ids[0])
+        )
+        self.assertNoValueScans(
+            lambda: CurrentValue.objects.get_values(self.probability, version_ids)
+        )
+        self.assertNoValueScans(
+            lambda: CurrentValue.objects.get_value(
+                self.rating, version_ids[0], self.users[0]
+            )
+        )
+
+    def test_counters(self):
+        version_ids = [version.pk for version in self.versions]
+        self.assertNoValueScans(
+            lambda: Counter.objects.get_count(self.count, version_ids[0])
+        )
+        self.assertNoValueScans(
+            lambda: Counter.objects.get_counts(self.count, version_ids)
+        )
+
+    def test_counter_increments(self):
+        version_ids = [version.pk for version in self.versions]
+        for shards in (1, 4):
+            Counter.objects.increment(self.count, version_ids[0], shards=shards)
+        Counter.objects.increment_many(
+            self.count, {version_ids[0]: 2.0, version_ids[1]: 1.0}, shards=4
+        )
+        self.assertEqual(
+            Counter.objects.get_counts(self.count, version_ids),
+            {version_ids[0]: 5.0, version_ids[1]: 2.0, version_ids[2]: 1.0},
+        )
+
+    def test_logged_ratings(self):
+        self.assertNoValueScans(lambda: evaluation.load_logged_events(self.mooclet))
+
+    def test_rating_events(self):
+        self.assertNoValueScans(lambda: replay.load_rating_events(self.mooclet))
+
+
+class VariableCacheTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.version_content_type = ContentType.objects.get_for_model(Version)
+        cls.user_content_type = ContentType.objects.get_for_model(User)
+        cls.version_grade = Variable.objects.create(
+            name="grade", content_type=cls.version_content_type
+        )
+
+    def test_any_content_type(self):
+        self.assertEqual(Variable.objects.get_cached("grade"), self.version_grade)
+
+    def test_content_type(self):
+        self.assertEqual(
+            Variable.objects.get_cached("grade", self.version_content_type),
+            self.version_grade,
+        )
+        with self.assertRaises(Variable.DoesNotExist):
+            Variable.objects.get_cached("grade", self.user_content_type)
+
+    def test_no_content_type(self):
+        # None is content_type IS NULL, as in get_or_create(content_type=None)
+        with self.assertRaises(Variable.DoesNotExist):
+            Variable.objects.get_cached("grade", None)
+        grade, created = Variable.objects.get_or_create_cached(
+            "grade", None, is_user_variable=True
+        )
+        self.assertTrue(created)
+        self.assertIsNone(grade.content_type_id)
+        Variable.objects.create(name="grade", content_type=self.user_content_type)
+        self.assertEqual(
+            Variable.objects.get_or_create_cached("grade", None, is_user_variable=True),
+            (grade, False),
+        )
+        with self.assertRaises(Variable.MultipleObjectsReturned):
+            Variable.objects.get_cached("grade")
+
+    def test_first(self):
+        # like filter(name=...).first(), for callers that tolerate duplicates
+        Variable.objects.create(name="grade", content_type=self.user_content_type)
+        self.assertEqual(
+            Variable.objects.get_cached("grade", first=True), self.version_grade
+        )
+        self.assertIsNone(Variable.objects.get_cached("missing", first=True))
+
+    def test_changed_in_another_process(self):
+        self.assertEqual(Variable.objects.get_cached("grade"), self.version_grade)
+        # updates and deletes without signals, as seen from this process
+        Variable.objects.filter(pk=self.version_grade.pk).update(name="score")
+        self.assertEqual(Variable.objects.get_cached("grade"), self.version_grade)
+        # the other process bumped the shared stamp from its signal handler
+        snapshots.bump_variables_stamp()
+        with self.assertRaises(Variable.DoesNotExist):
+            Variable.objects.get_cached("grade")
+        self.assertEqual(
+            Variable.objects.get_cached_by_id(self.version_grade.pk).name, "score"
+        )
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "DELETE FROM engine_variable WHERE id = %s", [self.version_grade.pk]
+            )
+        snapshots.bump_variables_stamp()
+        with self.assertRaises(Variable.DoesNotExist):
+            Variable.objects.get_cached("score")
+        self.assertIsNone(Variable.objects.get_cached_by_id(self.version_grade.pk))
+
+
+class RecomputeRequestTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Variable.objects.create(
+            name="student_rating",
+            content_type=ContentType.objects.get_for_model(Version),
+            is_user_variable=True,
+        )
+        cls.mooclets = [Mooclet.objects.create() for i in range(3)]
+        for mooclet in cls.mooclets:
+            Explanation.objects.create(mooclet=mooclet, text="e")
+
+    def enqueue_due(self):
+        for mooclet in self.mooclets:
+            RecomputeRequest.objects.enqueue(mooclet)
+        RecomputeRequest.objects.update(due_at=timezone.now())
+
+    def test_failed_mooclet_is_retried(self):
+        self.enqueue_due()
+        failing = self.mooclets[1]
+
+        def recompute_probabilities(mooclet_ids, **kwargs):
+            if failing.pk in mooclet_ids:
+                raise ValueError("bad mooclet")
+
+        with mock.patch.object(
+            recompute, "recompute_probabilities", recompute_probabilities
+        ), self.assertLogs("engine.recompute", "ERROR"):
+            self.assertEqual(recompute.process_recompute_requests(), 2)
+        request = RecomputeRequest.objects.get()
+        self.assertEqual(request.mooclet, failing)
+        self.assertIsNone(request.claimed_at)
+        self.assertEqual(request.attempts, 1)
+        self.assertEqual(request.last_error, "bad mooclet")
+        self.assertGreater(request.due_at, timezone.now())
+
+        # not due until the retry delay has passed, which doubles with each attempt
+        self.assertEqual(recompute.process_recompute_requests(), 0)
+        RecomputeRequest.objects.update(due_at=timezone.now())
+        with mock.patch.object(
+            recompute, "recompute_probabilities", recompute_probabilities
+        ), self.assertLogs("engine.recompute", "ERROR"):
+            self.assertEqual(recompute.process_recompute_requests(), 0)
+        request.refresh_from_db()
+        self.assertEqual(request.attempts, 2)
+        self.assertGreater(request.due_at, timezone.now() + timedelta(seconds=100))
+
+    def test_enqueued_while_claimed(self):
+        self.enqueue_due()
+        requests = RecomputeRequest.objects.claim_due()
+        self.assertEqual(len(requests), 3)
+        # claimed requests stay in the table until they are processed
+        self.assertEqual(RecomputeRequest.objects.claim_due(), [])
+        RecomputeRequest.objects.enqueue(self.mooclets[0])
+        RecomputeRequest.objects.complete(requests)
+        request = RecomputeRequest.objects.get()
+        self.assertEqual(request.mooclet, self.mooclets[0])
+        self.assertIsNone(request.claimed_at)
+
+    def test_expired_claim(self):
+        self.enqueue_due()
+        requests = RecomputeRequest.objects.claim_due()
+        # the worker died, its lease runs out and another worker claims the requests
+        RecomputeRequest.objects.update(due_at=timezone.now() - timedelta(seconds=1))
+        claimed_again = RecomputeRequest.objects.claim_due()
+        self.assertEqual(len(claimed_again), 3)
+        RecomputeRequest.objects.complete(requests)
+        self.assertEqual(RecomputeRequest.objects.count(), 3)
+        RecomputeRequest.objects.complete(claimed_again)
+        self.assertEqual(RecomputeRequest.objects.count(), 0)
+
+
+class AssignmentLogTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username="u{}".format(i)) for i in range(3)]
+
+    def make_mooclet(self, policy_name, **parameters):
+        policy = Policy.objects.create(
+            name=policy_name, parameters=json.dumps(parameters)
+        )
+        mooclet = Mooclet.objects.create(policy=policy)
+        for i in range(3):
+            Explanation.objects.create(mooclet=mooclet, text="e{}".format(i))
+        return mooclet
+
+    def test_logged_with_the_assignment(self):
+        mooclet = self.make_mooclet("uniform_random")
+        version = mooclet.get_version({"mooclet": mooclet, "user": self.users[0]})
+        log = AssignmentLog.objects.get()
+        self.assertEqual(
+            (log.version_id, log.user, log.propensity),
+            (version.pk, self.users[0], 1.0 / 3),
+        )
+
+        with self.assertNumQueries(2):
+            # the draw, and one insert for the log
+            versions = mooclet.get_versions({"mooclet": mooclet}, self.users)
+        self.assertEqual(
+            list(
+                AssignmentLog.objects.order_by("id")[1:].values_list(
+                    "version_id", "user_id", "propensity"
+                )
+            ),
+            [(v.pk, user.pk, 1.0 / 3) for v, user in zip(versions, self.users)],
+        )
+
+    def test_decayed_propensity(self):
+        mooclet = self.make_mooclet("decayed_thompson_sampling", half_life_days=14)
+        policy = mooclet.policy
+        version_ids = list(mooclet.get_version_ids())
+        states = policies.get_thompson_priors(policy, version_ids)[0]
+        now = timezone.now()
+        VersionPolicyState.objects.filter(pk=states[version_ids[0]].pk).update(
+            decayed_success=8.0, decayed_failure=1.0, decayed_at=now
+        )
+        # a half life later the counts have halved, and so have the probabilities
+        # the policy draws with
+        for days in (0, 14):
+            with mock.patch.object(
+                policies.timezone, "now", return_value=now + timedelta(days=days)
+            ):
+                version = mooclet.get_version({"mooclet": mooclet})
+                version_ids, successes, failures = policies.get_decayed_parameters(
+                    mooclet, policy, policies.get_decay_time(policy)
+                )
+            probabilities = sampling.win_probabilities(successes, failures)
+            self.assertAlmostEqual(
+                AssignmentLog.objects.latest("id").propensity,
+                probabilities[version_ids.index(version.pk)],
+                places=3,
+            )
+
+
+class TargetProbabilityTests(EngineTestCase):
+    def test_read_only(self):
+        for policy_name in ("thompson_sampling", "decayed_thompson_sampling"):
+            mooclet = Mooclet.objects.create(
+                policy=Policy.objects.create(name=policy_name)
+            )
+            for i in range(3):
+                Explanation.objects.create(mooclet=mooclet, text="e{}".format(i))
+            Variable.objects.get_or_create(
+                name="student_rating",
+                content_type=ContentType.objects.get_for_model(Version),
+            )
+            probabilities = evaluation.get_target_probabilities(mooclet, policy_name)
+            self.assertAlmostEqual(probabilities.sum(), 1.0)
+            # same priors for every version
+            self.assertAlmostEqual(probabilities[0], 1.0 / 3, places=3)
+            self.assertFalse(VersionPolicyState.objects.exists())
+
+
+class VersionPolicyStateCacheTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rating = Variable.objects.create(
+            name="student_rating",
+            content_type=ContentType.objects.get_for_model(Version),
+            is_user_variable=True,
+        )
+
+    def make_mooclet(self, policy_name):
+        policy = Policy.objects.create(name=policy_name)
+        mooclet = Mooclet.objects.create(policy=policy)
+        for i in range(2):
+            Explanation.objects.create(mooclet=mooclet, text="e{}".format(i))
+        return mooclet, list(mooclet.get_version_ids())
+
+    def test_changed_elsewhere(self):
+        mooclet, version_ids = self.make_mooclet("thompson_sampling")
+        policy = mooclet.policy
+        states = VersionPolicyState.objects.get_states(policy, version_ids)
+        # a change another process made, no signal reaches this one
+        VersionPolicyState.objects.filter(pk=states[version_ids[0]].pk).update(
+            prior_success=5.0
+        )
+        self.assertEqual(
+            VersionPolicyState.objects.get_states(policy, version_ids)[
+                version_ids[0]
+            ].prior_success,
+            1.0,
+        )
+        with override_settings(MOOCLET_SNAPSHOT_TIMEOUT=0):
+            states = VersionPolicyState.objects.get_states(policy, version_ids)
+        self.assertEqual(states[version_ids[0]].prior_success, 5.0)
+        self.assertEqual(
+            VersionPolicyState.objects.get_states(policy, version_ids, fresh=True)[
+                version_ids[0]
+            ].prior_success,
+            5.0,
+        )
+
+    def test_deleted_elsewhere(self):
+        user = User.objects.create(username="u")
+        for policy_name, update in (
+            ("linucb", policies.linucb_update),
+            ("decayed_thompson_sampling", policies.decayed_thompson_sampling_update),
+        ):
+            mooclet, version_ids = self.make_mooclet(policy_name)
+            policy = mooclet.policy
+            VersionPolicyState.objects.get_states(policy, version_ids)
+            # deleted by another process, no signal reaches this one
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "DELETE FROM engine_versionpolicystate WHERE policy_id = %s",
+                    [policy.pk],
+                )
+            context = {"mooclet": mooclet, "policy": policy, "user": user}
+            update(
+                policy_registry.get_compiled_policy(policy.pk).variables,
+                context,
+                Value(variable=self.rating, object_id=version_ids[0], value=10.0),
+            )
+            self.assertTrue(
+                VersionPolicyState.objects.filter(
+                    policy=policy, version_id=version_ids[0]
+                ).exists()
+            )
+            self.assertIsNotNone(mooclet.get_version(dict(context)))
+
+
+class WeightTableTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.weight = Variable.objects.create(
+            name="version_weight",
+            content_type=ContentType.objects.get_for_model(Version),
+        )
+
+    def add_version(self, mooclet, weight):
+        version = Explanation.objects.create(mooclet=mooclet, text="e")
+        Value.objects.create(variable=self.weight, object_id=version.pk, value=weight)
+        return version
+
+    def test_versions_and_weights_change(self):
+        policy = Policy.objects.create(
+            name="weighted_random", parameters=json.dumps({"buffer_size": 100})
+        )
+        policy.variables.add(self.weight)
+        mooclet = Mooclet.objects.create(policy=policy)
+        first = self.add_version(mooclet, 1.0)
+        self.assertEqual(mooclet.get_version({"mooclet": mooclet}).pk, first.pk)
+
+        # a new version is drawn at once, from a rebuilt table and buffer
+        second = self.add_version(mooclet, 1e9)
+        self.assertEqual(mooclet.get_version({"mooclet": mooclet}).pk, second.pk)
+        Value.objects.create(variable=self.weight, object_id=first.pk, value=1e18)
+        self.assertEqual(mooclet.get_version({"mooclet": mooclet}).pk, first.pk)
+        probabilities = policy_probabilities.weighted_random(
+            policy_registry.get_compiled_policy(policy.pk).variables,
+            {"mooclet": mooclet, "policy": policy},
+        )
+        self.assertEqual(
+            [version.pk for version in probabilities], [first.pk, second.pk]
+        )
+
+
+class ReplayTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        version_content_type = ContentType.objects.get_for_model(Version)
+        cls.rating = Variable.objects.create(
+            name="student_rating",
+            content_type=version_content_type,
+            is_user_variable=True,
+        )
+        cls.feature = Variable.objects.create(name="prior_grade", is_user_variable=True)
+        cls.users = [User.objects.create(username="u{}".format(i)) for i in range(3)]
+        for user, grade in zip(cls.users, [1.0, 3.0]):
+            Value.objects.create(variable=cls.feature, user=user, value=grade)
+
+    def create_mooclet(self, name):
+        policy = Policy.objects.create(name=name)
+        policy.variables.add(self.rating, self.feature)
+        mooclet = Mooclet.objects.create(policy=policy)
+        version = Explanation.objects.create(mooclet=mooclet, text="e")
+        return policy, mooclet, version
+
+    def test_linucb_learns_like_the_live_policy(self):
+        policy, mooclet, version = self.create_mooclet("linucb")
+        compiled = policy_registry.get_compiled_policy(policy.pk)
+        # the third user has no features
+        for user, rating in zip(self.users * 2, [5.0, 8.0, 2.0, 10.0, 0.0, 7.0]):
+            compiled.update(
+                Value.objects.create(
+                    variable=self.rating,
+                    object_id=version.pk,
+                    user=user,
+                    value=rating,
+                )
+            )
+        a_inverse, b = policies.unpack_linear_state(
+            VersionPolicyState.objects.get(policy=policy).linear_state, 2, 1.0
+        )
+
+        version_ids, arms, rewards, users, times = replay.load_rating_events(mooclet)
+        model = replay.LinUCBReplay(
+            1,
+            None,
+            features=policies.get_users_features([self.feature], users),
+            dimension=2,
+        )
+        for arm, reward, user, time in zip(arms, rewards, users, times):
+            model.update(arm, reward, user, time)
+        self.assertTrue(numpy.allclose(model.a_inverse[0], a_inverse))
+        self.assertTrue(numpy.allclose(model.b[0], b))
+
+        result = replay.replay_mooclet(mooclet, seed=0)
+        self.assertEqual(result["matched"], 6)
+
+    def test_linucb_without_policy(self):
+        policy, mooclet, version = self.create_mooclet("uniform_random")
+        with self.assertRaises(ValueError):
+            replay.replay_mooclet(mooclet, policy_name="linucb")
+
+    def test_decayed_thompson_sampling(self):
+        policy, mooclet, version = self.create_mooclet("decayed_thompson_sampling")
+        policy.parameters = json.dumps({"half_life_days": 1})
+        policy.save()
+        now = timezone.now()
+        for days, rating in [(2, 10.0), (1, 0.0), (0, 5.0)]:
+            value = Value.objects.create(
+                variable=self.rating, object_id=version.pk, value=rating
+            )
+            Value.objects.filter(pk=value.pk).update(
+                timestamp=now - timedelta(days=days)
+            )
+
+        version_ids, arms, rewards, users, times = replay.load_rating_events(mooclet)
+        model = replay.DecayedThompsonReplay(1, None, half_life_days=1)
+        for arm, reward, user, time in zip(arms, rewards, users, times):
+            model.update(arm, reward, user, time)
+        # each rating is halved once for every day since it was given
+        self.assertAlmostEqual(model.decayed_success[0], 0.25 + 0.0 + 0.5)
+        self.assertAlmostEqual(model.decayed_failure[0], 0.0 + 0.5 + 0.5)
+        self.assertAlmostEqual(
+            model.decay(numpy.array([times[-1] + 86400.0]))[0, 0], 0.5
+        )
+
+        result = replay.replay_mooclet(mooclet, seed=0)
+        self.assertEqual(result["matched"], 3)
+
+
+def beta_function(a, b):
+    return math.exp(math.lgamma(a) + math.lgamma(b) - math.lgamma(a + b))
+
+
+class WinProbabilityTests(SimpleTestCase):
+    def test_two_arms_closed_form(self):
+        # P(X2 > X1) for integer a2 (Miller, "Formulas for Bayesian A/B testing")
+        for a1, b1, a2, b2 in [(1, 1, 2, 1), (3, 7, 5, 5), (20, 30, 25, 28)]:
+            second = sum(
+                beta_function(a1 + i, b1 + b2)
+                / ((b2 + i) * beta_function(1 + i, b2) * beta_function(a1, b1))
+                for i in range(a2)
+            )
+            probabilities = sampling.beta_win_probabilities([a1, a2], [b1, b2])
+            self.assertAlmostEqual(probabilities[1], second, delta=1e-4)
+            self.assertAlmostEqual(probabilities.sum(), 1.0)
+
+    def test_equal_posteriors(self):
+        probabilities = sampling.beta_win_probabilities([1.9] * 4, [0.1] * 4)
+        self.assertTrue(numpy.allclose(probabilities, 0.25, atol=1e-4))
+
+    def test_monte_carlo(self):
+        # shapes below one, the default prior and large counts at once
+        successes = [0.5, 1.9, 12.3, 40.0, 150.2, 7.0]
+        failures = [0.7, 0.1, 9.8, 35.5, 160.0, 2.5]
+        iterations = 1000000
+        draws = sampling.beta_draws(
+            successes, failures, random_state=numpy.random.RandomState(0)
+        )(iterations)
+        simulated = (
+            numpy.bincount(numpy.argmax(draws, axis=1), minlength=len(successes))
+            / iterations
+        )
+        # within 5 standard errors of the simulation
+        error = numpy.sqrt(simulated * (1 - simulated) / iterations)
+        integrated = sampling.beta_win_probabilities(successes, failures)
+        self.assertTrue(
+            numpy.all(numpy.abs(integrated - simulated) <= 5 * error + 1e-4),
+            (integrated, simulated),
+        )
+
+    def recording_draw(self, successes, failures, seed=0):
+        # beta draws that also keep every block handed to simulate_win_probabilities
+        blocks = []
+        draw = sampling.beta_draws(
+            successes, failures, random_state=numpy.random.RandomState(seed)
+        )
+
+        def recording(size):
+            blocks.append(draw(size))
+            return blocks[-1]
+
+        return recording, blocks
+
+    def largest_error(self, blocks):
+        winners = numpy.argmax(numpy.concatenate(blocks), axis=1)
+        probabilities = numpy.bincount(winners, minlength=blocks[0].shape[1]) / len(
+            winners
+        )
+        return numpy.sqrt(probabilities * (1 - probabilities) / len(winners)).max()
+
+    def test_simulation_stops_at_standard_error(self):
+        draw, blocks = self.recording_draw([5.0, 6.0, 7.0], [5.0, 5.0, 5.0])
+        sampling.simulate_win_probabilities(
+            draw, 3, iterations=1000, standard_error=0.002
+        )
+        # the sample size doubles each round
+        sizes = [len(block) for block in blocks]
+        self.assertEqual(sizes, [1000] + [1000 * 2**i for i in range(len(sizes) - 1)])
+        self.assertGreater(len(sizes), 1)
+        # and stops at the first round within the target, not before or after it
+        self.assertLessEqual(self.largest_error(blocks), 0.002)
+        self.assertGreater(self.largest_error(blocks[:-1]), 0.002)
+
+    def test_simulation_stops_at_max_iterations(self):
+        draw, blocks = self.recording_draw([5.0, 6.0, 7.0], [5.0, 5.0, 5.0])
+        probabilities = sampling.simulate_win_probabilities(
+            draw, 3, iterations=1000, standard_error=0, max_iterations=5000
+        )
+        # the last block is cut short so the total lands on max_iterations
+        self.assertEqual([len(block) for block in blocks], [1000, 1000, 2000, 1000])
+        self.assertAlmostEqual(probabilities.sum(), 1.0)
+
+    def test_simulation_agrees_with_integration(self):
+        successes = [0.5, 1.9, 12.3, 40.0, 150.2, 7.0]
+        failures = [0.7, 0.1, 9.8, 35.5, 160.0, 2.5]
+        standard_error = 0.002
+        simulated = sampling.simulate_win_probabilities(
+            sampling.beta_draws(
+                successes, failures, random_state=numpy.random.RandomState(0)
+            ),
+            len(successes),
+            standard_error=standard_error,
+        )
+        integrated = sampling.beta_win_probabilities(successes, failures)
+        # within 5 of the standard errors the simulation stopped at
+        self.assertTrue(
+            numpy.all(numpy.abs(integrated - simulated) <= 5 * standard_error),
+            (integrated, simulated),
+        )
+
+
+class AliasTableTests(SimpleTestCase):
+    def assertSamplesMatch(self, weights, size=200000):
+        table = sampling.AliasTable(weights)
+        counts = numpy.bincount(
+            table.sample(size, random_state=numpy.random.RandomState(0)),
+            minlength=len(weights),
+        )
+        expected = numpy.asarray(weights, dtype=float) / sum(weights)
+        frequencies = counts / size
+        # within 5 standard errors, and exactly zero where the weight is
+        error = numpy.sqrt(expected * (1 - expected) / size)
+        self.assertTrue(
+            numpy.all(numpy.abs(frequencies - expected) <= 5 * error),
+            (frequencies, expected),
+        )
+        self.assertTrue(numpy.allclose(table.probabilities, expected))
+
+    def test_frequencies(self):
+        self.assertSamplesMatch([1.0, 2.0, 3.0, 4.0])
+        self.assertSamplesMatch([0.01, 100.0, 5.5, 0.3, 7.0])
+        self.assertSamplesMatch([1.0] * 7)
+
+    def test_zero_weights(self):
+        self.assertSamplesMatch([0.0, 3.0, 0.0, 1.0])
+        self.assertSamplesMatch([0.0, 0.0, 2.0])
+
+    def test_degenerate_weights(self):
+        table = sampling.AliasTable([5.0])
+        self.assertEqual(table.sample(), 0)
+        self.assertEqual(table.sample(3).tolist(), [0, 0, 0])
+        for weights in ([], [0.0, 0.0], [1.0, -1.0], [1.0, float("nan")]):
+            with self.assertRaises(ValueError):
+                sampling.AliasTable(weights)
+
+
+class LinUCBTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rating = Variable.objects.create(
+            name="student_rating",
+            content_type=ContentType.objects.get_for_model(Version),
+            is_user_variable=True,
+        )
+        cls.features = [
+            Variable.objects.create(name=name, is_user_variable=True)
+            for name in ("prior_grade", "attempts")
+        ]
+        cls.users = [User.objects.create(username="u{}".format(i)) for i in range(4)]
+        for user, values in zip(cls.users, [(1.0, 2.0), (3.0, 0.5), (-2.0, 4.0)]):
+            for variable, value in zip(cls.features, values):
+                Value.objects.create(variable=variable, user=user, value=value)
+
+    def test_inverse_after_updates(self):
+        policy = Policy.objects.create(
+            name="linucb", parameters=json.dumps({"ridge": 2.0})
+        )
+        policy.variables.add(self.rating, *self.features)
+        mooclet = Mooclet.objects.create(policy=policy)
+        version = Explanation.objects.create(mooclet=mooclet, text="e")
+        compiled = policy_registry.get_compiled_policy(policy.pk)
+
+        a = 2.0 * numpy.identity(3)
+        b = numpy.zeros(3)
+        # the last user has no features, only the constant
+        ratings = [(0, 7.0), (1, 3.0), (2, 10.0), (3, 5.0), (0, 1.0), (2, 0.0)]
+        for index, rating in ratings:
+            user = self.users[index]
+            compiled.update(
+                Value.objects.create(
+                    variable=self.rating,
+                    object_id=version.pk,
+                    user=user,
+                    value=rating,
+                )
+            )
+            features = policies.get_user_features(self.features, user)
+            a += numpy.outer(features, features)
+            b += rating * 0.1 * features
+
+        a_inverse, stored_b = policies.unpack_linear_state(
+            VersionPolicyState.objects.get(policy=policy, version=version).linear_state,
+            3,
+            2.0,
+        )
+        self.assertTrue(numpy.allclose(a_inverse, numpy.linalg.inv(a)))
+        self.assertTrue(numpy.allclose(stored_b, b))
+
+
+class EstimatorTests(SimpleTestCase):
+    # two versions, four logged events, worked out by hand
+    arms = numpy.array([0, 1, 0, 1])
+    propensities = numpy.array([0.5, 0.5, 0.25, 0.75])
+    rewards = numpy.array([1.0, 0.0, 0.5, 0.8])
+
+    def evaluate(self, target, **kwargs):
+        return evaluation.evaluate(
+            target, self.arms, self.propensities, self.rewards, 2, **kwargs
+        )
+
+    def test_fixed_target(self):
+        # importance weights 1.6, 0.4, 3.2, 4/15
+        # reward model: version means 0.75 and 0.4, so the target's model value is 0.68
+        result = self.evaluate([0.8, 0.2])
+        self.assertAlmostEqual(result["logged"], 0.575)
+        # (1.6 + 0 + 1.6 + 0.8 * 4 / 15) / 4
+        self.assertAlmostEqual(result["ips"], 0.853333333, places=6)
+        # 10.24 / 16.4
+        self.assertAlmostEqual(result["snips"], 0.624390244, places=6)
+        # 0.68 + mean(0.4, -0.16, -0.8, 0.4 * 4 / 15)
+        self.assertAlmostEqual(result["dr"], 17.0 / 30.0)
+        # (16.4 / 3) ** 2 / (117.28 / 9)
+        self.assertAlmostEqual(result["effective_sample_size"], 268.96 / 117.28)
+
+    def test_per_event_target(self):
+        target = [[1.0, 0.0], [0.0, 1.0], [1.0, 0.0], [1.0, 0.0]]
+        # importance weights 2, 2, 4, 0
+        result = self.evaluate(target, reward_estimates=[0.5, 0.5])
+        self.assertAlmostEqual(result["ips"], 1.0)
+        self.assertAlmostEqual(result["snips"], 0.5)
+        # 0.5 + mean(1, -1, 0, 0)
+        self.assertAlmostEqual(result["dr"], 0.5)
+
+    def test_logging_policy(self):
+        # evaluating the logging policy itself gives back the logged mean
+        target = numpy.zeros((4, 2))
+        target[numpy.arange(4), self.arms] = self.propensities
+        target[numpy.arange(4), 1 - self.arms] = 1 - self.propensities
+        result = self.evaluate(target)
+        self.assertAlmostEqual(result["ips"], 0.575)
+        self.assertAlmostEqual(result["snips"], 0.575)
+
+    def test_no_events(self):
+        result = evaluation.evaluate(
+            [0.5, 0.5], numpy.array([], dtype=int), numpy.array([]), numpy.array([]), 2
+        )
+        self.assertEqual(result["events"], 0)
+        self.assertIsNone(result["ips"])
+        self.assertIsNone(result["snips"])
+        self.assertIsNone(result["dr"])
+
+    def test_target_shape(self):
+        with self.assertRaises(ValueError):
+            self.evaluate([[0.5, 0.5]] * 3)
+
+
+class MoocletAssignmentTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="u")
+        cls.mooclet = Mooclet.objects.create(
+            policy=Policy.objects.create(name="prompt_shortlong_condition")
+        )
+        cls.versions = [
+            Explanation.objects.create(mooclet=cls.mooclet, text="e{}".format(i))
+            for i in range(2)
+        ]
+
+    def test_assign_once(self):
+        first, created = MoocletAssignment.objects.get_or_assign(
+            self.user, self.mooclet, lambda: self.versions[0]
+        )
+        self.assertEqual((first.pk, created), (self.versions[0].pk, True))
+        again, created = MoocletAssignment.objects.get_or_assign(
+            self.user, self.mooclet, lambda: self.versions[1]
+        )
+        self.assertEqual((again.pk, created), (self.versions[0].pk, False))
+
+    def test_assigned_concurrently(self):
+        def choose_version():
+            # another request assigns a version between the lookup and the insert
+            MoocletAssignment.objects.create(
+                user=self.user, mooclet=self.mooclet, version=self.versions[1]
+            )
+            return self.versions[0]
+
+        version, created = MoocletAssignment.objects.get_or_assign(
+            self.user, self.mooclet, choose_version
+        )
+        self.assertEqual((version.pk, created), (self.versions[1].pk, False))
+        # the failed insert is rolled back without breaking the transaction
+        self.assertEqual(
+            list(
+                MoocletAssignment.objects.filter(
+                    user=self.user, mooclet=self.mooclet
+                ).values_list("version_id", flat=True)
+            ),
+            [self.versions[1].pk],
+        )
+
+
+class BenchmarkStateTests(EngineTestCase):
+    def test_seeded_like_the_updates(self):
+        mooclet = benchmarks.build_mooclet("linucb", 3, 200, users=10)
+        feature = Variable.objects.get(name="benchmark_feature")
+        version_ids, arms, rewards, users, times = replay.load_rating_events(mooclet)
+        model = replay.LinUCBReplay(
+            3, None, features=policies.get_users_features([feature], users), dimension=2
+        )
+        for arm, reward, user, time in zip(arms, rewards, users, times):
+            model.update(arm, reward, user, time)
+        for arm, version_id in enumerate(version_ids):
+            a_inverse, b = policies.unpack_linear_state(
+                VersionPolicyState.objects.get(
+                    policy=mooclet.policy, version_id=version_id
+                ).linear_state,
+                2,
+                1.0,
+            )
+            self.assertTrue(numpy.allclose(a_inverse, model.a_inverse[arm]))
+            self.assertTrue(numpy.allclose(b, model.b[arm]))
+
+        mooclet = benchmarks.build_mooclet(
+            "decayed_thompson_sampling", 2, 100, users=10
+        )
+        version_ids, arms, rewards, users, times = replay.load_rating_events(mooclet)
+        for arm, version_id in enumerate(version_ids):
+            state = VersionPolicyState.objects.get(
+                policy=mooclet.policy, version_id=version_id
+            )
+            self.assertAlmostEqual(state.decayed_success, rewards[arms == arm].sum())
+            self.assertAlmostEqual(
+                state.decayed_failure, (1 - rewards[arms == arm]).sum()
+            )
+
+
+class ThompsonStateTests(SimpleTestCase):
+    results = [[1, 0, 1, 1], [0, 0], [0.5, 1, 0, 0, 1], []]
+
+    def test_from_results(self):
+        state = algorithms.ThompsonState.fromResults(self.results)
+        self.assertEqual(state.successes.tolist(), [3.0, 0.0, 2.5, 0.0])
+        self.assertEqual(state.trials.tolist(), [4.0, 2.0, 5.0, 0.0])
+
+    def test_update(self):
+        state = algorithms.ThompsonState(3)
+        state.update(1, 1.0)
+        state.update(1, 0.0)
+        state.update(2, 0.25)
+        self.assertEqual(state.successes.tolist(), [0.0, 1.0, 0.25])
+        self.assertEqual(state.trials.tolist(), [0.0, 2.0, 1.0])
+
+    def test_posterior(self):
+        state = algorithms.ThompsonState.fromResults(self.results)
+        a, b = state.posterior()
+        # beta(1 + successes, 1 + failures)
+        self.assertEqual(a.tolist(), [4.0, 1.0, 3.5, 1.0])
+        self.assertEqual(b.tolist(), [2.0, 3.0, 3.5, 1.0])
+        self.assertTrue(numpy.allclose(state.means(), [4.0 / 6, 1.0 / 4, 0.5, 0.5]))
+
+    def test_choose_matches_results(self):
+        explanations = ["a", "b", "c", "d"]
+        state = algorithms.ThompsonState.fromResults(self.results)
+        for seed in range(20):
+            numpy.random.seed(seed)
+            expected = algorithms.computeExplanation_Thompson(
+                None, explanations, self.results
+            )
+            idx, mean = state.choose(random_state=numpy.random.RandomState(seed))
+            self.assertEqual((explanations[idx], mean), expected)
+            numpy.random.seed(seed)
+            self.assertEqual(
+                algorithms.computeExplanation_ThompsonCounts(
+                    None, explanations, state.successes, state.trials
+                ),
+                expected,
+            )
+
+
+class CompiledPolicyTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.weight = Variable.objects.create(name="version_weight")
+        cls.policy = Policy.objects.create(
+            name="uniform_random", parameters=json.dumps({"buffer_size": 10})
+        )
+
+    def test_policy_saved(self):
+        compiled = policy_registry.get_compiled_policy(self.policy.pk)
+        self.assertIs(policy_registry.get_compiled_policy(self.policy.pk), compiled)
+        self.assertEqual(compiled.buffer_size, 10)
+
+        self.policy.parameters = json.dumps({"buffer_size": 20})
+        self.policy.save()
+        compiled = policy_registry.get_compiled_policy(self.policy.pk)
+        self.assertEqual(compiled.buffer_size, 20)
+
+        self.policy.variables.add(self.weight)
+        compiled = policy_registry.get_compiled_policy(self.policy.pk)
+        self.assertEqual(compiled.variables, [self.weight])
+
+        self.weight.name = "weight"
+        self.weight.save()
+        compiled = policy_registry.get_compiled_policy(self.policy.pk)
+        self.assertEqual(compiled.variables[0].name, "weight")
+
+    def test_changed_in_another_process(self):
+        compiled = policy_registry.get_compiled_policy(self.policy.pk)
+        # an update without signals, as seen from this process
+        Policy.objects.filter(pk=self.policy.pk).update(
+            parameters=json.dumps({"buffer_size": 30})
+        )
+        self.assertIs(policy_registry.get_compiled_policy(self.policy.pk), compiled)
+        # the other process bumped the shared stamp from its signal handler
+        snapshots.bump_policy_stamp(self.policy.pk)
+        self.assertEqual(
+            policy_registry.get_compiled_policy(self.policy.pk).buffer_size, 30
+        )
+
+        Policy.variables.through.objects.create(
+            policy_id=self.policy.pk, variable_id=self.weight.pk
+        )
+        snapshots.bump_variables_stamp()
+        self.assertEqual(
+            policy_registry.get_compiled_policy(self.policy.pk).variables,
+            [self.weight],
+        )
+
+    def test_register_policy(self):
+        def custom(variables, context):
+            return "custom"
+
+        def custom_probabilities(variables, context):
+            return {"custom": 1.0}
+
+        def custom_update(variables, context, value):
+            context["updated"] = value
+
+        def unregister():
+            for registry in (
+                policy_registry.custom_policies,
+                policy_registry.custom_policy_probabilities,
+                policy_registry.custom_policy_updates,
+            ):
+                registry.pop("uniform_random", None)
+            policy_registry.clear_compiled_policies()
+
+        builtin = policy_registry.get_compiled_policy(self.policy.pk)
+        self.assertIs(builtin.function, policies.uniform_random)
+        self.addCleanup(unregister)
+        policy_registry.register_policy(
+            "uniform_random", custom, custom_probabilities, custom_update
+        )
+        # registering replaces the compiled built-in
+        compiled = policy_registry.get_compiled_policy(self.policy.pk)
+        self.assertEqual(compiled.run({}), "custom")
+        self.assertIs(compiled.probability_function, custom_probabilities)
+        self.assertIs(compiled.update_function, custom_update)
+        self.assertIs(policy_registry.get_policy_function("uniform_random"), custom)
+        self.assertIs(
+            policy_registry.get_policy_function("thompson_sampling"),
+            policies.thompson_sampling,
+        )
+
+
+class ValueSummaryTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rating = Variable.objects.create(
+            name="student_rating",
+            content_type=ContentType.objects.get_for_model(Version),
+            is_user_variable=True,
+        )
+        cls.mooclet = Mooclet.objects.create(
+            policy=Policy.objects.create(name="thompson_sampling")
+        )
+        cls.versions = [
+            Explanation.objects.create(mooclet=cls.mooclet, text="e{}".format(i))
+            for i in range(2)
+        ]
+
+    def record(self, version, rating):
+        with transaction.atomic():
+            value = Value.objects.create(
+                variable=self.rating, object_id=version.pk, value=rating
+            )
+            ValueSummary.objects.record_value(value)
+
+    def assertInStep(self):
+        for version in self.versions:
+            ratings = list(
+                Value.objects.filter(
+                    variable=self.rating, object_id=version.pk
+                ).values_list("value", flat=True)
+            )
+            summary = ValueSummary.objects.get_summary(self.rating, version.pk)
+            self.assertEqual(summary.count, len(ratings))
+            if ratings:
+                self.assertAlmostEqual(summary.mean, numpy.mean(ratings))
+                self.assertAlmostEqual(summary.variance, numpy.var(ratings))
+                self.assertAlmostEqual(summary.std_dev, numpy.std(ratings))
+
+    def test_in_step_with_values(self):
+        for i, rating in enumerate([7.0, 3.0, 10.0, 0.0, 5.5, 8.0, 2.0]):
+            self.record(self.versions[i % 2], rating)
+            self.assertInStep()
+        summaries = dict(
+            ValueSummary.objects.values_list("object_id", "count").order_by("object_id")
+        )
+        ValueSummary.objects.rebuild(self.rating)
+        self.assertEqual(
+            dict(ValueSummary.objects.values_list("object_id", "count")), summaries
+        )
+        self.assertInStep()
+
+    def test_created_concurrently(self):
+        version = self.versions[0]
+        summaries = ValueSummary.objects.filter
+
+        def filter(*args, **kwargs):
+            queryset = summaries(*args, **kwargs)
+
+            def update(**changes):
+                # another request records its rating and creates the summary between
+                # the update finding no row and the insert
+                Value.objects.create(
+                    variable=self.rating, object_id=version.pk, value=9.0
+                )
+                ValueSummary.objects.bulk_create(
+                    [
+                        ValueSummary(
+                            variable=self.rating,
+                            object_id=version.pk,
+                            count=1,
+                            total=9.0,
+                            total_squares=81.0,
+                        )
+                    ]
+                )
+                del queryset.update
+                return 0
+
+            queryset.update = update
+            return queryset
+
+        with mock.patch.object(ValueSummary.objects, "filter", filter):
+            self.record(version, 4.0)
+        self.assertEqual(ValueSummary.objects.filter(object_id=version.pk).count(), 1)
+        self.assertInStep()
+
+    def test_rolled_back_with_the_value(self):
+        with mock.patch.object(
+            policy_registry.CompiledPolicy, "update", side_effect=RuntimeError
+        ):
+            with self.assertRaises(RuntimeError):
+                self.record(self.versions[0], 4.0)
+        self.assertFalse(Value.objects.filter(variable=self.rating).exists())
+        self.assertFalse(ValueSummary.objects.exists())
+
+    def test_stamp_bumped_on_commit(self):
+        stamp = snapshots.get_stamp(self.mooclet.pk)
+        with mock.patch.object(transaction, "on_commit") as on_commit:
+            self.record(self.versions[0], 4.0)
+        # nothing is marked out of date until the rating is committed
+        self.assertEqual(snapshots.get_stamp(self.mooclet.pk), stamp)
+        for call in on_commit.call_args_list:
+            call[0][0]()
+        self.assertNotEqual(snapshots.get_stamp(self.mooclet.pk), stamp)
+
+
+@override_settings(MOOCLET_PROBABILITY_METHOD="monte_carlo")
+class RecomputeCourseTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rating = Variable.objects.create(
+            name="student_rating",
+            content_type=ContentType.objects.get_for_model(Version),
+            is_user_variable=True,
+        )
+        policy = Policy.objects.create(name="thompson_sampling")
+        cls.course = Course.objects.create(name="course")
+        quiz = Quiz.objects.create(name="quiz", course=cls.course)
+        question = Question.objects.create(name="q", text="q")
+        question.quiz.add(quiz)
+        random_state = numpy.random.RandomState(0)
+        for i in range(recompute.MIN_POOL_MOOCLETS + 1):
+            mooclet = Mooclet.objects.create(policy=policy)
+            Answer.objects.create(
+                question=question, text="a", correct=False, mooclet_explanation=mooclet
+            )
+            for j in range(3):
+                version = Explanation.objects.create(mooclet=mooclet, text="e")
+                for rating in random_state.randint(0, 11, size=j * 5):
+                    Value.objects.create(
+                        variable=cls.rating, object_id=version.pk, value=rating
+                    )
+        ValueSummary.objects.rebuild(cls.rating)
+
+    def stored_probabilities(self):
+        return dict(
+            CurrentValue.objects.filter(
+                variable__name="explanation_probability"
+            ).values_list("object_id", "value")
+        )
+
+    def test_pool_matches_serial(self):
+        serial = recompute.recompute_course(self.course, workers=1, seed=3)
+        stored = self.stored_probabilities()
+        self.assertEqual(len(serial), recompute.MIN_POOL_MOOCLETS + 1)
+        self.assertEqual(len(stored), 3 * len(serial))
+
+        with mock.patch.object(
+            recompute,
+            "ProcessPoolExecutor",
+            wraps=recompute.ProcessPoolExecutor,
+        ) as executor:
+            pooled = recompute.recompute_course(self.course, workers=2, seed=3)
+        executor.assert_called_once_with(max_workers=2)
+        self.assertEqual(pooled, serial)
+        self.assertEqual(self.stored_probabilities(), stored)
+
+        # the draws really are simulated: another seed gives other probabilities
+        recompute.recompute_course(self.course, workers=1, seed=4)
+        self.assertNotEqual(self.stored_probabilities(), stored)
+
+
+class SnapshotTests(EngineTestCase):
+    def test_bump_makes_snapshot_stale(self):
+        builds = []
+
+        def build():
+            builds.append(len(builds))
+            return len(builds)
+
+        self.assertEqual(snapshots.get_snapshot(1, "test", build), 1)
+        self.assertEqual(snapshots.get_snapshot(1, "test", build), 1)
+        snapshots.bump_stamp(1)
+        self.assertEqual(snapshots.get_snapshot(1, "test", build), 2)
+        # other mooclets keep theirs
+        self.assertEqual(snapshots.get_snapshot(2, "test", build), 3)
+        snapshots.bump_stamp(1)
+        self.assertEqual(snapshots.get_snapshot(2, "test", build), 3)
+        # an evicted stamp is recreated from the clock, never matching an old one
+        cache.delete(snapshots.stamp_key(2))
+        self.assertEqual(snapshots.get_snapshot(2, "test", build), 4)
+
+    def test_version_save_clears_version_ids(self):
+        mooclet = Mooclet.objects.create()
+        first = Explanation.objects.create(mooclet=mooclet, text="e")
+        self.assertEqual(mooclet.get_version_ids(), (first.pk,))
+        with self.assertNumQueries(0):
+            self.assertEqual(mooclet.get_version_ids(), (first.pk,))
+
+        stamp = snapshots.get_stamp(mooclet.pk)
+        second = Explanation.objects.create(mooclet=mooclet, text="e")
+        self.assertEqual(mooclet.get_version_ids(), (first.pk, second.pk))
+        self.assertNotEqual(snapshots.get_stamp(mooclet.pk), stamp)
+
+
+class UniformRandomTests(EngineTestCase):
+    def draw(self, mooclet, size=50):
+        return policies.uniform_random(
+            policy_registry.PolicyVariables(), {"mooclet": mooclet}, size=size
+        )
+
+    def test_versions_added_and_deleted(self):
+        mooclet = Mooclet.objects.create()
+        first = Explanation.objects.create(mooclet=mooclet, text="e")
+        self.assertEqual({version.pk for version in self.draw(mooclet)}, {first.pk})
+
+        # a new version can be assigned at once
+        second = Explanation.objects.create(mooclet=mooclet, text="e")
+        self.assertEqual(
+            {version.pk for version in self.draw(mooclet)}, {first.pk, second.pk}
+        )
+
+        first.delete()
+        self.assertEqual({version.pk for version in self.draw(mooclet)}, {second.pk})
+        second.delete()
+        self.assertIsNone(self.draw(mooclet, size=None))
+
+
+class CurrentValueTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.variable = Variable.objects.create(name="explanation_probability")
+        cls.user = User.objects.create(username="u")
+
+    def rows(self, user):
+        return list(
+            CurrentValue.objects.filter(variable=self.variable, user=user)
+            .order_by("object_id")
+            .values_list("object_id", "value")
+        )
+
+    def test_upsert(self):
+        for user in (None, self.user):
+            # the raw INSERT ... ON CONFLICT, and the fallback for other backends
+            for upsert in (
+                CurrentValue.objects.upsert,
+                CurrentValue.objects.upsert_rows,
+            ):
+                CurrentValue.objects.filter(variable=self.variable).delete()
+                upsert(self.variable, {1: 0.2, 2: 0.4}, user, add=False)
+                upsert(self.variable, {1: 0.7}, user, add=False)
+                self.assertEqual(self.rows(user), [(1, 0.7), (2, 0.4)])
+                upsert(self.variable, {1: 1.0, 3: 2.0}, user, add=True)
+                self.assertEqual(self.rows(user), [(1, 1.7), (2, 0.4), (3, 2.0)])
+
+    def test_global_and_user_rows(self):
+        # the partial unique constraints keep a global row and a per-user row apart
+        CurrentValue.objects.set_values(self.variable, {1: 0.1})
+        CurrentValue.objects.set_values(self.variable, {1: 0.2}, user=self.user)
+        CurrentValue.objects.set_values(self.variable, {1: 0.3})
+        CurrentValue.objects.set_values(self.variable, {1: 0.4}, user=self.user)
+        self.assertEqual(self.rows(None), [(1, 0.3)])
+        self.assertEqual(self.rows(self.user), [(1, 0.4)])
+        self.assertEqual(CurrentValue.objects.get_value(self.variable, 1), 0.3)
+        self.assertEqual(
+            CurrentValue.objects.get_value(self.variable, 1, self.user), 0.4
+        )
+
+    def test_batches(self):
+        # more rows than fit in one statement
+        values = {object_id: float(object_id) for object_id in range(1, 1001)}
+        self.assertEqual(CurrentValue.objects.set_values(self.variable, values), 1000)
+        CurrentValue.objects.add_values(self.variable, values)
+        self.assertEqual(
+            CurrentValue.objects.get_values(self.variable, values),
+            {object_id: 2 * value for object_id, value in values.items()},
+        )
+
+
+class ValueObjectTests(EngineTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.rating = Variable.objects.create(
+            name="student_rating",
+            content_type=ContentType.objects.get_for_model(Version),
+        )
+        cls.attempts = Variable.objects.create(
+            name="attempts", content_type=ContentType.objects.get_for_model(Quiz)
+        )
+        mooclet = Mooclet.objects.create()
+        cls.versions = [
+            Explanation.objects.create(mooclet=mooclet, text="e{}".format(i))
+            for i in range(5)
+        ]
+        cls.quizzes = [Quiz.objects.create(name="q{}".format(i)) for i in range(3)]
+
+    def create_values(self, repeat):
+        for i in range(repeat):
+            for version in self.versions:
+                Value.objects.create(
+                    variable=self.rating, object_id=version.pk, value=i
+                )
+            for quiz in self.quizzes:
+                Value.objects.create(variable=self.attempts, object_id=quiz.pk, value=i)
+
+    def test_fixed_number_of_queries(self):
+        # content types are cached by then in a running process
+        for variable in (self.rating, self.attempts):
+            ContentType.objects.get_for_id(variable.content_type_id)
+        for repeat in (1, 4):
+            self.create_values(repeat)
+            # the values, then one query for each of the two content types
+            with self.assertNumQueries(3):
+                values = list(Value.objects.order_by("id").with_objects())
+                objects = [
+                    (value.variable_id, value.version or value.quiz) for value in values
+                ]
+            self.assertEqual(len(values), repeat * 8)
+            for value, (variable_id, obj) in zip(values, objects):
+                self.assertEqual(obj.pk, value.object_id)
+                self.assertIsInstance(
+                    obj, Version if variable_id == self.rating.pk else Quiz
+                )
+            Value.objects.all().delete()
+
+        # without it, each value loads its object on its own
+        self.create_values(1)
+        with self.assertNumQueries(1 + 2 * 8):
+            for value in Value.objects.order_by("id"):
+                value.version or value.quiz
@@ -9,7 +9,6 @@ from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from ltilib.utils import display_preview
-from numpy import std
 from qualtrics.utils import provision_qualtrics_quiz
 
 from .forms import *
@@ -249,6 +248,9 @@ def question_results(request, quiz_id, question_id):
     for answer in answers:
         answer_values = []
         for variable in variables:
+            if variable.is_counter:
+                answer_values.append(Counter.objects.get_count(variable, answer.pk))
+                continue
             value = variable.get_data(
                 {"quiz": quiz, "question": question, "answer": answer}
             ).last()
@@ -720,23 +722,16 @@ def mooclet_simulate_probabilities(request, **kwargs):
         float(version_counts[version]) / sum(version_counts.values())
         for version in versions
     ]
-    explanation_probability, created = Variable.objects.get_or_create(
-        name="explanation_probability", content_type=version_content_type
+    explanation_probability, created = Variable.objects.get_or_create_cached(
+        "explanation_probability", version_content_type
+    )
+    CurrentValue.objects.set_values(
+        explanation_probability,
+        {
+            version.pk: probability
+            for version, probability in zip(versions, probabilities)
+        },
     )
-    for version, probability in zip(versions, probabilities):
-        explanation_probability_value = explanation_probability.get_data(
-            {"version": version}
-        ).last()
-        if explanation_probability_value:
-            explanation_probability_value.value = probability
-            explanation_probability_value.save()
-        else:
-            # no current probability stored
-            explanation_probability_value = Value.objects.create(
-                variable=explanation_probability,
-                object_id=version.pk,
-                value=probability,
-            )
     probabilities = [
         "{:.2f}%".format(probability * 100) for probability in probabilities
     ]
@@ -757,20 +752,39 @@ def mooclet_list_values(request, **kwargs):
     mooclet = get_object_or_404(Mooclet, pk=kwargs["mooclet_id"])
     question = get_object_or_404(Question, pk=kwargs["question_id"])
     answer = get_object_or_404(Answer, pk=kwargs["answer_id"])
-    values = []
     # for variable in mooclet.policy.variables.all():
+    values = Value.objects.none()
+    current_values = CurrentValue.objects.none()
+    counts = []
     for variable in Variable.objects.all():
-        for value in variable.get_data(
+        data = variable.get_data(
             {"quiz": quiz, "question": question, "answer": answer, "mooclet": mooclet}
-        ):
-            values.append(value)
+        )
+        if variable.is_current_value:
+            current_values |= data
+        elif variable.is_counter:
+            # shown as one row per object, the total of its shards
+            totals = Counter.objects.get_counts(
+                variable, data.values_list("object_id", flat=True)
+            )
+            counts += [
+                CurrentValue(variable=variable, object_id=object_id, value=total)
+                for object_id, total in sorted(totals.items())
+            ]
+        else:
+            values |= data
+    # one query for the values, and one per type of object they belong to
+    values = values.order_by("variable", "id").select_related("user").with_objects()
+    current_values = current_values.order_by("variable", "object_id").select_related(
+        "user", "variable__content_type"
+    )
 
     context = {
         "quiz": quiz,
         "mooclet": mooclet,
         "question": question,
         "answer": answer,
-        "values": values,
+        "values": list(values) + list(current_values) + counts,
     }
     return render(request, "engine/mooclet_list_values.html", context)
 
@@ -785,87 +799,71 @@ def mooclet_results(request, **kwargs):
     # determine appropriate variables
     variables = []
     variables.append(
-        Variable.objects.get_or_create(
-            name="explanation_probability", content_type=version_content_type
+        Variable.objects.get_or_create_cached(
+            "explanation_probability", version_content_type
         )[0]
     )
     variables.append(
-        Variable.objects.get_or_create(
-            name="mean_student_rating",
+        Variable.objects.get_or_create_cached(
+            "mean_student_rating",
+            version_content_type,
             display_name="Mean Student Rating",
-            content_type=version_content_type,
         )[0]
     )
     variables.append(
-        Variable.objects.get_or_create(
-            name="num_students",
-            display_name="Number of Students",
-            content_type=version_content_type,
+        Variable.objects.get_or_create_cached(
+            "num_students", version_content_type, display_name="Number of Students"
         )[0]
     )
     variables.append(
-        Variable.objects.get_or_create(
-            name="rating_std_dev",
+        Variable.objects.get_or_create_cached(
+            "rating_std_dev",
+            version_content_type,
             display_name="Standard Deviation of Rating",
-            content_type=version_content_type,
         )[0]
     )
     # variables = [v for v in Variable.objects.all() if v.content_type.name == 'version']
     versions = mooclet.version_set.all()
+    rating_summaries = ValueSummary.objects.get_summaries(
+        Variable.objects.get_cached("student_rating", first=True),
+        [version.pk for version in versions],
+    )
+    # current values of every variable, read with one query each
+    current_values = {
+        variable.pk: CurrentValue.objects.get_values(
+            variable, [version.pk for version in versions]
+        )
+        for variable in variables
+    }
+    new_values = {variable.pk: {} for variable in variables}
     values_matrix = []
     # for variable in mooclet.policy.variables.all():
     for version in versions:
         version_values = []
+        rating_summary = rating_summaries.get(version.pk, ValueSummary())
         for variable in variables:
             new_value = None
             # value = variable.get_data({'quiz':quiz, 'version':version }).last()
 
             if variable.name == "mean_student_rating":
-                new_value = (
-                    Variable.objects.filter(name="student_rating")
-                    .first()
-                    .get_data({"quiz": quiz, "version": version})
-                    .all()
-                    .aggregate(Avg("value"))
-                )
-                new_value = new_value["value__avg"]
+                new_value = rating_summary.mean
             elif variable.name == "num_students":
-                new_value = (
-                    Variable.objects.filter(name="student_rating")
-                    .first()
-                    .get_data({"quiz": quiz, "version": version})
-                    .count()
-                )
+                new_value = rating_summary.count
             elif variable.name == "rating_std_dev":
-
-                ratings = [
-                    v.value
-                    for v in Variable.objects.filter(name="student_rating")
-                    .first()
-                    .get_data({"quiz": quiz, "version": version})
-                    .all()
-                ]
-                if len(ratings) >= 1:
-                    new_value = std(ratings)
-                # new_value = new_value['value__stddev']
-            #     new_value = Variable.objects.get(name='student_rating').get_data({'quiz':quiz, 'version':version }).count()
+                new_value = rating_summary.std_dev
             # new_value = Variable.objects.filter(name='student_rating').first().get_data({'quiz':quiz, 'version':version }).all().aggregate(StdDev('value', sample=True))
-            value = Value.objects.filter(variable=variable, object_id=version.pk).last()
-
-            if new_value and value:
-                value.value = new_value
-                value.save()
-                version_values.append("{:.2f}".format(value.value))
-            elif new_value and not value:
-                value = Value.objects.create(
-                    variable=variable, object_id=version.pk, value=new_value
-                )
-                version_values.append("{:.2f}".format(value.value))
-            elif value and not new_value:
-                version_values.append("{:.2f}".format(value.value))
+            value = current_values[variable.pk].get(version.pk)
+
+            if new_value:
+                new_values[variable.pk][version.pk] = new_value
+                version_values.append("{:.2f}".format(new_value))
+            elif value is not None:
+                version_values.append("{:.2f}".format(value))
             else:
                 version_values.append("n/a")
         values_matrix.append(version_values)
+    for variable in variables:
+        CurrentValue.objects.set_values(variable, new_values[variable.pk])
 
     context = {
         "quiz": quiz,
@@ -1043,15 +1041,15 @@ def get_question_results(request, **kwargs):
     #         values.append(value)
 
     try:
-        calculus_condition = Variable.objects.get(name="calculus_condition")
+        calculus_condition = Variable.objects.get_cached("calculus_condition")
     except Variable.DoesNotExist:
         calculus_condition = None
 
-    Grade = Variable.objects.get(name="quiz_grade")
+    Grade = Variable.objects.get_cached("quiz_grade")
     grades = Grade.get_data(context={"quiz": quiz})
 
     users = grades.values_list("user", flat=True)
-    rating = Variable.objects.get(name="student_rating")
+    rating = Variable.objects.get_cached("student_rating")
     user_ratings = Value.objects.filter(
         variable=rating,
         object_id__in=[version.pk for version in versions],
@@ -1152,7 +1150,7 @@ def question_comparison(request, **kwargs):
     version = Version.objects.get(pk=request.GET["version_id"])
 
     # get the rating variable and get all student ratings
-    rating = Variable.objects.get(name="student_rating")
+    rating = Variable.objects.get_cached("student_rating")
     rating_data = rating.get_data(context={"version": version})
 
     # get each user who provided a rating
@@ -1160,7 +1158,7 @@ def question_comparison(request, **kwargs):
 
     print(users)
 
-    grade = Variable.objects.get(name="quiz_grade")
+    grade = Variable.objects.get_cached("quiz_grade")
     # get the grades for the users who saw version = version_id on the new subsequent problem
     grade_data = Value.objects.filter(
         variable=grade, object_id=request.GET["quiz_id"], user__in=users
@@ -1187,8 +1185,8 @@ def calculus_comparison(request, **kwargs):
     arguments: start_problem, [list of following problems] in next_problems=2,3,4,5
 
     """
-    condition = Variable.objects.get(name="condition")
-    grade = Variable.objects.get(name="quiz_grade")
+    condition = Variable.objects.get_cached("condition")
+    grade = Variable.objects.get_cached("quiz_grade")
 
     week3q1quiz = Quiz.objects.get(pk=request.GET["start_problem"])  # quiz id
     week3q2quiz = Quiz.objects.get(pk=2)  # quiz id
@@ -1219,8 +1217,7 @@ def calculus_comparison(request, **kwargs):
                     {"version": version}
                 ).first()  # 1 = short, 2 = long
                 ratings = (
-                    Variable.objects.filter(name="student_rating")
-                    .first()
+                    Variable.objects.get_cached("student_rating", first=True)
                     .get_data({"quiz": quiz, "version": version})
                     .all()
                 )
@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.shortcuts import redirect, render
 from engine.models import *
 from ltilib.utils import grade_passback
@@ -93,9 +94,12 @@ def answer(request, answer_id):
             rate_explanation_form = RateExplanationForm(request.POST)
 
             rating = rate_explanation_form.save(commit=False)
-            rating.variable_id = Variable.objects.get(name="version_rating").id
+            rating.variable_id = Variable.objects.get_cached("version_rating").id
             rating.user = request.user
-            rating.save()
+            # the rating and its summary are saved together or not at all
+            with transaction.atomic():
+                rating.save()
+                ValueSummary.objects.record_value(rating)
 
             # get response
             Response.objects.filter(user=request.user, answer=answer).last()